@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# coding: utf8
+
+import os
+import time
+import shutil
+import random
+import logging
+from pytsdb import TSDB
+from pytsdb.models import ItemType
+
+SENSORS = 10
+POINTS = 10000
+PATCH_SIZE = 10
+QUERIES = 100
+QUERY_LENGTH = 500
+DIRECTORY = "bench_bucketsize"
+BUCKET_BYTES = [256, 1024, 4096, 16384, 65536]
+
+STORAGES = [
+    ("memory", {}),
+    ("sqlite", {"SQLITE_FILE": os.path.join(DIRECTORY, "bench.db3")}),
+    ("mmap", {"MMAP_DIRECTORY": os.path.join(DIRECTORY, "mmap")}),
+]
+
+
+def ingestTest(db, points, patch):
+    t = time.time()
+    for i in range(0, points, patch):
+        for s in range(SENSORS):
+            d = [((i + x) * 60, float(random.randint(20, 25)))
+                 for x in range(patch)]
+            db.insert("sensor{}.temp".format(s), d)
+    return (time.time() - t) / (points // patch * SENSORS)
+
+
+def queryTest(db, queries, length):
+    t = time.time()
+    for _ in range(queries):
+        key = "sensor{}.temp".format(random.randint(0, SENSORS - 1))
+        start = random.randint(0, POINTS - length) * 60
+        db.query(key, start, start + length * 60)
+    return (time.time() - t) / queries
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+
+    for storage, settings in STORAGES:
+        for size in BUCKET_BYTES:
+            if os.path.isdir(DIRECTORY):
+                shutil.rmtree(DIRECTORY)
+            os.makedirs(DIRECTORY)
+            db = TSDB(STORAGE=storage, ENABLE_CACHING=False,
+                      ENABLE_EVENTS=False, BUCKET_DYNAMIC_BYTES=size,
+                      **settings)
+            if storage != "memory":
+                db.storage._createTable()
+
+            insert_latency = ingestTest(db, POINTS, PATCH_SIZE)
+            query_latency = queryTest(db, QUERIES, QUERY_LENGTH)
+            target = db.bucket_policy.sizes("sensor0.temp",
+                                            ItemType.raw_float)[0]
+            print("{}: {} bytes/bucket ({} points) - insert {:.3f}ms - "
+                  "query ({} points) {:.3f}ms".format(
+                      storage, size, target, insert_latency * 1000,
+                      QUERY_LENGTH, query_latency * 1000))
+            db.close()
+
+    shutil.rmtree(DIRECTORY)
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# coding: utf8
+
+import sys
+import time
+import subprocess
+
+RUNS = 10
+IMPORTS = [
+    "import pytsdb",
+    "import pytsdb; pytsdb.TSDB(ENABLE_CACHING=False, ENABLE_EVENTS=False)",
+    "import pytsdb; pytsdb.TSDB()",
+    "import pytsdb; pytsdb.FlaskTSDB(__import__('flask').Flask('x'))",
+]
+HEAVY = ["redis", "flask", "cassandra"]
+
+
+def importTime(code):
+    """Best wall time of a fresh interpreter running code (seconds)."""
+    best = None
+    for _ in range(RUNS):
+        t = time.time()
+        subprocess.check_call([sys.executable, "-c", code])
+        t = time.time() - t
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def loadedModules(code):
+    check = "; import sys; print(' '.join(m for m in {!r} " \
+            "if m in sys.modules))".format(HEAVY)
+    out = subprocess.check_output([sys.executable, "-c", code + check])
+    return out.decode("utf-8").strip()
+
+
+def importTimeDetail(code):
+    """Cumulative import time per top level module from -X importtime."""
+    p = subprocess.Popen([sys.executable, "-X", "importtime", "-c", code],
+                         stderr=subprocess.PIPE)
+    _, err = p.communicate()
+    res = {}
+    for line in err.decode("utf-8").splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [x.strip() for x in line[12:].split("|")]
+        if not parts[1].isdigit():
+            continue
+        name = parts[2].strip().split(".")[0]
+        if parts[2] == parts[2].lstrip() or name in HEAVY + ["pytsdb"]:
+            res[name] = max(res.get(name, 0), int(parts[1]))
+    return res
+
+
+if __name__ == '__main__':
+    baseline = importTime("pass")
+    print("Interpreter startup: {:.1f}ms".format(baseline * 1000))
+    for code in IMPORTS:
+        t = importTime(code)
+        print("{}: {:.1f}ms (+{:.1f}ms) loaded: [{}]".format(
+            code, t * 1000, (t - baseline) * 1000, loadedModules(code)))
+    if sys.version_info >= (3, 7):
+        detail = importTimeDetail(IMPORTS[0])
+        for name in sorted(detail, key=detail.get, reverse=True)[:10]:
+            print("  {}: {}us".format(name, detail[name]))
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# coding: utf8
+
+import time
+import array
+import logging
+from pytsdb import TSDB
+
+POINTS = 100000
+BATCHES = 10
+
+
+def pointsInput(start):
+    return [(i, float(i)) for i in range(start, start + POINTS)]
+
+
+def arrayInput(start):
+    return (array.array("I", range(start, start + POINTS)),
+            array.array("f", range(start, start + POINTS)))
+
+
+def bytesInput(start):
+    ts, values = arrayInput(start)
+    return ts.tostring(), values.tostring()
+
+
+def numpyInput(start):
+    import numpy
+    ts = numpy.arange(start, start + POINTS, dtype="u4")
+    return ts, ts.astype("f4")
+
+
+def pointsTest(db, key, data):
+    db.insert(key, data)
+
+
+def columnsTest(db, key, data):
+    db.insert_columns(key, *data)
+
+
+TESTS = [
+    ("points", pointsInput, pointsTest),
+    ("array", arrayInput, columnsTest),
+    ("bytes", bytesInput, columnsTest),
+    ("numpy", numpyInput, columnsTest),
+]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    for name, make_input, test in TESTS:
+        try:
+            batches = [make_input(b * POINTS) for b in range(BATCHES)]
+        except ImportError:
+            print("{}: skipped".format(name))
+            continue
+        db = TSDB(STORAGE="memory", ENABLE_CACHING=False,
+                  ENABLE_EVENTS=False)
+        t = time.time()
+        for data in batches:
+            test(db, "ingest", data)
+        t = time.time() - t
+        assert(len(db.query("ingest", 0, POINTS * BATCHES)) ==
+               POINTS * BATCHES)
+        print("{}: {} x {} points - {:.3f}s - {:.0f} points/s".format(
+            name, BATCHES, POINTS, t, POINTS * BATCHES / t))
+        db.close()
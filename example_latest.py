@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# coding: utf8
+
+import os
+import time
+import logging
+from pytsdb import TSDB
+
+KEYS = 10000
+POINTS = 20
+SQLITE_FILE = "bench_latest.db3"
+
+SETUPS = [
+    ("memory", {"ENABLE_CACHING": False}),
+    ("sqlite", {"ENABLE_CACHING": False, "SQLITE_FILE": SQLITE_FILE}),
+    ("sqlite", {"ENABLE_CACHING": True, "SQLITE_FILE": SQLITE_FILE}),
+    ("sqlite", {"ENABLE_CACHING": True, "LATEST_LOCAL": True,
+                "SQLITE_FILE": SQLITE_FILE}),
+]
+
+
+def ingestTest(db, keys):
+    for key in keys:
+        db.insert(key, [(i * 60, float(i)) for i in range(POINTS)])
+
+
+def queryTest(db, keys):
+    # Current value with a guessed range
+    return [db.query(key, (POINTS - 5) * 60, POINTS * 60)[-1] for key in keys]
+
+
+def lastValueTest(db, keys):
+    return [db.last_value(key) for key in keys]
+
+
+def lastValuesTest(db, keys):
+    return db.last_values(keys)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    keys = ["sensor{}.temp".format(i) for i in range(KEYS)]
+
+    for storage, settings in SETUPS:
+        if os.path.exists(SQLITE_FILE):
+            os.remove(SQLITE_FILE)
+        db = TSDB(STORAGE=storage, ENABLE_EVENTS=False, **settings)
+        if storage == "sqlite":
+            db.storage._createTable()
+        db.clear_cache()
+        ingestTest(db, keys)
+        name = "{} caching={} local={}".format(
+            storage, settings["ENABLE_CACHING"],
+            settings.get("LATEST_LOCAL", False))
+        for test in [queryTest, lastValueTest, lastValuesTest]:
+            t = time.time()
+            res = test(db, keys)
+            t = time.time() - t
+            assert(res[-1] == ((POINTS - 1) * 60, float(POINTS - 1)))
+            print("{}: {} - {} keys - {:.3f}s - {:.1f} us/key".format(
+                name, test.__name__, KEYS, t, t / KEYS * 1e6))
+        db.clear_cache()
+        db.close()
+
+    if os.path.exists(SQLITE_FILE):
+        os.remove(SQLITE_FILE)
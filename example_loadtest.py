@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# coding: utf8
+
+import time
+import json
+import random
+import logging
+from flask import Flask
+from pytsdb import FlaskTSDB
+
+SENSORS = 10
+REQUESTS = 200
+PATCH_SIZE = 100
+TIME_OFFSET = int(time.time() - 365*24*60*60)
+TIME_OFFSET = TIME_OFFSET - (TIME_OFFSET % (24 * 60 * 60))
+
+
+app = Flask("loadtest")
+app.config.update(STORAGE="memory", ENABLE_CACHING=False, ENABLE_EVENTS=False)
+ext = FlaskTSDB(app)
+app.register_blueprint(ext.create_blueprint(), url_prefix="/tsdb")
+client = app.test_client()
+
+
+def ingestTest(requests, patch, fmt="json"):
+    points = 0
+    for i in range(requests):
+        key = "sensor{}.temp".format(i % SENSORS)
+        ts = TIME_OFFSET + (i // SENSORS) * patch * 60
+        d = [(ts + x * 60, float(random.randint(20, 25)))
+             for x in range(patch)]
+        if fmt == "json":
+            body = json.dumps({"key": key, "data": d})
+            content_type = "application/json"
+        else:
+            body = "\n".join("{} value={} {}".format(key, v, t) for t, v in d)
+            content_type = "text/plain"
+        r = client.post("/tsdb/ingest", data=body, content_type=content_type)
+        assert(r.status_code == 200)
+        points += patch
+    return points
+
+
+def queryTest(requests, fmt="json", gzip=False):
+    size = 0
+    headers = {"Accept-Encoding": "gzip"} if gzip else {}
+    for i in range(requests):
+        key = "sensor{}.temp".format(i % SENSORS)
+        r = client.get("/tsdb/query/{}?format={}".format(key, fmt),
+                       headers=headers)
+        assert(r.status_code == 200)
+        size += len(r.data)
+    return size
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+
+    for fmt in ["json", "line"]:
+        t = time.time()
+        points = ingestTest(REQUESTS, PATCH_SIZE, fmt)
+        t = time.time() - t
+        print("Ingest {}: {} requests - {}s - {} points/sec".format(
+            fmt, REQUESTS, t, points / t))
+
+    for fmt in ["json", "csv", "ndjson"]:
+        for gzip in [False, True]:
+            t = time.time()
+            size = queryTest(REQUESTS, fmt, gzip)
+            t = time.time() - t
+            print("Query {} (gzip: {}): {} requests - {}s - {} req/sec, "
+                  "{} bytes".format(fmt, gzip, REQUESTS, t, REQUESTS / t,
+                                    size))
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# coding: utf8
+
+import sys
+import time
+import random
+import logging
+from pytsdb.models import Item
+from pytsdb.storage import MemoryStorage
+
+POINTS = 1000000
+BUCKET_SIZE = 100
+BUCKETS = 100000
+OPERATIONS = 10000
+
+
+def storageSize(storage):
+    size = sys.getsizeof(storage.cache) + sys.getsizeof(storage.range_keys)
+    for key, blobs in storage.cache.items():
+        size += sys.getsizeof(blobs) + sys.getsizeof(storage.range_keys[key])
+        size += sum(sys.getsizeof(b) for b in blobs)
+    return size
+
+
+def itemSize(item):
+    size = sys.getsizeof(item) + sys.getsizeof(item._timestamps)
+    return size + sys.getsizeof(item._values)
+
+
+def memoryTest(points, bucket_size):
+    storage = MemoryStorage()
+    items = []
+    for b in range(points // bucket_size):
+        i = Item("mem", [(b * bucket_size + x, float(x))
+                         for x in range(bucket_size)])
+        storage.insert(i)
+        items.append(i)
+    return storageSize(storage), sum(itemSize(i) for i in items)
+
+
+def latencyTest(buckets, operations):
+    storage = MemoryStorage()
+    blob = Item("lat", [(0, 1.0)]).to_string()
+    t = time.time()
+    for b in range(buckets):
+        storage._insert("lat", b * 10, blob)
+    res = {"insert (append)": (time.time() - t) / buckets}
+
+    keys = [b * 10 for b in random.sample(range(buckets), operations)]
+    ops = [
+        ("get", lambda k: storage._get("lat", k)),
+        ("left", lambda k: storage._left("lat", k + 5)),
+        ("query (10 buckets)", lambda k: storage._query("lat", k, k + 99)),
+        ("update", lambda k: storage._update("lat", k, blob)),
+        ("insert (middle)", lambda k: storage._insert("lat", k + 5, blob)),
+    ]
+    for name, op in ops:
+        t = time.time()
+        for k in keys:
+            op(k)
+        res[name] = (time.time() - t) / operations
+    return res
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+
+    storage_size, item_size = memoryTest(POINTS, BUCKET_SIZE)
+    print("Memory per {} points (buckets of {}): storage {:.1f}MB, "
+          "decoded items {:.1f}MB".format(POINTS, BUCKET_SIZE,
+                                          storage_size / 1e6,
+                                          item_size / 1e6))
+
+    res = latencyTest(BUCKETS, OPERATIONS)
+    for name in sorted(res):
+        print("{} with {} buckets: {:.2f}us/op".format(name, BUCKETS,
+                                                       res[name] * 1e6))
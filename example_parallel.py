@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# coding: utf8
+
+import os
+import time
+import random
+import logging
+import multiprocessing
+from pytsdb.ingest import ParallelIngestor
+
+SENSORS = 100
+POINTS = 2000
+PATCH_SIZE = 100
+SQLITE_FILE = "bench_parallel.db3"
+
+STORAGES = [
+    ("memory", {}),
+    ("sqlite", {"SQLITE_FILE": SQLITE_FILE}),
+]
+
+
+def ingestTest(workers, storage, settings):
+    if os.path.exists(SQLITE_FILE):
+        os.remove(SQLITE_FILE)
+    if storage == "sqlite":
+        from pytsdb.storage import SQLiteStorage
+        s = SQLiteStorage(SQLITE_FILE)
+        s._createTable()
+        s.close()
+    ingestor = ParallelIngestor(workers=workers, STORAGE=storage,
+                                ENABLE_CACHING=False, ENABLE_EVENTS=False,
+                                **settings)
+    t = time.time()
+    for i in range(0, POINTS, PATCH_SIZE):
+        for s in range(SENSORS):
+            d = [((i + x) * 60, float(random.randint(20, 25)))
+                 for x in range(PATCH_SIZE)]
+            ingestor.insert("sensor{}.temp".format(s), d)
+    stats = ingestor.close()
+    t = time.time() - t
+    points = sum(s["points"] for s in stats)
+    assert(sum(s["errors"] for s in stats) == 0)
+    return points, t
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+
+    for storage, settings in STORAGES:
+        base = None
+        for workers in range(1, multiprocessing.cpu_count() + 1):
+            points, t = ingestTest(workers, storage, settings)
+            rate = points / t
+            base = base or rate
+            print("{}: {} workers - {} points - {}s - {} points/sec "
+                  "(x{:.2f})".format(storage, workers, points, t, rate,
+                                     rate / base))
+
+    if os.path.exists(SQLITE_FILE):
+        os.remove(SQLITE_FILE)
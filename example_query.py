@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# coding: utf8
+
+import os
+import time
+import shutil
+import logging
+from pytsdb import TSDB
+
+POINTS = 200000
+INTERVAL = 600
+PATCH_SIZE = 1000
+QUERIES = 10
+DIRECTORY = "bench_query"
+WORKERS = [1, 2, 4, 8]
+
+STORAGES = [
+    ("sqlite", {"SQLITE_FILE": os.path.join(DIRECTORY, "bench.db3")}),
+    ("mmap", {"MMAP_DIRECTORY": os.path.join(DIRECTORY, "mmap")}),
+]
+
+
+def ingestTest(db, points, patch):
+    for i in range(0, points, patch):
+        d = [((i + x) * INTERVAL, float(x)) for x in range(patch)]
+        db.insert("sensor.temp", d)
+
+
+def queryTest(db, queries):
+    count = 0
+    for _ in range(queries):
+        count += len(db.query("sensor.temp", 0, POINTS * INTERVAL))
+    return count
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    if os.path.isdir(DIRECTORY):
+        shutil.rmtree(DIRECTORY)
+    os.makedirs(DIRECTORY)
+
+    for storage, settings in STORAGES:
+        db = TSDB(STORAGE=storage, ENABLE_CACHING=False, ENABLE_EVENTS=False,
+                  **settings)
+        db.storage._createTable()
+        ingestTest(db, POINTS, PATCH_SIZE)
+        db.close()
+
+        base = None
+        for workers in WORKERS:
+            db = TSDB(STORAGE=storage, ENABLE_CACHING=False,
+                      ENABLE_EVENTS=False, QUERY_WORKERS=workers,
+                      QUERY_PARTITION=7 * 24 * 60 * 60, **settings)
+            t = time.time()
+            count = queryTest(db, QUERIES)
+            t = time.time() - t
+            base = base or t
+            print("{}: {} workers - {} queries ({} points) - {}s - "
+                  "{} points/sec (x{:.2f})".format(
+                      storage, workers, QUERIES, count // QUERIES, t,
+                      count / t, base / t))
+            db.close()
+
+    shutil.rmtree(DIRECTORY)
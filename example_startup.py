@@ -0,0 +1,36 @@
+#!/usr/bin/python
+# coding: utf8
+
+import time
+import logging
+from pytsdb import TSDB
+
+CLIENTS = 1000
+
+
+def startupTest(clients, **kwargs):
+    dbs = []
+    t = time.time()
+    for _ in range(clients):
+        dbs.append(TSDB(**kwargs))
+    t_create = time.time() - t
+    t = time.time()
+    for db in dbs:
+        db.close()
+    t_close = time.time() - t
+    return t_create, t_close
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+
+    setups = [
+        {"STORAGE": "memory", "ENABLE_CACHING": False,
+         "ENABLE_EVENTS": False},
+        {"STORAGE": "memory"},
+        {"STORAGE": "sqlite", "SQLITE_FILE": "startup.db3"},
+    ]
+    for settings in setups:
+        t_create, t_close = startupTest(CLIENTS, **settings)
+        print("{}: {} clients - create {}s ({}ms/client) - close {}s".format(
+            settings, CLIENTS, t_create, t_create * 1000 / CLIENTS, t_close))
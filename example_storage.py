@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# coding: utf8
+
+import os
+import time
+import shutil
+import random
+import logging
+from pytsdb import TSDB
+
+SENSORS = 10
+POINTS = 20000
+PATCH_SIZE = 10
+QUERIES = 100
+DIRECTORY = "bench_storage"
+
+STORAGES = [
+    ("sqlite", {"SQLITE_FILE": os.path.join(DIRECTORY, "bench.db3")}),
+    ("mmap", {"MMAP_DIRECTORY": os.path.join(DIRECTORY, "mmap")}),
+    ("lsm", {"LSM_DIRECTORY": os.path.join(DIRECTORY, "lsm")}),
+]
+
+
+def ingestTest(db, points, patch):
+    for i in range(0, points, patch):
+        for s in range(SENSORS):
+            d = [((i + x) * 60, float(random.randint(20, 25)))
+                 for x in range(patch)]
+            db.insert("sensor{}.temp".format(s), d)
+    return points * SENSORS
+
+
+def queryTest(db, queries, length):
+    count = 0
+    for _ in range(queries):
+        key = "sensor{}.temp".format(random.randint(0, SENSORS - 1))
+        start = random.randint(0, POINTS - length) * 60
+        count += len(db.query(key, start, start + length * 60))
+    return count
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    if os.path.isdir(DIRECTORY):
+        shutil.rmtree(DIRECTORY)
+    os.makedirs(DIRECTORY)
+
+    for storage, settings in STORAGES:
+        db = TSDB(STORAGE=storage, ENABLE_CACHING=False, ENABLE_EVENTS=False,
+                  **settings)
+        db.storage._createTable()
+
+        t = time.time()
+        points = ingestTest(db, POINTS, PATCH_SIZE)
+        t = time.time() - t
+        print("{}: ingest {} points (patch {}) - {}s - {} points/sec".format(
+            storage, points, PATCH_SIZE, t, points / t))
+
+        for length in [100, 10000]:
+            t = time.time()
+            count = queryTest(db, QUERIES, length)
+            t = time.time() - t
+            print("{}: {} range reads of {} points - {}s - {} points/sec"
+                  .format(storage, QUERIES, length, t, count / t))
+        db.close()
+
+    shutil.rmtree(DIRECTORY)
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# coding: utf8
+
+import time
+import logging
+from pytsdb import TSDB
+from pytsdb.models import Item, ItemType
+
+POINTS = 1000000
+BATCH = 10000
+
+
+def ingestTest(db):
+    for start in range(0, POINTS, BATCH):
+        db.insert("tuple", [(i, (i * 1.0, i * 2.0, i * 3.0, i * 4.0))
+                            for i in range(start, start + BATCH)])
+
+
+def queryTest(db):
+    return db.query("tuple", 0, POINTS)
+
+
+def pointsTest(res):
+    # One tuple per point
+    return sum(v[3] for _, v in res.all())
+
+
+def columnsTest(res):
+    # Column access, no per point objects
+    return sum(res.column(4))
+
+
+def resampleTest(res):
+    return res.resample(60, "previous")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    # New series are created as tuple_float_4
+    Item.DEFAULT_ITEMTYPE = ItemType.tuple_float_4
+    db = TSDB(STORAGE="memory", ENABLE_CACHING=False, ENABLE_EVENTS=False,
+              BUCKET_DYNAMIC_TARGET=1000, BUCKET_DYNAMIC_MAX=2000)
+
+    t = time.time()
+    ingestTest(db)
+    t = time.time() - t
+    print("ingest: {} points - {:.3f}s - {:.0f} points/s".format(
+        POINTS, t, POINTS / t))
+
+    t = time.time()
+    res = queryTest(db)
+    t = time.time() - t
+    assert(len(res) == POINTS)
+    print("query: {} points - {:.3f}s - {:.0f} points/s".format(
+        len(res), t, len(res) / t))
+
+    for test in [pointsTest, columnsTest, resampleTest]:
+        t = time.time()
+        test(res)
+        t = time.time() - t
+        print("{}: {} points - {:.3f}s - {:.0f} points/s".format(
+            test.__name__, len(res), t, len(res) / t))
+    db.close()
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# coding: utf8
+
+import io
+import time
+import array
+import logging
+from pytsdb import TSDB
+from pytsdb.ingest import LineProtocolParser, BinaryParser, encode_frame
+from pytsdb.ingest import ingest_stream
+
+KEYS = 100
+POINTS = 10000
+FRAME = 100
+CHUNK = 65536
+
+
+def lineData():
+    lines = []
+    for start in range(0, POINTS, FRAME):
+        for k in range(KEYS):
+            lines += ["sensor{}.temp value={} {}\n".format(k, float(i), i)
+                      for i in range(start, start + FRAME)]
+    return "".join(lines).encode("utf-8")
+
+
+def binaryData():
+    frames = []
+    for start in range(0, POINTS, FRAME):
+        ts = array.array("I", range(start, start + FRAME))
+        values = array.array("f", range(start, start + FRAME))
+        for k in range(KEYS):
+            frames.append(encode_frame("sensor{}.temp".format(k), ts, values))
+    return b"".join(frames)
+
+
+def parseTest(data, parser):
+    for i in range(0, len(data), CHUNK):
+        parser.feed(data[i:i + CHUNK])
+    parser.flush()
+    return parser.metrics["points"]
+
+
+def ingestTest(data, parser):
+    db = TSDB(STORAGE="memory", ENABLE_CACHING=False, ENABLE_EVENTS=False)
+    f = io.BytesIO(data)
+    stats = ingest_stream(db, lambda: f.read(CHUNK), parser,
+                          batch_points=100000)
+    db.close()
+    return stats["points"]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    for name, data, parser in [("line", lineData(), LineProtocolParser),
+                               ("binary", binaryData(), BinaryParser)]:
+        for test in [parseTest, ingestTest]:
+            t = time.time()
+            points = test(data, parser())
+            t = time.time() - t
+            assert(points == KEYS * POINTS)
+            print("{}: {} - {} points - {:.1f} MB - {:.3f}s - "
+                  "{:.0f} points/s".format(name, test.__name__, points,
+                                           len(data) / 1e6, t, points / t))
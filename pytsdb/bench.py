@@ -0,0 +1,358 @@
+#!/usr/bin/python
+# coding: utf8
+
+from __future__ import unicode_literals
+
+import os
+import sys
+import json
+import time
+import array
+import random
+import shutil
+import logging
+import platform
+import tempfile
+
+from .client import TSDB
+from .models import Item, ResultSet
+
+logger = logging.getLogger(__name__)
+
+clock = getattr(time, "perf_counter", time.time)
+
+# Sizes at scale 1.0
+KEYS = 20
+POINTS = 5000
+BATCH = 100
+QUERIES = 200
+
+
+# Backends, every factory returns (TSDB, cleanup function)
+
+def _settings(**kwargs):
+    settings = {"ENABLE_CACHING": False, "ENABLE_EVENTS": False}
+    settings.update(kwargs)
+    return settings
+
+
+def _memory():
+    return TSDB(STORAGE="memory", **_settings()), None
+
+
+def _sqlite():
+    directory = tempfile.mkdtemp(prefix="pytsdb-bench-")
+    db = TSDB(STORAGE="sqlite", **_settings(
+        SQLITE_FILE=os.path.join(directory, "bench.db3")))
+    db.storage._createTable()
+    return db, lambda: shutil.rmtree(directory)
+
+
+def _directory(storage, setting):
+    def factory():
+        directory = tempfile.mkdtemp(prefix="pytsdb-bench-")
+        db = TSDB(STORAGE=storage, **_settings(**{
+            setting: os.path.join(directory, storage)}))
+        return db, lambda: shutil.rmtree(directory)
+    return factory
+
+
+def _redis():
+    from .storage import RedisStorage
+    from .testing import FakeRedis
+    db = TSDB(STORAGE="memory", **_settings())
+    db.storage = RedisStorage(redis=FakeRedis())
+    return db, None
+
+
+def _cassandra():
+    from .storage import CassandraStorage
+    from .testing import FakeCassandraSession
+    db = TSDB(STORAGE="memory", **_settings())
+    db.storage = CassandraStorage(session=FakeCassandraSession())
+    db.storage._createTable()
+    return db, None
+
+
+def _cached():
+    """Memory storage with the redis cache (FakeRedis).
+    """
+    from .cache import RedisLRU
+    from .testing import FakeRedis
+    db = TSDB(STORAGE="memory", **_settings())
+    db.cache = RedisLRU(redis=FakeRedis())
+    for namespace in ["last_item", "data_stats", "latest"]:
+        db.cache.setup_namespace(namespace, 1000)
+    db.settings["ENABLE_CACHING"] = True
+    return db, None
+
+
+BACKENDS = {
+    "memory": _memory,
+    "sqlite": _sqlite,
+    "mmap": _directory("mmap", "MMAP_DIRECTORY"),
+    "lsm": _directory("lsm", "LSM_DIRECTORY"),
+    "redis": _redis,
+    "cassandra": _cassandra,
+    "cached": _cached,
+}
+
+
+# Benchmarks, every function prepares a db and returns (run, ops)
+
+def _keys(scale):
+    return ["bench{}.value".format(i)
+            for i in range(max(1, int(KEYS * scale)))]
+
+
+def _points(scale):
+    return max(2 * BATCH, int(POINTS * scale))
+
+
+def _fill(db, scale):
+    keys = _keys(scale)
+    points = _points(scale)
+    for key in keys:
+        for start in range(0, points, BATCH):
+            db.insert(key, [(i * 10, float(i)) for i in range(start,
+                                                              start + BATCH)])
+    return keys, points
+
+
+def ingest_append(db, scale):
+    keys = _keys(scale)
+    points = _points(scale)
+    batches = [[(i * 10, float(i)) for i in range(start, start + BATCH)]
+               for start in range(0, points, BATCH)]
+
+    def run():
+        for batch in batches:
+            for key in keys:
+                db.insert(key, batch)
+    return run, len(keys) * points
+
+
+def ingest_out_of_order(db, scale):
+    keys = _keys(scale)
+    points = _points(scale)
+    batches = [[(i * 10, float(i)) for i in range(start, start + BATCH)]
+               for start in range(0, points, BATCH)]
+    # Every second batch is backfilled in random order
+    for batch in batches[0::2]:
+        for key in keys:
+            db.insert(key, batch)
+    backfill = batches[1::2]
+    random.Random(1).shuffle(backfill)
+
+    def run():
+        for batch in backfill:
+            for key in keys:
+                db.insert(key, batch)
+    return run, len(keys) * len(backfill) * BATCH
+
+
+def ingest_bulk(db, scale):
+    keys = _keys(scale)
+    points = _points(scale)
+    bulks = [[{"key": key, "data": [(i * 10, float(i))
+                                    for i in range(start, start + BATCH)]}
+              for key in keys]
+             for start in range(0, points, BATCH)]
+
+    def run():
+        for bulk in bulks:
+            db.insert_bulk(bulk)
+    return run, len(keys) * points
+
+
+def ingest_columns(db, scale):
+    keys = _keys(scale)
+    points = _points(scale)
+    ts = array.array(str("I"), range(0, points * 10, 10))
+    values = array.array(str("f"), range(points))
+
+    def run():
+        for key in keys:
+            db.insert_columns(key, ts, values)
+    return run, len(keys) * points
+
+
+def query_short(db, scale):
+    keys, points = _fill(db, scale)
+    rnd = random.Random(1)
+    queries = [(rnd.choice(keys), rnd.randint(0, points - 100) * 10)
+               for _ in range(max(1, int(QUERIES * scale)))]
+
+    def run():
+        for key, ts in queries:
+            db.query(key, ts, ts + 600)
+    return run, len(queries)
+
+
+def query_long(db, scale):
+    keys, points = _fill(db, scale)
+
+    def run():
+        for key in keys:
+            db.query(key, 0, points * 10)
+    return run, len(keys) * points
+
+
+def query_multi(db, scale):
+    keys, points = _fill(db, scale)
+    ranges = [(ts, ts + 6000) for ts in range(0, points * 10, points)]
+
+    def run():
+        for ts_min, ts_max in ranges:
+            for key in keys:
+                db.query(key, ts_min, ts_max)
+            db.last_values(keys)
+    return run, len(ranges) * len(keys)
+
+
+def aggregation(db, scale):
+    keys, points = _fill(db, scale)
+    results = [db.query(key, 0, points * 10) for key in keys]
+
+    def run():
+        for r in results:
+            list(r.aggregation("hourly", "mean"))
+            r.resample(600, "linear")
+    return run, len(keys) * points
+
+
+def encode_decode(db, scale):
+    keys, points = _fill(db, scale)
+    items = []
+    for key in keys:
+        items += db.storage.query(key, 0, points * 10)
+
+    def run():
+        for item in items:
+            Item.from_string(item.key, item.to_string())
+        ResultSet(keys[0], [i for i in items if i.key == keys[0]])
+    return run, sum(len(i) for i in items)
+
+
+def cache_hits(db, scale):
+    keys, _ = _fill(db, scale)
+    # Warm the cache
+    db.stats_bulk(keys)
+    db.last_values(keys)
+    repeat = max(1, int(QUERIES * scale) // len(keys))
+
+    def run():
+        for _ in range(repeat):
+            for key in keys:
+                db.stats(key)
+                db.last_value(key)
+    return run, repeat * len(keys) * 2
+
+
+BENCHMARKS = [ingest_append, ingest_out_of_order, ingest_bulk, ingest_columns,
+              query_short, query_long, query_multi, aggregation,
+              encode_decode, cache_hits]
+
+# Benchmarks of the models only run once (on memory), the cache hit
+# path only with the cache
+ONLY = {"aggregation": ["memory"], "encode_decode": ["memory"],
+        "cache_hits": ["cached"]}
+
+
+def run(backends=None, benchmarks=None, scale=1.0, repeat=3):
+    """Run the benchmarks on the backends, returns the results (JSON
+    serializable). Every benchmark runs repeat times on a new db, the
+    fastest run counts.
+    """
+    backends = backends or sorted(BACKENDS)
+    benchmarks = benchmarks or [b.__name__ for b in BENCHMARKS]
+    results = {}
+    for backend in backends:
+        for bench in BENCHMARKS:
+            name = bench.__name__
+            if name not in benchmarks:
+                continue
+            if backend not in ONLY.get(name, [backend]):
+                continue
+            best = None
+            for _ in range(repeat):
+                db, cleanup = BACKENDS[backend]()
+                try:
+                    func, ops = bench(db, scale)
+                    t = clock()
+                    func()
+                    t = clock() - t
+                finally:
+                    db.close()
+                    if cleanup is not None:
+                        cleanup()
+                best = t if best is None else min(best, t)
+            result = {"seconds": best, "ops": ops,
+                      "ops_per_second": ops / best if best > 0 else 0.0}
+            results["{}.{}".format(backend, name)] = result
+            logger.info("{}.{}: {:.0f} ops/s".format(
+                backend, name, result["ops_per_second"]))
+    return {"python": platform.python_version(), "scale": scale,
+            "time": int(time.time()), "results": results}
+
+
+def compare(results, baseline, threshold=0.2):
+    """Regressions of results against a baseline: every benchmark of
+    both with ops_per_second more than threshold (relative) below the
+    baseline. Returns a list of (name, baseline, current) tuples.
+    """
+    if results.get("scale") != baseline.get("scale"):
+        raise ValueError("results of different scales")
+    regressions = []
+    for name, base in sorted(baseline["results"].items()):
+        current = results["results"].get(name)
+        if current is None:
+            continue
+        limit = base["ops_per_second"] * (1 - threshold)
+        if current["ops_per_second"] < limit:
+            regressions.append((name, base["ops_per_second"],
+                                current["ops_per_second"]))
+    return regressions
+
+
+def main(argv=None):
+    """Run the pytsdb benchmarks, optionally against a baseline.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m pytsdb.bench",
+                                     description=main.__doc__)
+    parser.add_argument("--backend", action="append",
+                        choices=sorted(BACKENDS))
+    parser.add_argument("--benchmark", action="append",
+                        choices=[b.__name__ for b in BENCHMARKS])
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the results (JSON)")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="results (JSON) to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown against the baseline")
+    args = parser.parse_args(argv)
+
+    results = run(args.backend, args.benchmark, args.scale, args.repeat)
+    for name, r in sorted(results["results"].items()):
+        print("{:<32} {:>12.0f} ops/s {:>9.3f}s".format(
+            name, r["ops_per_second"], r["seconds"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, base, current in regressions:
+            print("REGRESSION {}: {:.0f} -> {:.0f} ops/s".format(
+                name, base, current))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
@@ -6,7 +6,6 @@ from __future__ import unicode_literals
 import logging
 import time
 #import json
-from redis import StrictRedis as Redis
 
 logger = logging.getLogger(__name__)
 
@@ -16,11 +15,22 @@ class RedisLRU(object):
         if redis is not None:
             self._redis = redis
         else:
+            from redis import StrictRedis as Redis
             self._redis = Redis(**kwargs)
         self.namespaces = {
             "default": 10000
         }
 
+    def ping(self):
+        """Health check, returns True if redis is reachable.
+        """
+        try:
+            self._redis.ping()
+        except Exception as e:
+            logger.warning("Redis ping failed: {}".format(e))
+            return False
+        return True
+
     def setup_namespace(self, namespace, size):
         """Set the LRU Size for a namespace.
         """
@@ -55,7 +65,7 @@ class RedisLRU(object):
         if count >= size:
             values = self._value_store(namespace)
             items = self._redis.zrange(hits, 0, count-size)
-            logger.error(items)
+            logger.debug("Cache evicted: %s", items)
             self._redis.zremrangebyrank(hits, 0, count-size)
             self._redis.hdel(values, *items)
 
@@ -99,6 +109,41 @@ class RedisLRU(object):
             return self._unserialize(value)
         return None
 
+    def get_many(self, keys, namespace="default", touch=True):
+        """Get several values in one round trip (None if not found).
+        Without touch the hits are not moved up in the LRU.
+        """
+        if not keys:
+            return []
+        values = self._value_store(namespace)
+        res = self._redis.hmget(values, keys)
+        if not touch:
+            return [self._unserialize(v) if v else None for v in res]
+        hits = []
+        now = time.time()
+        for key, value in zip(keys, res):
+            if value:
+                hits += [now, key]
+        if hits:
+            self._redis.zadd(self._hit_store(namespace), *hits)
+        return [self._unserialize(v) if v else None for v in res]
+
+    def store_many(self, items, namespace="default"):
+        """Store several (key, value) pairs in one round trip.
+        """
+        if not items:
+            return
+        self._expire_old(namespace)
+        hits = []
+        now = time.time()
+        for key, _ in items:
+            hits += [now, key]
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hmset(self._value_store(namespace),
+                   dict((k, self._serialize(v)) for k, v in items))
+        pipe.zadd(self._hit_store(namespace), *hits)
+        pipe.execute()
+
     def expire(self, key, namespace="default"):
         """Expire (invalidate) a key from the cache.
         """
@@ -2,69 +2,166 @@
 # coding: utf8
 from __future__ import unicode_literals
 import re
+import os
+import bisect
 import logging
-import redis
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
 
 from .storage import MemoryStorage, RedisStorage, CassandraStorage, SQLiteStorage
-from .events import RedisPubSub
-from .models import Item, ResultSet, BucketType, Stats
-from .cache import RedisLRU
+from .storage import MMapStorage
+from .models import Item, ResultSet, BucketType, Stats, BucketPolicy
+from .models import as_of_join, Resampler, _sort_columns
 from .errors import NotFoundError
+from .resources import registry
+from .metrics import clock, create_metrics
 
 
 logger = logging.getLogger(__name__)
 
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_\-\.]+$')
+
 
 class TSDB(object):
+    KNOWN_KEYS_MAX = 100000
+    # Buckets (of the target size) per compaction step
+    COMPACTION_WINDOW = 64
+
     def __init__(self, STORAGE="memory", **kwargs):
         self.settings = {
             "BUCKET_TYPE": "dynamic",
             "BUCKET_DYNAMIC_TARGET": 100,
             "BUCKET_DYNAMIC_MAX": 200,
+            "BUCKET_DYNAMIC_BYTES": None,
+            "BUCKET_POLICIES": {},
+            "BUCKET_ADAPTIVE": False,
             "REDIS_PORT": 6379,
             "REDIS_HOST": "localhost",
             "REDIS_DB": 0,
             "SQLITE_FILE": "pytsdb.db3",
+            "MMAP_DIRECTORY": "pytsdb_data",
+            "LSM_DIRECTORY": "pytsdb_lsm",
             "CASSANDRA_PORT": 9042,
             "CASSANDRA_HOST": "localhost",
+            "CASSANDRA_PARTITION": None,
             "ENABLE_CACHING": True,
-            "ENABLE_EVENTS": True
+            "ENABLE_EVENTS": True,
+            "EVENT_BACKEND": "pubsub",
+            "EVENT_BATCH_WINDOW": None,
+            "EVENT_BINARY": False,
+            "ENABLE_COMPACTION": False,
+            "COMPACTION_DELAY": 60,
+            "RETENTION": {},
+            "RETENTION_INTERVAL": 3600,
+            "QUERY_WORKERS": 1,
+            "QUERY_PARTITION": 30 * 24 * 60 * 60,
+            "LATEST_CACHE_SIZE": 10000,
+            "LATEST_LOCAL": False,
+            "CONTINUOUS_QUERIES": [],
+            "CONTINUOUS_QUERIES_SYNC": True,
+            "SHARDS": {},
+            "SHARD_REPLICAS": 100,
+            "METRICS": None,
+            "METRICS_PREFIX": "pytsdb",
+            "STATSD_HOST": "localhost",
+            "STATSD_PORT": 8125
         }
         self.settings.update(kwargs)
+        self.settings["STORAGE"] = STORAGE
+
+        # Bucket Model of this instance
+        self.bucket_type = BucketType[self.settings["BUCKET_TYPE"]]
+
+        # Shared resources (released on close)
+        self._resources = []
+        self._query_pool = None
+
+        # Validated keys (key -> lower case key)
+        self._known_keys = {}
 
-        # Setup Item Model
-        Item.DYNAMICSIZE_TARGET = self.settings["BUCKET_DYNAMIC_TARGET"]
-        Item.DYNAMICSIZE_MAX = self.settings["BUCKET_DYNAMIC_MAX"]
-        Item.DEFAULT_BUCKETTYPE = BucketType[self.settings["BUCKET_TYPE"]]
+        # Write locks of the keys in use (key -> [lock, users])
+        self._key_locks = {}
+        self._key_locks_lock = threading.Lock()
 
-        # Setup Redis Pool
-        self.redis_pool = redis.ConnectionPool(host=self.settings["REDIS_HOST"],
-                                               port=self.settings["REDIS_PORT"],
-                                               db=self.settings["REDIS_DB"])
+        # Setup Redis Pool (redis is only imported if needed)
+        self.redis_pool = None
+        if self.settings["ENABLE_EVENTS"] or self.settings["ENABLE_CACHING"]:
+            self.redis_pool = self._redis_pool(self.settings)
 
         # Setup Storage
-        if STORAGE == "memory":
-            self.storage = MemoryStorage()
-        elif STORAGE == "sqlite":
-            self.storage = SQLiteStorage(self.settings["SQLITE_FILE"])
-        elif STORAGE == "redis":
-            self.storage = RedisStorage(connection_pool=self.redis_pool)
-        elif STORAGE == "cassandra":
-            self.storage = CassandraStorage(
-                contact_points=[self.settings["CASSANDRA_HOST"]],
-                port=self.settings["CASSANDRA_PORT"])
-        else:
-            raise NotImplementedError("Storage not implemented")
+        self.storage = self._create_storage(STORAGE, self.settings)
+
+        # Hot path metrics (None if disabled, checked before every use).
+        # Storages can be shared, they get the metrics per write.
+        self.metrics = create_metrics(self.settings)
+
+        # Bucket sizes (points or a byte budget, "auto" per storage)
+        target_bytes = self.settings["BUCKET_DYNAMIC_BYTES"]
+        if target_bytes == "auto":
+            target_bytes = self.storage.BUCKET_BYTES
+        self.bucket_policy = BucketPolicy(
+            target=self.settings["BUCKET_DYNAMIC_TARGET"],
+            max_size=self.settings["BUCKET_DYNAMIC_MAX"],
+            target_bytes=target_bytes,
+            series=self.settings["BUCKET_POLICIES"],
+            adaptive=self.settings["BUCKET_ADAPTIVE"])
 
         # Event Class
         if self.settings["ENABLE_EVENTS"]:
-            self.events = RedisPubSub(connection_pool=self.redis_pool)
-
+            if self.settings["EVENT_BACKEND"] == "streams":
+                from .events import RedisStreams
+                self.events = RedisStreams(connection_pool=self.redis_pool)
+            else:
+                from .events import RedisPubSub
+                # Events are coalesced per key with a batch window
+                self.events = RedisPubSub(
+                    connection_pool=self.redis_pool,
+                    batch_window=self.settings["EVENT_BATCH_WINDOW"],
+                    binary=self.settings["EVENT_BINARY"])
+
+        # Cache keys are prefixed with the storage namespace,
+        # so there is no need to clear the shared cache on startup.
         if self.settings["ENABLE_CACHING"]:
+            from .cache import RedisLRU
             self.cache = RedisLRU(connection_pool=self.redis_pool)
             self.cache.setup_namespace("last_item", 1000)
             self.cache.setup_namespace("data_stats", 1000)
-            self.cache.clearAll()
+            self.cache.setup_namespace("latest",
+                                       self.settings["LATEST_CACHE_SIZE"])
+
+        # Latest point per key in process (only valid if this instance
+        # is the only writer of its keys)
+        self._latest = None
+        if self.settings["LATEST_LOCAL"]:
+            self._latest = OrderedDict()
+
+        # Background compaction of keys with out of order inserts
+        self.compactor = None
+        if self.settings["ENABLE_COMPACTION"]:
+            from .compaction import Compactor
+            self.compactor = Compactor(self,
+                                       delay=self.settings["COMPACTION_DELAY"])
+            self.compactor.start()
+
+        # Retention policies (key or "prefix*" -> max age in seconds)
+        self.retention = None
+        if self.settings["RETENTION"]:
+            from .retention import RetentionWorker
+            self.retention = RetentionWorker(
+                self, interval=self.settings["RETENTION_INTERVAL"])
+            for pattern, max_age in self.settings["RETENTION"].items():
+                self.retention.add_policy(pattern, max_age)
+            self.retention.start()
+
+        # Aggregates materialized on insert (or from data events)
+        self.continuous = None
+        if self.settings["CONTINUOUS_QUERIES"]:
+            from .continuous import ContinuousQueries
+            self.continuous = ContinuousQueries(
+                self, sync=self.settings["CONTINUOUS_QUERIES_SYNC"])
+            for q in self.settings["CONTINUOUS_QUERIES"]:
+                self.continuous.add(**q)
 
     def _register_data_listener(self, key, callback):
         if not self.settings["ENABLE_EVENTS"]:
@@ -73,6 +170,9 @@ class TSDB(object):
 
     def _event(self, key, stats):
         if self.settings["ENABLE_EVENTS"]:
+            m = self.metrics
+            if m is not None:
+                t = clock()
             self.events.publish_event(key=key,
                                       ts_min=stats["ts_min"],
                                       ts_max=stats["ts_max"],
@@ -80,29 +180,137 @@ class TSDB(object):
                                       appended=stats["appended"],
                                       inserted=stats["inserted"],
                                       updated=stats["updated"],
-                                      deleted=0)
+                                      deleted=stats.get("deleted", 0))
+            if m is not None:
+                m.timing("event_publish", clock() - t)
+
+    def _redis_pool(self, settings):
+        import redis
+        return self._acquire(
+            ("redis", settings["REDIS_HOST"], settings["REDIS_PORT"],
+             settings["REDIS_DB"]),
+            lambda: redis.ConnectionPool(host=settings["REDIS_HOST"],
+                                         port=settings["REDIS_PORT"],
+                                         db=settings["REDIS_DB"]))
+
+    def _create_storage(self, storage, settings):
+        if storage == "memory":
+            return MemoryStorage()
+        elif storage == "sqlite":
+            filepath = os.path.abspath(settings["SQLITE_FILE"])
+            return self._acquire(
+                ("sqlite", filepath), lambda: SQLiteStorage(filepath))
+        elif storage == "mmap":
+            directory = os.path.abspath(settings["MMAP_DIRECTORY"])
+            return self._acquire(
+                ("mmap", directory), lambda: MMapStorage(directory))
+        elif storage == "lsm":
+            from .lsm import LSMStorage
+            directory = os.path.abspath(settings["LSM_DIRECTORY"])
+            return self._acquire(
+                ("lsm", directory), lambda: LSMStorage(directory))
+        elif storage == "redis":
+            return RedisStorage(connection_pool=self._redis_pool(settings))
+        elif storage == "cassandra":
+            return self._acquire(
+                ("cassandra", settings["CASSANDRA_HOST"],
+                 settings["CASSANDRA_PORT"], settings["CASSANDRA_PARTITION"]),
+                lambda: CassandraStorage(
+                    partition=settings["CASSANDRA_PARTITION"],
+                    contact_points=[settings["CASSANDRA_HOST"]],
+                    port=settings["CASSANDRA_PORT"]))
+        elif storage == "sharded":
+            # SHARDS: name -> settings of the shard (with STORAGE)
+            from .sharding import ShardedStorage
+            shards = {}
+            for name, shard_settings in settings["SHARDS"].items():
+                s = dict(settings, SHARDS={})
+                s.update(shard_settings)
+                shards[name] = self._create_storage(s["STORAGE"], s)
+            if not shards:
+                raise ValueError("No shards configured")
+            # The shards themselves are released with the resources
+            return ShardedStorage(shards,
+                                  replicas=settings["SHARD_REPLICAS"],
+                                  close_shards=False)
+        raise NotImplementedError("Storage not implemented")
+
+    def _acquire(self, name, factory):
+        resource = registry.acquire(name, factory)
+        self._resources.append(name)
+        return resource
+
+    def close(self):
+        """Stop event handling and release all shared resources.
+        """
+        if self.compactor is not None:
+            self.compactor.stop()
+        if self.retention is not None:
+            self.retention.stop()
+        if self._query_pool is not None:
+            self._query_pool.close()
+            self._query_pool = None
+        if self.settings.get("STORAGE") == "sharded":
+            self.storage.close()
+        if self.settings["ENABLE_EVENTS"]:
+            self.events.close()
+        if self.metrics is not None:
+            self.metrics.close()
+        while self._resources:
+            registry.release(self._resources.pop())
 
     def _close(self):
-        self.events.close()
+        self.close()
+
+    def health(self):
+        """Health check of all components.
+        Returns a dict with component -> reachable.
+        """
+        res = {"storage": self.storage.ping()}
+        if self.settings["ENABLE_CACHING"]:
+            res["cache"] = self.cache.ping()
+        if self.settings["ENABLE_EVENTS"]:
+            res["events"] = self.events.ping()
+        return res
+
+    def clear_cache(self):
+        """Clear the cache (all storages sharing this redis).
+        """
+        if self.settings["ENABLE_CACHING"]:
+            self.cache.clearAll()
+
+    def _cache_key(self, key):
+        return "{}:{}".format(self.storage.namespace, key)
+
+    def _cache_get(self, key, namespace):
+        m = self.metrics
+        if m is None:
+            return self.cache.get(key=self._cache_key(key),
+                                  namespace=namespace)
+        t = clock()
+        data = self.cache.get(key=self._cache_key(key), namespace=namespace)
+        m.timing("cache_lookup", clock() - t)
+        m.incr("cache_misses" if data is None else "cache_hits")
+        return data
 
     def _last_item_from_cache(self, key):
         # Cache Disbaled - Miss
         if not self.settings["ENABLE_CACHING"]:
             return None
-        item_data = self.cache.get(key=key, namespace="last_item")
+        item_data = self._cache_get(key, "last_item")
         if item_data is None:
-            logger.debug("LAST GET MISS: {}".format(key))
+            logger.debug("LAST GET MISS: %s", key)
             return None
         item = Item.from_db_data(key, item_data)
-        logger.debug("LAST GET HIT: {}".format(item))
+        logger.debug("LAST GET HIT: %s", item)
         return item
 
     def _store_last_item_in_cache(self, last_item):
         if not self.settings["ENABLE_CACHING"]:
             return
-        logger.debug("LAST PUT: {}".format(last_item))
-        self.cache.store(last_item.key, last_item.to_string(),
-                         namespace="last_item")
+        logger.debug("LAST PUT: %s", last_item)
+        self.cache.store(self._cache_key(last_item.key),
+                         last_item.to_string(), namespace="last_item")
 
     def _get_last_item_or_new(self, key):
         # Try to get it from Cache
@@ -110,40 +318,229 @@ class TSDB(object):
         if cached is not None:
             return cached
         # Get it from DB
+        m = self.metrics
+        if m is not None:
+            t = clock()
         try:
             item = self.storage.last(key)
         except NotFoundError:
-            item = Item.new(key)
-        else:
-            self._store_last_item_in_cache(item)
+            item = None
+        if m is not None:
+            m.timing("storage_read", clock() - t)
+        if item is None:
+            return Item(key, item_type=Item.DEFAULT_ITEMTYPE,
+                        bucket_type=self.bucket_type)
+        self._store_last_item_in_cache(item)
         return item
 
+    def _store_latest(self, last_items):
+        """Keep the last point of the last buckets as latest records.
+        """
+        records = []
+        for item in last_items:
+            if len(item) < 1:
+                continue
+            point = item[-1]
+            if self._latest is not None:
+                self._latest.pop(item.key, None)
+                if len(self._latest) >= self.settings["LATEST_CACHE_SIZE"]:
+                    self._latest.popitem(last=False)
+                self._latest[item.key] = point
+            if self.settings["ENABLE_CACHING"]:
+                record = Item(item.key, [point], item_type=item.item_type)
+                records.append((self._cache_key(item.key),
+                                record.to_string()))
+        if records:
+            self.cache.store_many(records, namespace="latest")
+
+    def last_value(self, key):
+        """Latest (timestamp, value) of a series (None if empty).
+        """
+        return self.last_values([key])[0]
+
+    def last_values(self, keys):
+        """Latest (timestamp, value) of several series, in order.
+        Served from the latest records (local, then one redis round
+        trip), the rest from the last buckets of the storage.
+        """
+        keys = [k.lower() for k in keys]
+        out = [None] * len(keys)
+        missing = list(range(len(keys)))
+        if self._latest is not None:
+            for i in missing:
+                out[i] = self._latest.get(keys[i])
+            missing = [i for i in missing if out[i] is None]
+        if missing and self.settings["ENABLE_CACHING"]:
+            # Records are refreshed by every write, reads do not touch
+            records = self.cache.get_many(
+                [self._cache_key(keys[i]) for i in missing],
+                namespace="latest", touch=False)
+            for i, data in zip(missing, records):
+                if data is not None:
+                    out[i] = Item.from_db_data(keys[i], data)[0]
+            missing = [i for i in missing if out[i] is None]
+        if missing:
+            items = self.storage.last_bulk([keys[i] for i in missing])
+            found = []
+            for i, item in zip(missing, items):
+                if item is not None and len(item) > 0:
+                    out[i] = item[-1]
+                    found.append(item)
+            self._store_latest(found)
+        return out
+
+    def latest(self, key, n):
+        """The last n points of a series as ResultSet.
+        """
+        if n < 1:
+            raise ValueError("n has to be positive")
+        key = key.lower()
+        items = []
+        count = 0
+        item = self._last_item_from_cache(key)
+        try:
+            if item is None:
+                item = self.storage.last(key)
+            while True:
+                items.insert(0, item)
+                count += len(item)
+                if count >= n:
+                    break
+                item = self.storage.left(key, item.range_key - 1)
+        except NotFoundError:
+            pass
+        r = ResultSet(key, items)
+        if len(r) > n:
+            r._trim(r._timestamps[-n], r._timestamps[-1])
+        return r
+
+    def value_at(self, key, ts, tolerance=None):
+        """Point of a series as of ts (the last point with timestamp
+        <= ts), None if there is none or it is older than tolerance.
+        Reads only one bucket.
+        """
+        key = key.lower()
+        ts = int(ts)
+        item = self._last_item_from_cache(key)
+        if item is None or item.range_key > ts:
+            try:
+                item = self.storage.left(key, ts)
+            except NotFoundError:
+                return None
+        point = item.at(ts)
+        if point is None:
+            return None
+        if tolerance is not None and ts - point[0] > tolerance:
+            return None
+        return point
+
+    def as_of_join(self, keys, ts_min, ts_max, tolerance=None):
+        """Align several series on the union of their timestamps
+        between ts_min and ts_max, forward filled (see
+        models.as_of_join). Requires numpy.
+        """
+        results = []
+        for key in keys:
+            key = key.lower()
+            r = ResultSet(key, self.storage.query(key, ts_min, ts_max))
+            # Keep the point before ts_min to fill from
+            start = r.at(ts_min)
+            r._trim(start[0] if start else ts_min, ts_max)
+            results.append(r)
+        return as_of_join(results, ts_min=ts_min, tolerance=tolerance)
+
     def _get_items_between(self, key, ts_min, ts_max):
-        return self.storage.query(key, ts_min, ts_max)
+        m = self.metrics
+        if m is None:
+            return self.storage.query(key, ts_min, ts_max)
+        t = clock()
+        items = self.storage.query(key, ts_min, ts_max)
+        m.timing("storage_read", clock() - t)
+        return items
 
     def query(self, key, ts_min, ts_max):
         return self._query(key, ts_min, ts_max)
 
     def _query(self, key, ts_min, ts_max):
-        r = ResultSet(key, self._get_items_between(key, ts_min, ts_max))
+        ranges = self._query_ranges(ts_min, ts_max)
+        if len(ranges) > 1:
+            m = self.metrics
+            if m is not None:
+                t = clock()
+            items = self.storage.query_ranges(key, ranges, self._pool())
+            if m is not None:
+                m.timing("storage_read", clock() - t)
+        else:
+            items = self._get_items_between(key, ts_min, ts_max)
+        r = ResultSet(key, items)
         r._trim(ts_min, ts_max)
         return r
 
+    def iter_query(self, key, ts_min, ts_max):
+        """Query as a stream of ResultSets (one per sub range, in order).
+        """
+        ranges = self._query_ranges(ts_min, ts_max)
+        for items in self.storage.iter_query_ranges(key, ranges,
+                                                    self._pool()):
+            r = ResultSet(key, items)
+            r._trim(ts_min, ts_max)
+            if len(r) > 0:
+                yield r
+
+    def iter_resample(self, key, ts_min, ts_max, interval, fill="none",
+                      function="mean"):
+        """Resampled query (see Resampler), yields a ResultSet per
+        chunk of iter_query.
+        """
+        resampler = Resampler(key, interval, fill, function)
+        for r in self.iter_query(key, ts_min, ts_max):
+            r = resampler.feed(r)
+            if len(r) > 0:
+                yield r
+        r = resampler.finish()
+        if len(r) > 0:
+            yield r
+
+    def _query_ranges(self, ts_min, ts_max):
+        """Split long queries into sub ranges of about QUERY_PARTITION
+        seconds. The number of sub ranges is rounded up to a multiple of
+        QUERY_WORKERS (up to 4 per worker), so they can be shorter.
+        """
+        workers = self.settings["QUERY_WORKERS"]
+        partition = self.settings["QUERY_PARTITION"]
+        span = ts_max - ts_min + 1
+        if workers < 2 or span <= partition:
+            return [(ts_min, ts_max)]
+        parts = min(-(-span // partition), 4 * workers)
+        parts = -(-parts // workers) * workers
+        step = -(-span // parts)
+        return [(a, min(a + step - 1, ts_max))
+                for a in range(ts_min, ts_max + 1, step)]
+
+    def _pool(self):
+        if self.settings["QUERY_WORKERS"] < 2:
+            return None
+        if self._query_pool is None:
+            from multiprocessing.pool import ThreadPool
+            self._query_pool = ThreadPool(self.settings["QUERY_WORKERS"])
+        return self._query_pool
+
     def _insert_or_update_item(self, item):
-        if item.existing:
-            self.storage.update(item)
+        write = self.storage.update if item.existing else self.storage.insert
+        if self.metrics is None:
+            write(item)
         else:
-            self.storage.insert(item)
+            write(item, metrics=self.metrics)
 
     def _stats_from_cache(self, key):
         if not self.settings["ENABLE_CACHING"]:
             return None
-        stats_raw = self.cache.get(key=key, namespace="data_stats")
+        stats_raw = self._cache_get(key, "data_stats")
         if stats_raw is None:
-            logger.debug("STATS GET MISS: {}".format(key))
+            logger.debug("STATS GET MISS: %s", key)
             return None
         stats = Stats.from_string(stats_raw)
-        logger.debug("STATS GET HIT: {}".format(key))
+        logger.debug("STATS GET HIT: %s", key)
         return stats
 
     def stats(self, key):
@@ -162,58 +559,132 @@ class TSDB(object):
             return cached
         # From DB
         stats = self.storage.stats(key)
-        if stats is not None:
-            self.cache.store(key, stats.to_string(), namespace="data_stats")
+        if stats is not None and self.settings["ENABLE_CACHING"]:
+            self.cache.store(self._cache_key(key), stats.to_string(),
+                             namespace="data_stats")
         return stats
 
     def _data_changed(self, key):
         if not self.settings["ENABLE_CACHING"]:
             return
-        return self.cache.expire(key, namespace="data_stats")
+        return self.cache.expire(self._cache_key(key),
+                                 namespace="data_stats")
 
     def insert_bulk(self, inserts):
+        """Insert a list of {"key", "data"} or columnar {"key",
+        "timestamps", "values"} dicts.
+        """
         res = []
         for i in inserts:
-            res.append(self._insert(i["key"], i["data"]))
+            if "timestamps" in i:
+                res.append(self._insert_columns(i["key"], i["timestamps"],
+                                                i["values"]))
+            else:
+                res.append(self._insert(i["key"], i["data"]))
         return res
 
-    def insert(self, key, data):
-        return self._insert(key, data)
-
-    def _insert(self, key, data):
-        key = key.lower()
-        if not re.match(r'^[A-Za-z0-9_\-\.]+$', key):
+    def insert(self, key, data, overwrite=False):
+        """Insert (timestamp, value) points. Existing points are kept,
+        with overwrite their values are replaced (counted as inserted).
+        """
+        return self._insert(key, data, overwrite)
+
+    def insert_columns(self, key, timestamps, values, overwrite=False):
+        """Insert points given as columns (like insert). A column may be
+        an array.array, a numpy array, a list or little-endian bytes
+        (uint32 timestamps, float32 values), tuple series take a list
+        of value columns.
+        """
+        return self._insert_columns(key, timestamps, values, overwrite)
+
+    def _check_key(self, key):
+        """Lower case key, raises ValueError if it is invalid.
+        """
+        known = self._known_keys.get(key)
+        if known is not None:
+            return known
+        if not KEY_PATTERN.match(key):
             raise ValueError("Key should be alphanumeric (including .-_)")
-
-        assert(isinstance(data, list))
-        assert(len(data) > 0)
-        data.sort(key=lambda x: x[0])
-
+        if len(self._known_keys) >= self.KNOWN_KEYS_MAX:
+            self._known_keys.clear()
+        self._known_keys[key] = key.lower()
+        return key.lower()
+
+    @contextmanager
+    def _locked(self, key):
+        """Serialize the writes of a key in this process (inserts,
+        deletes and compaction read and rewrite its buckets).
+        """
+        with self._key_locks_lock:
+            entry = self._key_locks.get(key)
+            if entry is None:
+                entry = self._key_locks[key] = [threading.RLock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._key_locks_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[key]
+
+    def _insert(self, key, data, overwrite=False):
+        key = self._check_key(key)
+        if len(data) < 1:
+            raise ValueError("no points")
+        with self._locked(key):
+            last_item = self._get_last_item_or_new(key)
+            timestamps, columns = _sort_columns(*last_item._to_columns(data))
+            return self._merge(key, last_item, timestamps, columns,
+                               overwrite)
+
+    def _insert_columns(self, key, timestamps, values, overwrite=False):
+        key = self._check_key(key)
+        with self._locked(key):
+            last_item = self._get_last_item_or_new(key)
+            timestamps, columns = last_item._input_columns(timestamps,
+                                                           values)
+            if len(timestamps) < 1:
+                raise ValueError("no points")
+            return self._merge(key, last_item, timestamps, columns,
+                               overwrite)
+
+    def _merge(self, key, last_item, timestamps, columns, overwrite):
+        """Insert sorted columns, starting with the last item of the key
+        (read with the lock of the key held).
+        """
         # Limits and Stats
-        ts_min = int(data[0][0])
-        ts_max = int(data[-1][0])
-        count = len(data)
-        logger.debug("Inserting {} {} points".format(key, len(data)))
-        logger.debug("Limits: {} - {}".format(ts_min, ts_max))
+        ts_min = timestamps[0]
+        ts_max = timestamps[-1]
+        count = len(timestamps)
+        logger.debug("Inserting %s %s points", key, count)
+        logger.debug("Limits: %s - %s", ts_min, ts_max)
         stats = {"ts_min": ts_min, "ts_max": ts_max, "count": count,
                  "appended": 0, "inserted": 0, "updated": 0, "key": key,
                  "splits": 0, "merged": 0}
 
-        # Find the last Item
-        last_item = self._get_last_item_or_new(key)
+        self.bucket_policy.observe(key, count)
+
         if len(last_item) > 0:
             last_item_range_key = last_item.range_key
         else:
             last_item_range_key = -1
-        logger.debug("Last: {}".format(last_item))
+        logger.debug("Last: %s", last_item)
 
         # List with all Items we updated
         updated = []
+        m = self.metrics
 
         # Just Append - Best Case
         if ts_min >= last_item.ts_max:
             logger.debug("Append Data")
-            appended = last_item.insert(data)
+            if m is not None:
+                t = clock()
+            appended = last_item.insert_columns(timestamps, columns,
+                                                overwrite)
+            if m is not None:
+                m.timing("merge", clock() - t)
             updated.append(last_item)
             stats["appended"] += appended
         else:
@@ -221,50 +692,67 @@ class TSDB(object):
             merge_items = self._get_items_between(key, ts_min, ts_max)
             assert(len(merge_items) > 0)
             assert(merge_items[0].ts_min <= ts_min)
-            logger.debug("Merging Data Query({} - {}) {} items"
-                         .format(ts_min, ts_max, len(merge_items)))
-            i = len(data) - 1
-            m = len(merge_items) - 1
+            logger.debug("Merging Data Query(%s - %s) %s items",
+                         ts_min, ts_max, len(merge_items))
+            if m is not None:
+                t = clock()
+            # Every item gets the points from its ts_min on (column-wise)
+            high = len(timestamps)
             inserted = 0
-            while i >= 0:
-                last_merge_item = merge_items[m]
-                if data[i][0] >= last_merge_item.ts_min:
-                    inserted += last_merge_item.insert_point(data[i][0],
-                                                             data[i][1])
-                    i -= 1
-                else:
-                    m -= 1
+            for merge_item in reversed(merge_items):
+                low = bisect.bisect_left(timestamps, merge_item.ts_min)
+                if merge_item is merge_items[0]:
+                    low = 0
+                if low < high:
+                    inserted += merge_item.insert_columns(
+                        timestamps[low:high], [c[low:high] for c in columns],
+                        overwrite)
+                high = low
             updated += merge_items
             stats["merged"] += len(merge_items)
             stats["inserted"] += inserted
+            if m is not None:
+                m.timing("merge", clock() - t)
 
         # Splitting Round
+        if m is not None:
+            t = clock()
         updated_splitted = []
         for i in updated:
             # Check Size for Split
-            if not i.split_needed(limit="soft"):
+            if not i.split_needed(limit="soft", policy=self.bucket_policy):
                 logger.debug("No Split, No Fragmentation")
                 updated_splitted.append(i)
             # If its not the last we let it grow a bit
-            elif i != last_item and not i.split_needed(limit="hard"):
+            elif i != last_item and not i.split_needed(
+                    limit="hard", policy=self.bucket_policy):
                 logger.debug("Fragmentation, No Split")
                 updated_splitted.append(i)
             else:
-                splited = i.split_item()
+                splited = i.split_item(policy=self.bucket_policy)
                 logger.debug("Split needed")
                 for j in splited:
                     updated_splitted.append(j)
                 stats["splits"] += 1
+        if m is not None:
+            m.timing("split", clock() - t)
 
         # Update
         if stats["inserted"] > 0 or stats["appended"] > 0:
             # Update Round
             for i in updated_splitted:
                 self._insert_or_update_item(i)
+            if m is not None:
+                # Points rewritten per new point: write amplification
+                m.incr("points_inserted",
+                       stats["inserted"] + stats["appended"])
+                m.incr("points_written",
+                       sum(len(i) for i in updated_splitted))
+                m.incr("buckets_written", len(updated_splitted))
 
             # Update Event
             self._event(key=key, stats=stats)
-            logger.debug("Insert Finished {}".format(stats))
+            logger.debug("Insert Finished %s", stats)
 
             # Invalidate Stats
             self._data_changed(key)
@@ -272,7 +760,244 @@ class TSDB(object):
             # If it was the Last Item we update the Cache
             if updated_splitted[-1].range_key >= last_item_range_key:
                 self._store_last_item_in_cache(updated_splitted[-1])
+                self._store_latest([updated_splitted[-1]])
+
+            # Out of order inserts fragment the buckets, every insert
+            # delays the compaction of a scheduled key
+            if self.compactor is not None:
+                if stats["merged"] > 0:
+                    self.compactor.schedule(key)
+                else:
+                    self.compactor.touch(key)
+            if self.retention is not None:
+                self.retention.track(key)
+            if self.continuous is not None and self.continuous.sync:
+                self.continuous.update(key, ts_min, ts_max)
         else:
             logger.info("Duplicate ... Nothing to do ...")
 
         return stats
+
+    def delete(self, key, ts_min, ts_max):
+        """Delete all points with ts_min <= timestamp <= ts_max.
+        Returns the delete stats.
+        """
+        return self._delete(key, ts_min, ts_max)
+
+    def _delete(self, key, ts_min, ts_max):
+        key = key.lower()
+        with self._locked(key):
+            return self._delete_locked(key, ts_min, ts_max)
+
+    def _delete_locked(self, key, ts_min, ts_max):
+        ts_min = int(ts_min)
+        ts_max = int(ts_max)
+        stats = {"ts_min": ts_min, "ts_max": ts_max, "count": 0,
+                 "appended": 0, "inserted": 0, "updated": 0, "key": key,
+                 "deleted": 0, "dropped": 0, "rewritten": 0}
+        if ts_max < ts_min:
+            return stats
+
+        # Only the buckets of ts_min and ts_max are decoded, the
+        # buckets between them are dropped by range key
+        try:
+            right = self.storage.left(key, ts_max)
+        except NotFoundError:
+            return stats
+        try:
+            left = self.storage.left(key, ts_min)
+        except NotFoundError:
+            left = None
+        if left is None:
+            edges = [right]
+            sizes = self.storage.sizes(key, ts_min, right.range_key - 1)
+        elif left.range_key == right.range_key:
+            edges = [right]
+            sizes = []
+        else:
+            edges = [left, right]
+            # Without the left bucket (range_min is its range key)
+            sizes = self.storage.sizes(key, left.range_key,
+                                       right.range_key - 1)[1:]
+        drop_min = ts_min if left is None else left.range_key + 1
+        drop_max = right.range_key - 1
+        stats["deleted"] = sum(sizes)
+        stats["dropped"] = len(sizes)
+
+        rewrite = []
+        for i in edges:
+            range_key = i.range_key
+            removed = i.remove(ts_min, ts_max)
+            if removed < 1:
+                continue
+            stats["deleted"] += removed
+            if len(i) < 1 or i.range_key != range_key:
+                drop_min = min(drop_min, range_key)
+                drop_max = max(drop_max, range_key)
+            if len(i) < 1:
+                stats["dropped"] += 1
+                continue
+            if i.range_key != range_key:
+                i._existing = False
+            rewrite.append(i)
+        if stats["deleted"] < 1:
+            return stats
+
+        # New edge buckets first, the dropped range keys are contiguous
+        for i in rewrite:
+            self._insert_or_update_item(i)
+        if drop_min <= drop_max:
+            self.storage.delete_range(key, drop_min, drop_max)
+        stats["rewritten"] = len(rewrite)
+
+        self._event(key=key, stats=stats)
+        self._data_changed(key)
+        if self.settings["ENABLE_CACHING"]:
+            self.cache.expire(self._cache_key(key), namespace="last_item")
+            self.cache.expire(self._cache_key(key), namespace="latest")
+        if self._latest is not None:
+            self._latest.pop(key, None)
+        logger.debug("Delete Finished %s", stats)
+        return stats
+
+    def compact_bulk(self, keys):
+        res = []
+        for key in keys:
+            res.append(self._compact(key))
+        return res
+
+    def compact(self, key):
+        """Re-partition the dynamic buckets of a key to the target size.
+        Returns the compaction stats.
+        """
+        return self._compact(key)
+
+    def _compact(self, key):
+        key = key.lower()
+        # Inserts of the key wait, they read the last bucket (and its
+        # cache entry) again after the new layout is written
+        with self._locked(key):
+            return self._compact_locked(key)
+
+    def _compact_locked(self, key):
+        stats = {"key": key, "points": 0, "buckets_before": 0,
+                 "buckets_after": 0, "written": 0, "deleted": 0}
+        try:
+            first = self.storage.first(key)
+            end = self.storage.last(key).range_key
+        except NotFoundError:
+            first = None
+        if first is None:
+            target = self.bucket_policy.target
+            stats.update(_read_amplification([], target, "before"))
+            stats.update(_read_amplification([], target, "after"))
+            return stats
+        target = self.bucket_policy.sizes(key, first.item_type)[0]
+        window = self.COMPACTION_WINDOW
+        # Time span of a window, from the density of the first bucket
+        span = max(1, (first.ts_max - first.ts_min + 1) * target * window //
+                   len(first))
+
+        before = []
+        after = []
+        cursor = first.range_key
+        carry = None
+        changed = False
+        while True:
+            window_end = cursor + span - 1
+            final = window_end >= end
+            if final:
+                window_end = (2**31) - 1
+            items = [i for i in self._get_items_between(key, cursor,
+                                                        window_end)
+                     if i.range_key >= cursor]
+            if not items:
+                cursor = window_end + 1
+                span *= 2
+                continue
+            sizes = [len(i) for i in items]
+            # A bucket carried over from the last window is counted there
+            before += sizes[1:] if carry is not None else sizes
+
+            if any(i.bucket_type != BucketType.dynamic for i in items):
+                logger.debug("Compaction only for dynamic buckets: %s", key)
+                new_items = items
+            elif all(x == target for x in sizes[:-1]) and sizes[-1] <= target:
+                new_items = items
+            else:
+                new_items = self._compact_window(key, items, target, stats)
+                changed = True
+
+            # A partial last bucket is merged with the next window
+            if not final and len(new_items[-1]) < target:
+                carry = new_items[-1].range_key
+                after += [len(i) for i in new_items[:-1]]
+                next_cursor = carry
+            else:
+                carry = None
+                after += [len(i) for i in new_items]
+                next_cursor = window_end + 1
+            if final:
+                break
+            # The window adapts to the density of the series
+            if next_cursor <= cursor or len(items) < window // 2:
+                span *= 2
+            elif len(items) > 2 * window:
+                span = max(1, span // 2)
+            cursor = next_cursor
+
+        if changed:
+            self._data_changed(key)
+            self._store_last_item_in_cache(new_items[-1])
+        stats["points"] = sum(before)
+        stats["buckets_before"] = len(before)
+        stats["buckets_after"] = len(after)
+        stats.update(_read_amplification(before, target, "before"))
+        stats.update(_read_amplification(after, target, "after"))
+        logger.debug("Compaction Finished %s", stats)
+        return stats
+
+    def _compact_window(self, key, items, target, stats):
+        """Rewrite adjacent buckets to buckets of the target size.
+        Returns the new buckets.
+        """
+        merged = Item(key, item_type=items[0].item_type,
+                      bucket_type=BucketType.dynamic)
+        merged._append_items(items)
+        if len(merged) > target:
+            new_items = merged._split_item_at(count=target)
+        else:
+            new_items = [merged]
+
+        # Readers do not take the lock: the new buckets are written from
+        # right to left, a bucket overwritten in place has all of its
+        # points in new buckets already. Overlapping buckets are read
+        # once (Item._append_items) until the obsolete ones are deleted.
+        old_range_keys = set(i.range_key for i in items)
+        for i in reversed(new_items):
+            i._existing = i.range_key in old_range_keys
+            self._insert_or_update_item(i)
+            stats["written"] += 1
+        new_range_keys = set(i.range_key for i in new_items)
+        for range_key in sorted(old_range_keys - new_range_keys):
+            self.storage.delete(key, range_key)
+            stats["deleted"] += 1
+        return new_items
+
+
+def _read_amplification(sizes, target, suffix):
+    """Expected cost of a query for `target` consecutive points
+    (starting at a random point) with these bucket sizes.
+    A bucket of size s is hit by s + target - 1 of the start points.
+    Returns the rows read and the points read per point returned.
+    """
+    points = sum(sizes)
+    if points < 1:
+        rows = amplification = 0.0
+    else:
+        hits = [s + target - 1 for s in sizes]
+        rows = float(sum(hits)) / points
+        amplification = (float(sum(s * h for s, h in zip(sizes, hits))) /
+                         (points * target))
+    return {"rows_per_query_" + suffix: rows,
+            "read_amplification_" + suffix: amplification}
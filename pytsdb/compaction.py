@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# coding: utf8
+
+from __future__ import unicode_literals
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Compactor(object):
+    """Background compaction of fragmented keys.
+    Keys are scheduled after out of order inserts and compacted
+    once they had no inserts for `delay` seconds (every insert of a
+    scheduled key restarts the delay).
+    """
+    def __init__(self, db, delay=60, interval=1.0):
+        self.db = db
+        self.delay = delay
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.metrics = {"runs": 0, "keys": 0, "errors": 0, "points": 0,
+                        "buckets_before": 0, "buckets_after": 0,
+                        "written": 0, "deleted": 0, "seconds": 0.0}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def schedule(self, key):
+        """Schedule a key, the delay restarts with every call.
+        """
+        with self._lock:
+            self._pending[key] = time.time()
+
+    def touch(self, key):
+        """Restart the delay of a key if it is scheduled.
+        """
+        if key in self._pending:
+            with self._lock:
+                if key in self._pending:
+                    self._pending[key] = time.time()
+
+    def run_pending(self, force=False):
+        """Compact all keys due (or all scheduled keys with force).
+        Returns the compaction stats of these keys.
+        """
+        now = time.time()
+        with self._lock:
+            keys = [k for k, t in self._pending.items()
+                    if force or now - t >= self.delay]
+            for k in keys:
+                del self._pending[k]
+        res = []
+        if not keys:
+            return res
+        t = time.time()
+        for key in sorted(keys):
+            try:
+                res.append(self.db.compact(key))
+            except Exception:
+                logger.exception("Compaction failed: {}".format(key))
+                self.metrics["errors"] += 1
+        self._record(res, time.time() - t)
+        return res
+
+    def _record(self, results, seconds):
+        m = self.metrics
+        m["runs"] += 1
+        m["seconds"] += seconds
+        for r in results:
+            m["keys"] += 1
+            for k in ["points", "buckets_before", "buckets_after",
+                      "written", "deleted"]:
+                m[k] += r[k]
+
+    def bucket_reduction(self):
+        """Fraction of buckets removed by all compactions so far
+        (negative if more oversized buckets were split than merged).
+        """
+        before = self.metrics["buckets_before"]
+        if before < 1:
+            return 0.0
+        return 1.0 - float(self.metrics["buckets_after"]) / before
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread (pending keys are kept).
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_pending()
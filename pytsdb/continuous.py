@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# coding: utf8
+
+from __future__ import unicode_literals
+
+import re
+import time
+import logging
+import threading
+from itertools import groupby
+
+from .models import AGGREGATION_FUNCTIONS
+
+logger = logging.getLogger(__name__)
+
+
+def _pattern(pattern):
+    parts = [re.escape(p) for p in pattern.lower().split("*")]
+    return re.compile("^{}$".format("(.*)".join(parts)))
+
+
+class ContinuousQuery(object):
+    """Aggregate of a series over fixed windows, stored as a series.
+    Source and target may contain "*", the parts of the key matched
+    by the source wildcards are filled into the target wildcards
+    (e.g. "sensor*.temp" -> "sensor*.temp.1h").
+    """
+    def __init__(self, source, target, interval=3600, function="mean"):
+        if function not in AGGREGATION_FUNCTIONS:
+            raise ValueError("Invalid aggregation function")
+        if source.count("*") != target.count("*"):
+            raise ValueError("source and target need the same wildcards")
+        if interval < 1:
+            raise ValueError("invalid interval")
+        self.source = source.lower()
+        self.target = target.lower()
+        self.interval = int(interval)
+        self.function = function
+        self._func = AGGREGATION_FUNCTIONS[function]
+        self._source = _pattern(self.source)
+        self._target = _pattern(self.target)
+
+    def target_key(self, key):
+        """Target series of a source key (None if it does not match).
+        """
+        m = self._source.match(key)
+        if m is None or self._target.match(key):
+            # Never aggregate its own output
+            return None
+        parts = self.target.split("*")
+        out = parts[0]
+        for value, part in zip(m.groups(), parts[1:]):
+            out += value + part
+        return out
+
+    def windows(self, ts_min, ts_max):
+        """First and last timestamp of all windows touching a range.
+        """
+        start = ts_min - ts_min % self.interval
+        end = ts_max - ts_max % self.interval + self.interval - 1
+        return start, end
+
+    def evaluate(self, result):
+        """Aggregates (window start, value) of a ResultSet.
+        """
+        out = []
+        for window, points in groupby(result.all(),
+                                      lambda p: p[0] - p[0] % self.interval):
+            out.append((window, self._func([p[1] for p in points])))
+        return out
+
+    def to_dict(self):
+        return {"source": self.source, "target": self.target,
+                "interval": self.interval, "function": self.function}
+
+
+class ContinuousQueries(object):
+    """Continuous queries of a TSDB.
+
+    An update recomputes only the windows touched by the inserted
+    range and overwrites them in the target series. With sync the
+    write path updates the aggregates on every insert, otherwise
+    on_event can be registered as data event callback.
+    Deletes are not propagated, the aggregates are kept (e.g. when
+    the raw data expires by retention).
+    """
+    def __init__(self, db, sync=True):
+        self.db = db
+        self.sync = sync
+        self._lock = threading.Lock()
+        self._queries = []
+        self.metrics = {"updates": 0, "windows": 0, "points": 0,
+                        "errors": 0, "seconds": 0.0}
+
+    def __len__(self):
+        return len(self._queries)
+
+    def add(self, source, target, interval=3600, function="mean"):
+        query = ContinuousQuery(source, target, interval, function)
+        with self._lock:
+            if any(q.target == query.target for q in self._queries):
+                raise ValueError("target already used: {}".format(target))
+            self._queries = self._queries + [query]
+        return query
+
+    def remove(self, target):
+        with self._lock:
+            self._queries = [q for q in self._queries
+                             if q.target != target.lower()]
+
+    def queries(self):
+        return list(self._queries)
+
+    def update(self, key, ts_min, ts_max):
+        """Recompute the windows of all queries of a key between
+        ts_min and ts_max. Returns the number of written windows.
+        """
+        key = key.lower()
+        written = 0
+        for query in self._queries:
+            target = query.target_key(key)
+            if target is None:
+                continue
+            t = time.time()
+            try:
+                start, end = query.windows(ts_min, ts_max)
+                result = self.db.query(key, start, end)
+                values = query.evaluate(result)
+                if values:
+                    self.db.insert(target, values, overwrite=True)
+            except Exception:
+                logger.exception("Continuous query failed: {} -> {}"
+                                 .format(key, target))
+                self.metrics["errors"] += 1
+                continue
+            m = self.metrics
+            m["updates"] += 1
+            m["windows"] += len(values)
+            m["points"] += len(result)
+            m["seconds"] += time.time() - t
+            written += len(values)
+        return written
+
+    def on_event(self, key, event):
+        """Data event callback (e.g. of an event consumer process).
+        """
+        if event.appended or event.inserted or event.updated:
+            self.update(key, event.ts_min, event.ts_max)
+
+    def backfill(self, key):
+        """Compute all windows of a source key.
+        """
+        stats = self.db.stats(key)
+        if stats is None:
+            return 0
+        return self.update(key, stats.ts_min, stats.ts_max)
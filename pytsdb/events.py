@@ -5,14 +5,28 @@ from __future__ import unicode_literals
 
 import logging
 import json
+import struct
 import sys
-from redis import StrictRedis as Redis
+import threading
+from fnmatch import fnmatchcase
 from .errors import InternalError
 
 logger = logging.getLogger(__name__)
 
+# Channel of the batched events
+BATCH_CHANNEL = "pytsdb:events"
+
+_BATCH_MAGIC = b"TSEB"
+_BATCH_HEADER = struct.Struct(str("<4sI"))
+_EVENT_FIELDS = ("ts_min", "ts_max", "count",
+                 "appended", "inserted", "updated", "deleted")
+_EVENT_VALUES = struct.Struct(str("<H7q"))
+
 
 class DataEvent(object):
+    __slots__ = ("key", "ts_min", "ts_max", "count",
+                 "appended", "inserted", "updated", "deleted")
+
     def __init__(self, key, ts_min, ts_max, count,
                  appended=0, inserted=0, updated=0, deleted=0):
         self.key = key
@@ -36,6 +50,17 @@ class DataEvent(object):
             "deleted": self.deleted,
         }
 
+    def merge(self, other):
+        """Add the changes of a later event of the same key.
+        """
+        self.ts_min = min(self.ts_min, other.ts_min)
+        self.ts_max = max(self.ts_max, other.ts_max)
+        self.count += other.count
+        self.appended += other.appended
+        self.inserted += other.inserted
+        self.updated += other.updated
+        self.deleted += other.deleted
+
     def to_json(self):
         return json.dumps(self.to_dict())
 
@@ -51,16 +76,79 @@ class DataEvent(object):
                                                                 self.ts_max)
 
 
+def encode_batch(events, binary=False):
+    """Encode a list of events as one message (JSON or binary).
+    """
+    if not binary:
+        return json.dumps([e.to_dict() for e in events])
+    out = [_BATCH_HEADER.pack(_BATCH_MAGIC, len(events))]
+    for e in events:
+        key = e.key.encode("utf-8")
+        out.append(_EVENT_VALUES.pack(len(key), *[int(getattr(e, f))
+                                                  for f in _EVENT_FIELDS]))
+        out.append(key)
+    return b"".join(out)
+
+
+def decode_batch(data):
+    """Events of a message created by encode_batch (either encoding).
+    """
+    if not data.startswith(_BATCH_MAGIC):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        return [DataEvent(**d) for d in json.loads(data)]
+    _, n = _BATCH_HEADER.unpack_from(data)
+    offset = _BATCH_HEADER.size
+    events = []
+    for _ in range(n):
+        values = _EVENT_VALUES.unpack_from(data, offset)
+        offset += _EVENT_VALUES.size
+        key = data[offset:offset + values[0]].decode("utf-8")
+        offset += values[0]
+        events.append(DataEvent(key, *values[1:]))
+    return events
+
+
 class RedisPubSub(object):
-    def __init__(self, redis=None, **kwargs):
+    """Data events over redis pubsub.
+
+    Without a batch_window every event is published on the channel of
+    its key. With a batch_window (seconds) the events are coalesced per
+    key and published once per window as a batch on BATCH_CHANNEL
+    (JSON or binary); subscribers match the keys of a batch against
+    their patterns (fnmatch).
+    """
+    def __init__(self, redis=None, batch_window=None, batch_size=1000,
+                 binary=False, **kwargs):
         if redis is not None:
             self._redis = redis
         else:
+            from redis import StrictRedis as Redis
             self._redis = Redis(**kwargs)
         self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
         self._thread = None
         self._callbacks = {}
         self._last_error = None
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.binary = binary
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stop = threading.Event()
+        self._flusher = None
+        self._batch_subscribed = False
+        self.metrics = {"events": 0, "messages": 0,
+                        "received_events": 0, "received_messages": 0}
+
+    def ping(self):
+        """Health check, returns True if redis is reachable.
+        """
+        try:
+            self._redis.ping()
+        except Exception as e:
+            logger.warning("Redis ping failed: {}".format(e))
+            return False
+        return True
 
     def start(self):
         if not self._thread:
@@ -72,37 +160,372 @@ class RedisPubSub(object):
     def stop(self):
         if self._thread is not None:
             self._thread.stop()
+            # Do not close the connection under the reading thread
+            self._thread.join()
             self._thread = None
 
     def close(self):
+        self._stop_flusher()
+        self.flush()
         self.stop()
         self._pubsub.close()
 
+    def messages_saved(self):
+        """Number of messages not sent because of coalescing.
+        """
+        return self.metrics["events"] - self.metrics["messages"]
+
     def publish_event(self, key, **kwargs):
         key = "{}".format(key)
         ev = DataEvent(key=key, **kwargs)
-        self._redis.publish(key, ev.to_json())
+        if not self.batch_window:
+            self._redis.publish(key, ev.to_json())
+            self.metrics["events"] += 1
+            self.metrics["messages"] += 1
+            return
+        with self._lock:
+            self.metrics["events"] += 1
+            if key in self._pending:
+                self._pending[key].merge(ev)
+            else:
+                self._pending[key] = ev
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+        self._start_flusher()
+
+    def flush(self):
+        """Publish the pending events as one batch.
+        Returns the number of events (keys) in the batch.
+        """
+        with self._lock:
+            events = [self._pending[k] for k in sorted(self._pending)]
+            self._pending = {}
+        if not events:
+            return 0
+        self._redis.publish(BATCH_CHANNEL, encode_batch(events, self.binary))
+        self.metrics["messages"] += 1
+        return len(events)
+
+    def _start_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._stop.clear()
+                self._flusher = threading.Thread(target=self._run)
+                self._flusher.daemon = True
+                self._flusher.start()
+
+    def _stop_flusher(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+
+    def _run(self):
+        while not self._stop.wait(self.batch_window):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Publishing events failed")
 
     def register_callback(self, key, callback):
         key = "{}".format(key)
         self._callbacks[key] = callback
         self._pubsub.psubscribe(**{key: self._route_callback})
+        if not self._batch_subscribed:
+            self._pubsub.subscribe(**{BATCH_CHANNEL: self._route_callback})
+            self._batch_subscribed = True
         self.start()
 
     def _route_callback(self, message):
-        logger.info("Incomming Event: {}".format(message))
+        logger.debug("Incomming Event: %s", message)
+        channel = message["channel"].decode("utf-8")
+        if channel == BATCH_CHANNEL:
+            # A pattern matching the batch channel gets the batch twice
+            if message["type"] == "pmessage":
+                return
+            events = decode_batch(message["data"])
+            self.metrics["received_messages"] += 1
+            self.metrics["received_events"] += len(events)
+            for event in events:
+                for pattern, callback in list(self._callbacks.items()):
+                    if fnmatchcase(event.key, pattern):
+                        self._dispatch(callback, event.key, event)
+            return
         pattern = message["pattern"].decode("utf-8")
         if pattern in self._callbacks:
+            self.metrics["received_messages"] += 1
+            self.metrics["received_events"] += 1
             try:
                 event = DataEvent.from_json(message["data"].decode("utf-8"))
-                key = message["channel"].decode("utf-8")
-                self._callbacks[pattern](key=key, event=event)
-            except Exception as e:
-                # TODO Python 3 Exception chaining
-                t, value, traceback = sys.exc_info()
-                self._last_error = "{}\n{}\n{}".format(t, value, traceback)
-                logger.error(self._last_error)
-                # Do not raise
-                # raise InternalError, ("callback raised exception"), traceback
+            except Exception:
+                self._error()
+                return
+            self._dispatch(self._callbacks[pattern], channel, event)
         else:
             raise InternalError("no callback found")
+
+    def _dispatch(self, callback, key, event):
+        try:
+            callback(key=key, event=event)
+        except Exception:
+            self._error()
+
+    def _error(self):
+        # TODO Python 3 Exception chaining
+        t, value, traceback = sys.exc_info()
+        self._last_error = "{}\n{}\n{}".format(t, value, traceback)
+        logger.error(self._last_error)
+        # Do not raise
+        # raise InternalError, ("callback raised exception"), traceback
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+
+class RedisStreams(object):
+    """Durable data events on a redis stream.
+
+    Events are appended with XADD (the stream is capped at about maxlen
+    entries). Consumers read with XREADGROUP in a consumer group, so a
+    slow or restarted consumer continues where it stopped; entries are
+    acknowledged after they were handled. Several consumers of one
+    group share the events, every group gets all events.
+    Reads block on the server (no polling).
+    Entries of a failed callback stay pending, the consumer thread
+    reads its pending entries again on start and claims the entries
+    of other consumers idle for claim_idle milliseconds (e.g. of a
+    consumer which crashed, the default consumer name is per process).
+    """
+    def __init__(self, redis=None, stream="pytsdb:stream", group="pytsdb",
+                 consumer=None, maxlen=100000, block=1000, batch_size=100,
+                 claim_idle=60000, **kwargs):
+        if redis is not None:
+            self._redis = redis
+        else:
+            from redis import StrictRedis as Redis
+            self._redis = Redis(**kwargs)
+        self.stream = stream
+        self.group = group
+        if consumer is None:
+            import os
+            import socket
+            consumer = "{}-{}".format(socket.gethostname(), os.getpid())
+        self.consumer = consumer
+        self.maxlen = maxlen
+        self.block = block
+        self.batch_size = batch_size
+        self.claim_idle = claim_idle
+        self._callbacks = {}
+        self._last_error = None
+        self._group_created = False
+        self._stop = threading.Event()
+        self._thread = None
+        self.metrics = {"events": 0, "messages": 0,
+                        "received_events": 0, "received_messages": 0,
+                        "acked": 0, "failed": 0, "claimed": 0}
+
+    def ping(self):
+        """Health check, returns True if redis is reachable.
+        """
+        try:
+            self._redis.ping()
+        except Exception as e:
+            logger.warning("Redis ping failed: {}".format(e))
+            return False
+        return True
+
+    def _xadd_args(self, event):
+        return ("XADD", self.stream, "MAXLEN", "~", self.maxlen, "*",
+                "key", event.key, "event", event.to_json())
+
+    def publish_event(self, key, **kwargs):
+        key = "{}".format(key)
+        ev = DataEvent(key=key, **kwargs)
+        self._redis.execute_command(*self._xadd_args(ev))
+        self.metrics["events"] += 1
+        self.metrics["messages"] += 1
+
+    def publish_events(self, events):
+        """Append several events in one round trip.
+        """
+        pipe = self._redis.pipeline(transaction=False)
+        for ev in events:
+            pipe.execute_command(*self._xadd_args(ev))
+        pipe.execute()
+        self.metrics["events"] += len(events)
+        self.metrics["messages"] += len(events)
+
+    def create_group(self, start="$"):
+        """Create the consumer group (and the stream) if needed.
+        New groups get the events after start ("$": new events only).
+        """
+        from redis.exceptions import ResponseError
+        try:
+            self._redis.execute_command("XGROUP", "CREATE", self.stream,
+                                        self.group, start, "MKSTREAM")
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_created = True
+
+    def read(self, count=None, block=None, pending=False, start="0"):
+        """Read a batch of (entry id, DataEvent) for this consumer.
+        With pending the entries delivered before but not acknowledged
+        (after the entry id start) are read again, e.g. after a restart.
+        Blocks up to block milliseconds for new entries.
+        """
+        if not self._group_created:
+            self.create_group()
+        args = ["XREADGROUP", "GROUP", self.group, self.consumer,
+                "COUNT", count or self.batch_size]
+        if block is not None and not pending:
+            args += ["BLOCK", block]
+        args += ["STREAMS", self.stream, start if pending else ">"]
+        res = self._redis.execute_command(*args)
+        entries = []
+        for _, items in res or []:
+            for entry_id, fields in items:
+                if fields is None:
+                    # Deleted by the length cap before it was acked
+                    self.ack([entry_id])
+                    continue
+                if not isinstance(fields, dict):
+                    fields = dict(zip(fields[::2], fields[1::2]))
+                fields = dict((_decode(k), v) for k, v in fields.items())
+                entries.append((_decode(entry_id),
+                                DataEvent.from_json(_decode(fields["event"]))))
+        if entries:
+            self.metrics["received_messages"] += 1
+            self.metrics["received_events"] += len(entries)
+        return entries
+
+    def ack(self, ids):
+        """Acknowledge handled entries.
+        """
+        if not ids:
+            return 0
+        n = self._redis.execute_command("XACK", self.stream, self.group,
+                                        *ids)
+        self.metrics["acked"] += n
+        return n
+
+    def claim(self, min_idle=None):
+        """Take over the pending entries of the other consumers of the
+        group which are idle for min_idle (claim_idle) milliseconds,
+        they are read with read(pending=True).
+        Returns the number of claimed entries.
+        """
+        if min_idle is None:
+            min_idle = self.claim_idle
+        if not self._group_created:
+            self.create_group()
+        claimed = 0
+        start = "-"
+        while True:
+            res = self._redis.execute_command(
+                "XPENDING", self.stream, self.group, start, "+",
+                self.batch_size)
+            # Rows of (entry id, consumer, idle ms, deliveries)
+            res = [(r["message_id"], r["consumer"], r["time_since_delivered"])
+                   if isinstance(r, dict) else r for r in res]
+            ids = [_decode(r[0]) for r in res
+                   if _decode(r[1]) != self.consumer and r[2] >= min_idle]
+            if ids:
+                claimed += len(self._redis.execute_command(
+                    "XCLAIM", self.stream, self.group, self.consumer,
+                    min_idle, *(ids + ["JUSTID"])))
+            if len(res) < self.batch_size:
+                break
+            # The entry id after the last one
+            ms, seq = _decode(res[-1][0]).split("-")
+            start = "{}-{}".format(ms, int(seq) + 1)
+        self.metrics["claimed"] += claimed
+        return claimed
+
+    def consume(self, callback, count=None, block=None):
+        """Handle one batch: callback(events) gets a list of DataEvents,
+        the batch is acknowledged if it returns without an exception.
+        Returns the number of events.
+        """
+        entries = self.read(count=count, block=block)
+        if not entries:
+            return 0
+        callback([ev for _, ev in entries])
+        self.ack([i for i, _ in entries])
+        return len(entries)
+
+    def register_callback(self, key, callback):
+        key = "{}".format(key)
+        self._callbacks[key] = callback
+        self.start()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if not self._group_created:
+            self.create_group()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the consumer thread (within block milliseconds).
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+
+    def _run(self):
+        try:
+            self.claim()
+        except Exception:
+            logger.exception("Claiming events failed")
+        # Unacknowledged entries of an earlier run (and the claimed
+        # ones) first, each of them once
+        pending = "0"
+        while not self._stop.is_set():
+            try:
+                if pending is not None:
+                    entries = self.read(pending=True, start=pending)
+                else:
+                    entries = self.read(block=self.block)
+            except Exception:
+                logger.exception("Reading events failed")
+                self._stop.wait(1.0)
+                continue
+            if pending is not None:
+                pending = entries[-1][0] if entries else None
+            self._route(entries)
+
+    def _route(self, entries):
+        handled = []
+        for entry_id, event in entries:
+            failed = False
+            for pattern, callback in list(self._callbacks.items()):
+                if fnmatchcase(event.key, pattern):
+                    try:
+                        callback(key=event.key, event=event)
+                    except Exception:
+                        # The entry stays pending (delivered again after
+                        # a restart), it does not block the stream
+                        t, value, traceback = sys.exc_info()
+                        self._last_error = "{}\n{}\n{}".format(
+                            t, value, traceback)
+                        logger.error(self._last_error)
+                        failed = True
+            if failed:
+                self.metrics["failed"] += 1
+            else:
+                handled.append(entry_id)
+        self.ack(handled)
@@ -3,17 +3,39 @@
 
 from os import environ
 import logging
+import threading
+import json
+import zlib
 from .client import TSDB
-from flask import (
-    _app_ctx_stack as stack,
-)
+from .ingest import LineProtocolParser
 
 logger = logging.getLogger(__name__)
 
+try:
+    _STRING_TYPES = (str, unicode)  # Python 2
+except NameError:
+    _STRING_TYPES = (str, )
+
+
+TSDB_SETTINGS = ["REDIS_PORT", "REDIS_HOST", "REDIS_DB", "SQLITE_FILE",
+                 "MMAP_DIRECTORY", "LSM_DIRECTORY",
+                 "CASSANDRA_PORT", "CASSANDRA_HOST", "CASSANDRA_PARTITION",
+                 "ENABLE_CACHING", "ENABLE_EVENTS",
+                 "EVENT_BACKEND", "EVENT_BATCH_WINDOW", "EVENT_BINARY",
+                 "ENABLE_COMPACTION", "COMPACTION_DELAY",
+                 "RETENTION", "RETENTION_INTERVAL",
+                 "QUERY_WORKERS", "QUERY_PARTITION",
+                 "LATEST_CACHE_SIZE", "LATEST_LOCAL",
+                 "CONTINUOUS_QUERIES", "CONTINUOUS_QUERIES_SYNC",
+                 "SHARDS", "SHARD_REPLICAS",
+                 "METRICS", "METRICS_PREFIX", "STATSD_HOST", "STATSD_PORT"]
+
 
 class FlaskTSDB(object):
     """TSDB Extension for Flask"""
     def __init__(self, app=None):
+        self._db = None
+        self._lock = threading.Lock()
         self.app = app
         if app is not None:
             self.init_app(app)
@@ -26,10 +48,36 @@ class FlaskTSDB(object):
         self.app.config.setdefault('REDIS_HOST', "localhost")
         self.app.config.setdefault('REDIS_DB', 0)
 
+        self.app.config.setdefault('SQLITE_FILE', "pytsdb.db3")
+        self.app.config.setdefault('MMAP_DIRECTORY', "pytsdb_data")
+        self.app.config.setdefault('LSM_DIRECTORY', "pytsdb_lsm")
+
         self.app.config.setdefault('CASSANDRA_PORT', 9042)
         self.app.config.setdefault('CASSANDRA_HOST', "localhost")
+        self.app.config.setdefault('CASSANDRA_PARTITION', None)
         self.app.config.setdefault('ENABLE_CACHING', True)
         self.app.config.setdefault('ENABLE_EVENTS', True)
+        self.app.config.setdefault('EVENT_BACKEND', "pubsub")
+        self.app.config.setdefault('EVENT_BATCH_WINDOW', None)
+        self.app.config.setdefault('EVENT_BINARY', False)
+        self.app.config.setdefault('ENABLE_COMPACTION', False)
+        self.app.config.setdefault('COMPACTION_DELAY', 60)
+        self.app.config.setdefault('RETENTION', {})
+        self.app.config.setdefault('RETENTION_INTERVAL', 3600)
+        self.app.config.setdefault('QUERY_WORKERS', 1)
+        self.app.config.setdefault('QUERY_PARTITION', 30 * 24 * 60 * 60)
+        self.app.config.setdefault('LATEST_CACHE_SIZE', 10000)
+        self.app.config.setdefault('LATEST_LOCAL', False)
+        self.app.config.setdefault('CONTINUOUS_QUERIES', [])
+        self.app.config.setdefault('CONTINUOUS_QUERIES_SYNC', True)
+        self.app.config.setdefault('SHARDS', {})
+        self.app.config.setdefault('SHARD_REPLICAS', 100)
+        self.app.config.setdefault('METRICS', None)
+        self.app.config.setdefault('METRICS_PREFIX', "pytsdb")
+        self.app.config.setdefault('STATSD_HOST', "localhost")
+        self.app.config.setdefault('STATSD_PORT', 8125)
+
+        self.app.config.setdefault('TSDB_CHUNK_SIZE', 1000)
 
     def check_settings(self):
         """Check all user settings."""
@@ -46,22 +94,23 @@ class FlaskTSDB(object):
         self.init_settings()
         self.check_settings()
 
+    def _create_db(self):
+        settings = dict((k, self.app.config[k]) for k in TSDB_SETTINGS)
+        return TSDB(STORAGE=self.app.config["STORAGE"], **settings)
+
     @property
     def db(self):
-        ctx = stack.top
-        if ctx is not None:
-            if not hasattr(ctx, 'tsdb_connection'):
-                ctx.tsdb_connection = TSDB(
-                    STORAGE=self.app.config["STORAGE"],
-                    REDIS_PORT=self.app.config["REDIS_PORT"],
-                    REDIS_HOST=self.app.config["REDIS_HOST"],
-                    REDIS_DB=self.app.config["REDIS_DB"],
-                    CASSANDRA_PORT=self.app.config["CASSANDRA_PORT"],
-                    CASSANDRA_HOST=self.app.config["CASSANDRA_HOST"],
-                    ENABLE_CACHING=self.app.config["ENABLE_CACHING"],
-                    ENABLE_EVENTS=self.app.config["ENABLE_EVENTS"])
-            return ctx.tsdb_connection
-        raise RuntimeError("No Flask Context")
+        """The TSDB instance of this process.
+        It is created on first access and shared by all app contexts.
+        """
+        from flask import _app_ctx_stack as stack
+        if stack.top is None:
+            raise RuntimeError("No Flask Context")
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    self._db = self._create_db()
+        return self._db
 
     def __getattr__(self, item):
         """Redirect function calls to db instance.
@@ -70,3 +119,154 @@ class FlaskTSDB(object):
         if callable(result):
             return result
         return getattr(self, item)
+
+    def create_blueprint(self, name="tsdb", import_name=__name__):
+        """
+        Create a blueprint with the HTTP API.
+
+        POST /ingest          JSON ({"key": ..., "data": [[ts, v], ...]}
+                              or a list of those) or Influx line protocol
+                              (text/plain, "cpu,host=a value=0.5 60",
+                              see LineProtocolParser), precision=s|ms|us|ns
+        GET  /query/<key>     ts_min, ts_max, format=json|csv|ndjson
+        GET  /stats/<key>     stats of one key
+        GET  /stats           stats of all keys given with ?key=
+        GET  /metrics         prometheus text (METRICS with "memory")
+
+        Request bodies and responses can be gzip encoded.
+
+        :param str name: The blueprint name.
+        """
+        from flask import Blueprint, Response, request, jsonify, abort
+        bp = Blueprint(name, import_name)
+
+        @bp.route("/ingest", methods=["POST"])
+        def ingest():
+            body = request.get_data()
+            try:
+                if request.headers.get("Content-Encoding", "") == "gzip":
+                    body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+                text = body.decode("utf-8")
+            except (zlib.error, UnicodeDecodeError) as e:
+                abort(400, str(e))
+            try:
+                if request.mimetype == "application/json":
+                    inserts = _parse_json_inserts(text)
+                else:
+                    inserts = _parse_line_protocol(
+                        body, request.args.get("precision", "s"))
+                res = self.db.insert_bulk(inserts)
+            except ValueError as e:
+                abort(400, str(e))
+            summary = {"keys": len(res), "count": 0, "appended": 0,
+                       "inserted": 0}
+            for stats in res:
+                for k in ["count", "appended", "inserted"]:
+                    summary[k] += stats[k]
+            return jsonify(summary)
+
+        @bp.route("/query/<key>", methods=["GET"])
+        def query(key):
+            try:
+                ts_min = int(request.args.get("ts_min", 0))
+                ts_max = int(request.args.get("ts_max", (2**31) - 1))
+                chunk_size = int(request.args.get(
+                    "chunk_size", self.app.config["TSDB_CHUNK_SIZE"]))
+            except ValueError:
+                abort(400, "invalid query parameter")
+            fmt = request.args.get("format", "json")
+            result = self.db.query(key, ts_min, ts_max)
+            if fmt == "json":
+                body = result.iter_json(chunk_size)
+                mimetype = "application/json"
+            elif fmt == "csv":
+                body = result.iter_csv(chunk_size)
+                mimetype = "text/csv"
+            elif fmt == "ndjson":
+                body = result.iter_ndjson(chunk_size)
+                mimetype = "application/x-ndjson"
+            else:
+                abort(400, "invalid format")
+            return _stream(body, mimetype)
+
+        @bp.route("/stats/<key>", methods=["GET"])
+        def stats(key):
+            s = self.db.stats(key)
+            if s is None:
+                abort(404)
+            return jsonify(s)
+
+        @bp.route("/stats", methods=["GET"])
+        def stats_bulk():
+            keys = request.args.getlist("key")
+            return Response(json.dumps(self.db.stats_bulk(keys)),
+                            mimetype="application/json")
+
+        @bp.route("/metrics", methods=["GET"])
+        def metrics():
+            m = self.db.metrics
+            sink = m.memory() if m is not None else None
+            if sink is None:
+                abort(404)
+            return Response(
+                sink.prometheus(self.app.config["METRICS_PREFIX"]),
+                content_type="text/plain; version=0.0.4; charset=utf-8")
+
+        return bp
+
+
+def _parse_line_protocol(body, precision):
+    # A request with an invalid line is rejected as a whole
+    parser = LineProtocolParser(precision)
+    parser.feed(body)
+    parser.close()
+    if parser.metrics["errors"] > 0:
+        raise ValueError("{} invalid lines".format(parser.metrics["errors"]))
+    return parser.flush()
+
+
+def _parse_json_inserts(body):
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = [payload]
+    if not isinstance(payload, list):
+        raise ValueError("object or list of objects needed")
+    inserts = []
+    for p in payload:
+        if not isinstance(p, dict) or "key" not in p or "data" not in p:
+            raise ValueError("key and data needed")
+        if not isinstance(p["key"], _STRING_TYPES):
+            raise ValueError("key must be a string")
+        if not isinstance(p["data"], list):
+            raise ValueError("data must be a list of [ts, value] pairs")
+        try:
+            data = [(int(ts), _json_value(v)) for ts, v in p["data"]]
+        except TypeError:
+            raise ValueError("data must be a list of [ts, value] pairs")
+        inserts.append({"key": p["key"], "data": data})
+    return inserts
+
+
+def _json_value(v):
+    # A number or a list of numbers (tuple series)
+    if isinstance(v, list):
+        return tuple(float(x) for x in v)
+    return float(v)
+
+
+def _gzip(chunks):
+    c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = c.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield c.flush()
+
+
+def _stream(chunks, mimetype):
+    from flask import Response, request
+    if "gzip" in request.accept_encodings:
+        r = Response(_gzip(chunks), mimetype=mimetype)
+        r.headers["Content-Encoding"] = "gzip"
+        return r
+    return Response(chunks, mimetype=mimetype)
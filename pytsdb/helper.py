@@ -126,3 +126,17 @@ def ts_monthly_right(ts):
         days[2] = 29
     ts = int(calendar.timegm(n)) + days[month] * 24 * 60 * 60 - 1
     return ts
+
+
+def match_pattern(patterns, key):
+    """Best pattern for a key: the key itself or the longest
+    matching "prefix*" pattern (None if nothing matches).
+    """
+    if key in patterns:
+        return key
+    best = None
+    for pattern in patterns:
+        if (pattern.endswith("*") and key.startswith(pattern[:-1]) and
+                (best is None or len(pattern) > len(best))):
+            best = pattern
+    return best
@@ -0,0 +1,551 @@
+#!/usr/bin/python
+# coding: utf8
+
+from __future__ import unicode_literals
+
+import re
+import sys
+import time
+import array
+import socket
+import struct
+import logging
+import multiprocessing
+import signal
+import zlib
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+from .resources import registry
+
+logger = logging.getLogger(__name__)
+
+
+def shard(key, shards):
+    """Stable shard of a key (the same in every process).
+    """
+    key = key.lower()
+    if not isinstance(key, bytes):
+        key = key.encode("utf-8")
+    return (zlib.crc32(key) & 0xffffffff) % shards
+
+
+class ParallelIngestor(object):
+    """Multi-process ingest.
+
+    Inserts are sharded by a hash of the key onto worker processes,
+    every worker owns a TSDB (created with these settings).
+    All inserts of a key go through one worker in order, so there is
+    no locking between the workers. Inserts are sent in batches of
+    batch_size, at most queue_size batches are queued per worker,
+    insert blocks if a worker is behind (back-pressure).
+    A worker which fails (or dies) raises RuntimeError in the parent.
+    """
+    # Seconds between the checks of the worker processes while waiting
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, workers=None, batch_size=100, queue_size=16,
+                 **settings):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.settings = settings
+        self._buffers = [[] for _ in range(self.workers)]
+        self._queues = [multiprocessing.Queue(queue_size)
+                        for _ in range(self.workers)]
+        self._results = multiprocessing.Queue()
+        self._flushes = 0
+        self._stats = None
+        self._processes = []
+        for i in range(self.workers):
+            p = multiprocessing.Process(
+                target=_worker, args=(i, self._queues[i], self._results,
+                                      settings))
+            p.daemon = True
+            p.start()
+            self._processes.append(p)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._stats is not None
+
+    def insert(self, key, data, timeout=None):
+        """Queue an insert, blocks while the worker queue is full.
+        Raises queue.Full after timeout seconds.
+        """
+        if self.closed:
+            raise RuntimeError("ingestor closed")
+        i = shard(key, self.workers)
+        self._buffers[i].append((key, data))
+        if len(self._buffers[i]) >= self.batch_size:
+            self._send(i, timeout)
+
+    def insert_bulk(self, inserts, timeout=None):
+        for i in inserts:
+            self.insert(i["key"], i["data"], timeout)
+
+    def _send(self, i, timeout=None):
+        batch = self._buffers[i]
+        if batch:
+            self._put(i, ("insert", batch), timeout)
+            self._buffers[i] = []
+
+    def _put(self, i, msg, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = self._wait(deadline)
+            try:
+                self._queues[i].put(msg, timeout=wait)
+                return
+            except queue.Full:
+                if wait < self.POLL_INTERVAL:
+                    raise
+                # Nobody takes from the queue of a dead worker
+                self._check_alive([i])
+
+    def _wait(self, deadline):
+        if deadline is None:
+            return self.POLL_INTERVAL
+        return max(0, min(self.POLL_INTERVAL, deadline - time.time()))
+
+    def _check_alive(self, workers):
+        for i in workers:
+            if not self._processes[i].is_alive():
+                raise RuntimeError("ingest worker {} died (exit code {})"
+                                   .format(i, self._processes[i].exitcode))
+
+    def flush(self, timeout=None):
+        """Wait until all queued inserts are written.
+        Returns the stats of all workers.
+        """
+        if self.closed:
+            return self.stats()
+        self._flushes += 1
+        token = self._flushes
+        for i in range(self.workers):
+            self._send(i, timeout)
+            self._put(i, ("flush", token), timeout)
+        return self._collect("flush", token, timeout)
+
+    def close(self, timeout=None):
+        """Write all queued inserts and stop the workers.
+        Workers still running after timeout seconds are terminated.
+        Returns the stats of all workers.
+        """
+        if self.closed:
+            return self.stats()
+        try:
+            for i in range(self.workers):
+                self._send(i, timeout)
+                self._put(i, None, timeout)
+            self._stats = self._collect("done", None, timeout)
+        finally:
+            for p in self._processes:
+                # After a failure the workers are not waited for
+                p.join(timeout if self._stats is not None else 0)
+                if p.is_alive():
+                    logger.warning("Terminating worker {}".format(p.pid))
+                    p.terminate()
+        return self.stats()
+
+    def _collect(self, kind, token, timeout):
+        stats = {}
+        deadline = None if timeout is None else time.time() + timeout
+        while len(stats) < self.workers:
+            wait = self._wait(deadline)
+            try:
+                k, t, s = self._results.get(timeout=wait)
+            except queue.Empty:
+                if wait < self.POLL_INTERVAL:
+                    raise
+                # Results sent before a worker exited are read first
+                if self._results.empty():
+                    self._check_alive([i for i in range(self.workers)
+                                       if i not in stats])
+                continue
+            if s.get("error") is not None:
+                raise RuntimeError("ingest worker {} failed: {}".format(
+                    s["worker"], s["error"]))
+            if k == kind and t == token:
+                stats[s["worker"]] = s
+        return [stats[i] for i in range(self.workers)]
+
+    def stats(self):
+        """Final stats of all workers (None while running).
+        """
+        if self._stats is None:
+            return None
+        return list(self._stats)
+
+
+def _worker(index, queue, results, settings):
+    # The parent handles SIGINT and stops the workers with close()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    registry.forget()
+    stats = {"worker": index, "inserts": 0, "points": 0, "errors": 0}
+    db = None
+    try:
+        from .client import TSDB
+        db = TSDB(**settings)
+        while True:
+            msg = queue.get()
+            if msg is None:
+                break
+            if msg[0] == "flush":
+                results.put(("flush", msg[1], dict(stats)))
+                continue
+            for key, data in msg[1]:
+                try:
+                    db.insert(key, data)
+                except Exception:
+                    logger.exception("Insert failed: {}".format(key))
+                    stats["errors"] += 1
+                else:
+                    stats["inserts"] += 1
+                    stats["points"] += len(data)
+    except Exception as e:
+        logger.exception("Ingest worker %s failed", index)
+        stats["error"] = repr(e)
+    finally:
+        try:
+            if db is not None:
+                db.close()
+        finally:
+            # The parent waits for this message
+            results.put(("done", None, stats))
+
+
+# Wire formats
+
+# Binary frame: key length, value columns, point count, then the key,
+# count uint32 timestamps and the value columns (count values each, as
+# stored: float32 or uint32), all little-endian.
+_FRAME_HEADER = struct.Struct(str("<HBI"))
+
+# Influx-style line: series[,tag=value...] field=value[,...] [timestamp]
+_LINE_PATTERN = re.compile(
+    br"^[ \t]*([^\s,#][^\s,]*)((?:,[^\s,=]+=[^\s,]+)*) "
+    br"([^\s,=]+)=([^\s,]+)((?:,[^\s,=]+=[^\s,]+)*)(?: (-?\d+))?[ \t\r]*$",
+    re.M)
+_LINE_START = re.compile(br"^[ \t]*[^\s#]", re.M)
+
+PRECISION = {"s": 1, "ms": 10**3, "us": 10**6, "ns": 10**9}
+
+
+def encode_frame(key, timestamps, values):
+    """Binary frame of one key. values is one column, or a list of
+    columns for tuple series (array.array or sequences of floats).
+    """
+    if not isinstance(values, list) or not values or \
+            not isinstance(values[0], (list, tuple, array.array)):
+        values = [values]
+    key = key.encode("utf-8")
+    out = [_FRAME_HEADER.pack(len(key), len(values), len(timestamps)), key]
+    for typecode, column in [("I", timestamps)] + [("f", v) for v in values]:
+        if not isinstance(column, array.array):
+            column = array.array(str(typecode), column)
+        if len(column) != len(timestamps):
+            raise ValueError("columns of different length")
+        if sys.byteorder != "little":
+            column = array.array(column.typecode, column)
+            column.byteswap()
+        out.append(column.tostring())
+    return b"".join(out)
+
+
+class StreamParser(object):
+    """Incremental parser of a wire format.
+
+    feed() takes any chunks of the stream (e.g. socket reads), the
+    points are collected per key as columns. flush() returns them as
+    columnar entries for TSDB.insert_bulk.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._pending = {}
+        self.points = 0
+        self.metrics = {"bytes": 0, "points": 0, "errors": 0}
+
+    def feed(self, data):
+        """Parse a chunk, returns the number of new points.
+        """
+        self._buffer += data
+        self.metrics["bytes"] += len(data)
+        return self._consume()
+
+    def _consume(self):
+        before = self.points
+        consumed = self._parse(self._buffer)
+        del self._buffer[:consumed]
+        self.metrics["points"] += self.points - before
+        return self.points - before
+
+    def close(self):
+        """End of stream, raises ValueError on an incomplete rest.
+        """
+        if self._buffer:
+            raise ValueError("incomplete data at end of stream")
+
+    def flush(self):
+        """Pending points as insert_bulk entries (columns per key).
+        """
+        inserts = [self._entry(key, columns)
+                   for key, columns in self._pending.items()]
+        self._pending = {}
+        self.points = 0
+        return inserts
+
+
+class LineProtocolParser(StreamParser):
+    """Influx-style line protocol.
+
+    Every field is its own series: the key is the series name, the tag
+    values (in order) and the field name joined by "." (the field
+    "value" is left out), e.g. "cpu,host=a load=0.5 60" is a point of
+    "cpu.a.load". Integer values may have the "i" suffix, timestamps
+    are in precision units (default seconds), missing ones are the
+    current time. Invalid lines are counted as errors and skipped.
+    """
+    def __init__(self, precision="s"):
+        super(LineProtocolParser, self).__init__()
+        if precision not in PRECISION:
+            raise ValueError("invalid precision")
+        self._divisor = PRECISION[precision]
+        self._keys = {}
+
+    def close(self):
+        """End of stream, a rest without newline is the last line.
+        """
+        if self._buffer:
+            self._buffer += b"\n"
+            self._consume()
+
+    def _parse(self, buf):
+        end = buf.rfind(b"\n") + 1
+        if end < 1:
+            return 0
+        chunk = bytes(buf[:end])
+        now = int(time.time())
+        divisor = self._divisor
+        parsed = 0
+        # One regex pass over the chunk, no per line split and strip
+        for line in _LINE_PATTERN.findall(chunk):
+            series, tags, name, value, more, ts = line
+            try:
+                ts = int(ts) // divisor if ts else now
+                if ts < 0 or ts > 2**32 - 1:
+                    raise ValueError("timestamp out of range")
+                if value.endswith(b"i"):
+                    value = value[:-1]
+                values = [(name, float(value))]
+                for field in more.split(b",")[1:]:
+                    n, v = field.split(b"=", 1)
+                    if v.endswith(b"i"):
+                        v = v[:-1]
+                    values.append((n, float(v)))
+            except ValueError:
+                continue
+            parsed += 1
+            for name, value in values:
+                columns = self._columns(series, tags, name)
+                columns[0].append(ts)
+                columns[1].append(value)
+            self.points += len(values)
+        # Lines which are not blank or comments but were not parsed
+        errors = len(_LINE_START.findall(chunk)) - parsed
+        if errors > 0:
+            logger.debug("%s invalid lines", errors)
+            self.metrics["errors"] += errors
+        return end
+
+    def _columns(self, series, tags, field):
+        k = (series, tags, field)
+        key = self._keys.get(k)
+        if key is None:
+            parts = [series] + [t.split(b"=", 1)[1]
+                                for t in tags.split(b",")[1:]]
+            if field != b"value":
+                parts.append(field)
+            key = b".".join(parts).decode("utf-8")
+            if len(self._keys) < 100000:
+                self._keys[k] = key
+        columns = self._pending.get(key)
+        if columns is None:
+            columns = self._pending[key] = (array.array(str("I")),
+                                            array.array(str("f")))
+        return columns
+
+    def _entry(self, key, columns):
+        return {"key": key, "timestamps": columns[0], "values": columns[1]}
+
+
+class BinaryParser(StreamParser):
+    """Binary frames (see encode_frame).
+
+    The packed columns are only copied into per key buffers, there are
+    no per point objects. A frame with an invalid header raises
+    ValueError (the stream can not be resynchronized).
+    """
+    def _parse(self, buf):
+        offset = 0
+        while len(buf) - offset >= _FRAME_HEADER.size:
+            key_length, n_columns, count = _FRAME_HEADER.unpack_from(
+                buf, offset)
+            if key_length < 1 or n_columns < 1 or n_columns > 20:
+                raise ValueError("invalid frame")
+            start = offset + _FRAME_HEADER.size + key_length
+            end = start + 4 * count * (n_columns + 1)
+            if end > len(buf):
+                break
+            key = bytes(buf[start - key_length:start]).decode("utf-8")
+            columns = self._pending.get(key)
+            if columns is None:
+                columns = self._pending[key] = [bytearray()
+                                                for _ in range(n_columns + 1)]
+            elif len(columns) != n_columns + 1:
+                raise ValueError("invalid frame: columns of {}".format(key))
+            for i, c in enumerate(columns):
+                c += buf[start + 4 * count * i:start + 4 * count * (i + 1)]
+            self.points += count
+            offset = end
+        return offset
+
+    def _entry(self, key, columns):
+        values = [bytes(c) for c in columns[1:]]
+        return {"key": key, "timestamps": bytes(columns[0]),
+                "values": values[0] if len(values) == 1 else values}
+
+
+PARSERS = {"line": LineProtocolParser, "binary": BinaryParser}
+
+
+def _write(db, parser, stats):
+    for entry in parser.flush():
+        try:
+            db.insert_columns(entry["key"], entry["timestamps"],
+                              entry["values"])
+        except Exception:
+            logger.exception("Insert failed: {}".format(entry["key"]))
+            stats["failed"] += 1
+        else:
+            stats["inserts"] += 1
+
+
+def ingest_stream(db, read, parser, batch_points=10000, flush_interval=1.0):
+    """Parse a stream and insert it in batches of batch_points (or
+    after flush_interval seconds). read() returns the next chunk (b""
+    at the end, None if there is no data yet).
+    Returns the ingest stats (failed: inserts raising an error, errors:
+    invalid lines).
+    """
+    stats = {"inserts": 0, "failed": 0}
+    last = time.time()
+    while True:
+        chunk = read()
+        if chunk == b"":
+            break
+        if chunk:
+            parser.feed(chunk)
+        if (parser.points >= batch_points or
+                time.time() - last >= flush_interval):
+            _write(db, parser, stats)
+            last = time.time()
+    # The rest of the stream (e.g. a last line without newline)
+    parser.close()
+    _write(db, parser, stats)
+    stats.update(parser.metrics)
+    return stats
+
+
+def serve(db, host="127.0.0.1", port=8094, wire="line",
+          batch_points=10000, flush_interval=1.0, **kwargs):
+    """Ingest TCP connections (one at a time) until interrupted.
+    """
+    try:
+        import socketserver
+    except ImportError:  # Python 2
+        import SocketServer as socketserver
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            self.request.settimeout(flush_interval)
+
+            def read():
+                try:
+                    return self.request.recv(65536)
+                except socket.timeout:
+                    return None
+            try:
+                stats = ingest_stream(db, read, PARSERS[wire](**kwargs),
+                                      batch_points, flush_interval)
+            except ValueError:
+                logger.exception("Invalid stream from {}".format(
+                    self.client_address))
+            else:
+                logger.info("Ingested {}: {}".format(self.client_address,
+                                                     stats))
+
+    socketserver.TCPServer.allow_reuse_address = True
+    server = socketserver.TCPServer((host, port), Handler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    return server
+
+
+def main(argv=None):
+    """Ingest line protocol or binary frames from stdin or TCP.
+    """
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(prog="python -m pytsdb.ingest",
+                                     description=main.__doc__)
+    parser.add_argument("--format", choices=sorted(PARSERS), default="line")
+    parser.add_argument("--precision", choices=sorted(PRECISION),
+                        default="s", help="line protocol timestamps")
+    parser.add_argument("--listen", metavar="HOST:PORT",
+                        help="TCP address (default: read stdin)")
+    parser.add_argument("--batch", type=int, default=10000,
+                        help="points per insert batch")
+    parser.add_argument("--storage", default="memory")
+    parser.add_argument("--setting", action="append", default=[],
+                        metavar="NAME=JSON", help="TSDB setting")
+    args = parser.parse_args(argv)
+
+    from .client import TSDB
+    settings = {"ENABLE_CACHING": False, "ENABLE_EVENTS": False}
+    for s in args.setting:
+        name, value = s.split("=", 1)
+        try:
+            settings[name] = json.loads(value)
+        except ValueError:
+            settings[name] = value
+    db = TSDB(STORAGE=args.storage, **settings)
+    kwargs = {"precision": args.precision} if args.format == "line" else {}
+    try:
+        if args.listen:
+            host, port = args.listen.rsplit(":", 1)
+            serve(db, host, int(port), args.format, args.batch, **kwargs)
+        else:
+            stdin = getattr(sys.stdin, "buffer", sys.stdin)
+            stats = ingest_stream(db, lambda: stdin.read(65536),
+                                  PARSERS[args.format](**kwargs), args.batch)
+            print(json.dumps(stats))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
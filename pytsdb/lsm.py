@@ -0,0 +1,701 @@
+#!/usr/bin/python
+# coding: utf8
+
+from __future__ import unicode_literals
+
+import os
+import re
+import mmap
+import array
+import bisect
+import struct
+import hashlib
+import heapq
+import logging
+import threading
+import zlib
+
+from .storage import Storage
+from .models import Item
+from .errors import NotFoundError, InternalError
+
+logger = logging.getLogger(__name__)
+
+
+try:
+    _view = buffer
+except NameError:  # Python 3
+    def _view(obj, offset, size):
+        return memoryview(obj)[offset:offset + size]
+
+
+TOMBSTONE = 0xffffffff
+
+
+def _size(data):
+    return 0 if data is None else len(data)
+
+
+def _key_bytes(key):
+    if isinstance(key, bytes):
+        return key
+    return key.encode("utf-8")
+
+
+class BloomFilter(object):
+    """Bloom filter over series keys (double hashing of md5)."""
+    __slots__ = ("bits", "k")
+
+    def __init__(self, bits, k=7):
+        self.bits = bits
+        self.k = k
+
+    @classmethod
+    def create(cls, keys, bits_per_key=10, k=7):
+        size = max(8, (len(keys) * bits_per_key + 7) // 8)
+        b = cls(bytearray(size), k)
+        for key in keys:
+            b.add(key)
+        return b
+
+    def _positions(self, key):
+        h1, h2 = struct.unpack(str("<QQ"), hashlib.md5(key).digest())
+        m = len(self.bits) * 8
+        return [(h1 + i * h2) % m for i in range(self.k)]
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key):
+        for p in self._positions(key):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+
+class MemTable(object):
+    """Sorted in-memory buckets per key (newest version only).
+    Deleted buckets are kept as tombstones (data None).
+    """
+    def __init__(self):
+        self.range_keys = {}
+        self.data = {}
+        self.size = 0
+
+    def __len__(self):
+        return sum(len(a) for a in self.range_keys.values())
+
+    def put(self, key, range_key, data):
+        if key not in self.range_keys:
+            self.range_keys[key] = array.array("l")
+            self.data[key] = []
+        a = self.range_keys[key]
+        i = bisect.bisect_left(a, range_key)
+        if i != len(a) and a[i] == range_key:
+            self.size += _size(data) - _size(self.data[key][i])
+            self.data[key][i] = data
+        else:
+            a.insert(i, range_key)
+            self.data[key].insert(i, data)
+            self.size += _size(data) + len(key) + 16
+
+    def get(self, key, range_key):
+        a = self.range_keys.get(key)
+        if a is not None:
+            i = bisect.bisect_left(a, range_key)
+            if i != len(a) and a[i] == range_key:
+                return range_key, self.data[key][i]
+        return None
+
+    def left(self, key, range_key):
+        a = self.range_keys.get(key)
+        if a is not None:
+            i = bisect.bisect_right(a, range_key)
+            if i > 0:
+                return a[i - 1], self.data[key][i - 1]
+        return None
+
+    def right(self, key, range_key):
+        a = self.range_keys.get(key)
+        if a is not None:
+            i = bisect.bisect_left(a, range_key)
+            if i < len(a):
+                return a[i], self.data[key][i]
+        return None
+
+    def first(self, key):
+        a = self.range_keys.get(key)
+        if a:
+            return a[0], self.data[key][0]
+        return None
+
+    def last(self, key):
+        a = self.range_keys.get(key)
+        if a:
+            return a[-1], self.data[key][-1]
+        return None
+
+    def range(self, key, range_min, range_max):
+        a = self.range_keys.get(key)
+        if a is None:
+            return []
+        m = bisect.bisect_left(a, range_min)
+        e = bisect.bisect_right(a, range_max)
+        return [(a[i], self.data[key][i]) for i in range(m, e)]
+
+    def records(self):
+        """All (key, range_key, data) sorted."""
+        for key in sorted(self.range_keys):
+            for rk, data in zip(self.range_keys[key], self.data[key]):
+                yield key, rk, data
+
+
+class Segment(object):
+    """Immutable sorted segment file.
+
+    Layout: records (keylen, key, range_key, datalen, data) sorted by
+    (key, range_key) (datalen TOMBSTONE marks a deleted bucket),
+    a sparse index of every INDEX_INTERVAL-th record
+    and of the first record of every key, a bloom filter over the keys
+    and a fixed size footer.
+    """
+    RECORD_HEAD = struct.Struct(str("<I"))
+    RECORD_TAIL = struct.Struct(str("<qI"))
+    INDEX_ENTRY = struct.Struct(str("<qQ"))
+    FOOTER = struct.Struct(str("<QQQI8s"))
+    MAGIC = b"PYTSDBL1"
+    INDEX_INTERVAL = 16
+
+    def __init__(self, path):
+        self.path = path
+        self.seq = int(re.search(r"seg-(\d+)\.sst", path).group(1))
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.mm)
+        (index_offset, bloom_offset, self.count, k,
+         magic) = self.FOOTER.unpack_from(self.mm,
+                                          self.size - self.FOOTER.size)
+        if magic != self.MAGIC:
+            raise InternalError("invalid segment {}".format(path))
+        self.bloom = BloomFilter(bytearray(
+            self.mm[bloom_offset:self.size - self.FOOTER.size]), k)
+        self.index = []
+        self.index_offsets = []
+        self.data_end = index_offset
+        pos = index_offset
+        while pos < bloom_offset:
+            key, pos = self._read_key(pos)
+            range_key, offset = self.INDEX_ENTRY.unpack_from(self.mm, pos)
+            pos += self.INDEX_ENTRY.size
+            self.index.append((key, range_key))
+            self.index_offsets.append(offset)
+
+    @classmethod
+    def write(cls, path, records):
+        """Write sorted (key, range_key, data) records to a new segment.
+        """
+        tmp = path + ".tmp"
+        index = []
+        keys = []
+        count = 0
+        with open(tmp, "wb") as f:
+            offset = 0
+            for key, range_key, data in records:
+                new_key = not keys or keys[-1] != key
+                if new_key:
+                    keys.append(key)
+                if new_key or count % cls.INDEX_INTERVAL == 0:
+                    index.append((key, range_key, offset))
+                if data is None:
+                    data = b""
+                    dl = TOMBSTONE
+                else:
+                    dl = len(data)
+                rec = (cls.RECORD_HEAD.pack(len(key)) + key +
+                       cls.RECORD_TAIL.pack(range_key, dl))
+                f.write(rec)
+                f.write(data)
+                offset += len(rec) + len(data)
+                count += 1
+            index_offset = offset
+            for key, range_key, o in index:
+                f.write(cls.RECORD_HEAD.pack(len(key)) + key +
+                        cls.INDEX_ENTRY.pack(range_key, o))
+                offset += cls.RECORD_HEAD.size + len(key) + \
+                    cls.INDEX_ENTRY.size
+            bloom = BloomFilter.create(keys)
+            f.write(bytes(bloom.bits))
+            f.write(cls.FOOTER.pack(index_offset, offset, count, bloom.k,
+                                    cls.MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, path)
+        return cls(path)
+
+    def _read_key(self, pos):
+        kl = self.RECORD_HEAD.unpack_from(self.mm, pos)[0]
+        pos += self.RECORD_HEAD.size
+        return self.mm[pos:pos + kl], pos + kl
+
+    def _read(self, pos):
+        key, pos = self._read_key(pos)
+        range_key, dl = self.RECORD_TAIL.unpack_from(self.mm, pos)
+        pos += self.RECORD_TAIL.size
+        if dl == TOMBSTONE:
+            return key, range_key, None, pos
+        return key, range_key, _view(self.mm, pos, dl), pos + dl
+
+    def records(self, key=None, range_min=None):
+        """Records (key, range_key, data) from the position of
+        (key, range_min) (or the beginning) to the end of the segment.
+        """
+        pos = 0
+        if key is not None:
+            i = bisect.bisect_right(self.index, (key, range_min)) - 1
+            if i >= 0:
+                pos = self.index_offsets[i]
+        while pos < self.data_end:
+            k, rk, data, pos = self._read(pos)
+            yield k, rk, data
+
+    def _key_records(self, key, range_min=-(2**63)):
+        if key not in self.bloom:
+            return
+        for k, rk, data in self.records(key, range_min):
+            if k < key or (k == key and rk < range_min):
+                continue
+            if k != key:
+                return
+            yield rk, data
+
+    def get(self, key, range_key):
+        for rk, data in self._key_records(key, range_key):
+            if rk == range_key:
+                return rk, data
+            return None
+        return None
+
+    def range(self, key, range_min, range_max):
+        out = []
+        for rk, data in self._key_records(key, range_min):
+            if rk > range_max:
+                break
+            out.append((rk, data))
+        return out
+
+    def left(self, key, range_key):
+        res = None
+        # Start at the index entry before range_key
+        i = bisect.bisect_right(self.index, (key, range_key)) - 1
+        if i < 0 or self.index[i][0] != key:
+            return None
+        for rk, data in self._key_records(key, self.index[i][1]):
+            if rk > range_key:
+                break
+            res = (rk, data)
+        return res
+
+    def right(self, key, range_key):
+        for rk, data in self._key_records(key, range_key):
+            return rk, data
+        return None
+
+    def first(self, key):
+        return self.right(key, -(2**63))
+
+    def last(self, key):
+        return self.left(key, 2**63 - 1)
+
+
+class LSMStorage(Storage):
+    """Log-structured local storage.
+
+    Bucket writes go to a write ahead log and a sorted memtable.
+    Full memtables are flushed (in a background thread) into immutable
+    sorted segment files with a sparse index and a bloom filter.
+    Segments of the same size tier are merged (size-tiered compaction).
+    Reads merge memtables and segments, the newest version wins.
+    Deletes write tombstones, they are dropped once a merge includes
+    the oldest segment.
+    """
+    WAL_RECORD = struct.Struct(str("<IIqI"))
+    MEMTABLE_SIZE = 4 << 20
+    COMPACTION_TIER_SIZE = 4
+    COMPACTION_TIER_FACTOR = 4
+
+    def __init__(self, directory, memtable_size=None, background=True,
+                 sync=False):
+        self.directory = directory
+        self.memtable_size = memtable_size or self.MEMTABLE_SIZE
+        self.background = background
+        self.sync = sync
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._segments = []
+        self._immutable = []
+        self._memtable = None
+        self._wal = None
+        self._seq = 0
+        self._thread = None
+        self._open()
+
+    @property
+    def namespace(self):
+        return "lsm:{}".format(os.path.abspath(self.directory))
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _open(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        files = sorted(os.listdir(self.directory))
+        seqs = [0]
+        for f in files:
+            m = re.match(r"^seg-(\d+)\.sst$", f)
+            if m:
+                self._segments.append(Segment(self._path(f)))
+                seqs.append(int(m.group(1)))
+            elif f.endswith(".tmp") or f.endswith(".merge"):
+                os.remove(self._path(f))
+        self._segments.sort(key=lambda s: s.seq)
+        # Replay left over logs, each one becomes a segment
+        for f in files:
+            m = re.match(r"^wal-(\d+)\.log$", f)
+            if m:
+                seq = int(m.group(1))
+                seqs.append(seq)
+                memtable = self._replay(self._path(f))
+                if len(memtable) > 0:
+                    self._write_segment(seq, memtable)
+                os.remove(self._path(f))
+        self._seq = max(seqs)
+        self._new_memtable()
+
+    def _replay(self, path):
+        memtable = MemTable()
+        with open(path, "rb") as f:
+            raw = f.read()
+        pos = 0
+        size = self.WAL_RECORD.size
+        while pos + size <= len(raw):
+            crc, kl, range_key, dl = self.WAL_RECORD.unpack_from(raw, pos)
+            end = pos + size + kl + (0 if dl == TOMBSTONE else dl)
+            if end > len(raw):
+                break
+            key = raw[pos + size:pos + size + kl]
+            data = raw[pos + size + kl:end]
+            if zlib.crc32(key + data) & 0xffffffff != crc:
+                logger.warning("Corrupt wal record in {}".format(path))
+                break
+            memtable.put(key, range_key, None if dl == TOMBSTONE else data)
+            pos = end
+        return memtable
+
+    def _new_memtable(self):
+        self._seq += 1
+        self._memtable = MemTable()
+        self._memtable_seq = self._seq
+        self._wal = open(self._path("wal-{:08d}.log".format(self._seq)),
+                         "ab")
+
+    def _write_segment(self, seq, memtable):
+        path = self._path("seg-{:08d}.sst".format(seq))
+        segment = Segment.write(path, memtable.records())
+        with self._lock:
+            self._segments = [s for s in self._segments if s.seq != seq]
+            self._segments.append(segment)
+            self._segments.sort(key=lambda s: s.seq)
+        return segment
+
+    def _createTable(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _dropTable(self):
+        self.wait()
+        with self._lock:
+            self._wal.close()
+            for f in os.listdir(self.directory):
+                if re.match(r"^(seg-\d+\.sst|wal-\d+\.log)(\.tmp)?$", f):
+                    os.remove(self._path(f))
+            self._segments = []
+            self._immutable = []
+            self._new_memtable()
+
+    def _ping(self):
+        if not os.path.isdir(self.directory):
+            raise IOError("directory not found")
+
+    def close(self):
+        """Flush the memtable and wait for background work.
+        """
+        self.flush()
+        self.wait()
+        with self._lock:
+            if self._wal is not None:
+                self._wal.close()
+
+    def wait(self):
+        """Wait for a running background flush/compaction.
+        """
+        t = self._thread
+        if t is not None:
+            t.join()
+
+    def _to_item(self, key, data):
+        return Item.from_db_data(key, data)
+
+    def _from_item(self, item):
+        return {"key": item.key,
+                "range_key": item.range_key,
+                "data": item.to_string()}
+
+    # Writes
+
+    def _put(self, key, range_key, data):
+        key = _key_bytes(key)
+        if data is None:
+            raw = b""
+            dl = TOMBSTONE
+        else:
+            raw = data = bytes(data)
+            dl = len(data)
+        with self._lock:
+            self._wal.write(self.WAL_RECORD.pack(
+                zlib.crc32(key + raw) & 0xffffffff, len(key), range_key,
+                dl) + key + raw)
+            self._wal.flush()
+            if self.sync:
+                os.fsync(self._wal.fileno())
+            self._memtable.put(key, range_key, data)
+            if self._memtable.size >= self.memtable_size:
+                self._rotate()
+
+    def _insert(self, key, range_key, data):
+        self._put(key, range_key, data)
+
+    def _update(self, key, range_key, data):
+        self._put(key, range_key, data)
+
+    def _delete(self, key, range_key):
+        self._get(key, range_key)
+        self._put(key, range_key, None)
+
+    def _delete_range(self, key, range_min, range_max):
+        # A tombstone for every live bucket in the range
+        for range_key in self._range_keys(key, range_min, range_max):
+            self._put(key, range_key, None)
+
+    def _rotate(self):
+        self._wal.close()
+        self._immutable.append((self._memtable_seq, self._memtable))
+        self._new_memtable()
+        if self.background:
+            self._start_background()
+        else:
+            self._flush_immutable()
+
+    def _start_background(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._flush_immutable)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def flush(self):
+        """Flush the active memtable to a segment (synchronous).
+        """
+        with self._lock:
+            if len(self._memtable) > 0:
+                self._wal.close()
+                self._immutable.append((self._memtable_seq, self._memtable))
+                self._new_memtable()
+        self._flush_immutable()
+
+    def _flush_immutable(self):
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self._immutable:
+                        break
+                    seq, memtable = self._immutable[0]
+                self._write_segment(seq, memtable)
+                with self._lock:
+                    self._immutable.pop(0)
+                os.remove(self._path("wal-{:08d}.log".format(seq)))
+            self._compact_tiers()
+
+    # Compaction
+
+    def _tier(self, segment):
+        tier = 0
+        size = segment.size
+        base = self.memtable_size
+        while size > base:
+            size //= self.COMPACTION_TIER_FACTOR
+            tier += 1
+        return tier
+
+    def _compact_tiers(self):
+        while True:
+            with self._lock:
+                segments = list(self._segments)
+            run = self._find_run(segments)
+            if run is None:
+                return
+            self._merge(run)
+
+    def _find_run(self, segments):
+        """Oldest run of adjacent segments in the same size tier."""
+        i = 0
+        while i < len(segments):
+            tier = self._tier(segments[i])
+            j = i
+            while j < len(segments) and self._tier(segments[j]) == tier:
+                j += 1
+            if j - i >= self.COMPACTION_TIER_SIZE:
+                return segments[i:j]
+            i = j
+        return None
+
+    def compact(self):
+        """Merge all segments into one (major compaction).
+        """
+        self.flush()
+        with self._flush_lock:
+            with self._lock:
+                segments = list(self._segments)
+            if len(segments) > 1:
+                self._merge(segments)
+
+    def _merge(self, run):
+        # Newest segment first, so its version wins on equal keys
+        def numbered(n, segment):
+            for k, rk, data in segment.records():
+                yield k, rk, n, data
+        iterators = [numbered(n, s) for n, s in enumerate(reversed(run))]
+        with self._lock:
+            # Nothing older can be shadowed by a tombstone
+            drop_tombstones = run[0] is self._segments[0]
+
+        def merged():
+            last = None
+            for k, rk, n, data in heapq.merge(*iterators):
+                if (k, rk) != last:
+                    last = (k, rk)
+                    if data is None and drop_tombstones:
+                        continue
+                    yield k, rk, data
+        seq = run[-1].seq
+        tmp_path = self._path("seg-{:08d}.sst.merge".format(seq))
+        segment = Segment.write(tmp_path, merged())
+        path = run[-1].path
+        os.rename(tmp_path, path)
+        segment.path = path
+        segment.seq = seq
+        with self._lock:
+            self._segments = [s for s in self._segments if s not in run]
+            self._segments.append(segment)
+            self._segments.sort(key=lambda s: s.seq)
+        for s in run[:-1]:
+            os.remove(s.path)
+        logger.debug("Merged %s segments into %s", len(run), path)
+
+    # Reads
+
+    def _sources(self):
+        """Memtables and segments, newest first."""
+        with self._lock:
+            sources = [self._memtable]
+            sources += [m for _, m in reversed(self._immutable)]
+            sources += list(reversed(self._segments))
+        return sources
+
+    def _keys(self):
+        keys = set()
+        for s in self._sources():
+            if isinstance(s, MemTable):
+                keys.update(s.range_keys)
+            else:
+                # The index has the first record of every key
+                keys.update(k for k, _ in s.index)
+        out = []
+        for key in sorted(keys):
+            try:
+                self._first(key)
+            except NotFoundError:
+                continue
+            out.append(key.decode("utf-8"))
+        return out
+
+    def _get(self, key, range_key):
+        key = _key_bytes(key)
+        for s in self._sources():
+            r = s.get(key, range_key)
+            if r is not None:
+                if r[1] is None:
+                    break
+                return r[1]
+        raise NotFoundError
+
+    def _best(self, key, func, pick):
+        res = None
+        for s in self._sources():
+            r = func(s)
+            if r is not None and (res is None or pick(r[0], res[0])):
+                res = r
+        if res is None:
+            raise NotFoundError
+        return res
+
+    def _left_record(self, key, range_key):
+        # Newest version of the nearest bucket, skipping tombstones
+        while True:
+            rk, data = self._best(key, lambda s: s.left(key, range_key),
+                                  lambda a, b: a > b)
+            if data is not None:
+                return rk, data
+            range_key = rk - 1
+
+    def _first(self, key):
+        key = _key_bytes(key)
+        range_key = -(2**63)
+        while True:
+            rk, data = self._best(key, lambda s: s.right(key, range_key),
+                                  lambda a, b: a < b)
+            if data is not None:
+                return data
+            range_key = rk + 1
+
+    def _last(self, key):
+        key = _key_bytes(key)
+        return self._left_record(key, 2**63 - 1)[1]
+
+    def _left(self, key, range_key):
+        key = _key_bytes(key)
+        return self._left_record(key, range_key)[1]
+
+    def _merged_range(self, key, range_min, range_max):
+        merged = {}
+        for s in reversed(self._sources()):
+            for rk, data in s.range(key, range_min, range_max):
+                merged[rk] = data
+        return merged
+
+    def _range_keys(self, key, range_min, range_max):
+        merged = self._merged_range(_key_bytes(key), range_min, range_max)
+        return sorted(rk for rk in merged if merged[rk] is not None)
+
+    def _query(self, key, range_min, range_max):
+        key = _key_bytes(key)
+        merged = self._merged_range(key, range_min, range_max)
+        try:
+            rk, data = self._left_record(key, range_min)
+        except NotFoundError:
+            pass
+        else:
+            merged[rk] = data
+        return [merged[rk] for rk in sorted(merged)
+                if merged[rk] is not None]
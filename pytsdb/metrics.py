@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# coding: utf8
+
+from __future__ import unicode_literals
+
+import re
+import time
+import socket
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+clock = getattr(time, "perf_counter", time.time)
+
+# Timers of the write and read path
+TIMERS = ["cache_lookup", "storage_read", "merge", "split", "serialize",
+          "storage_write", "event_publish"]
+
+# Counters (points_written / points_inserted is the write amplification)
+COUNTERS = ["cache_hits", "cache_misses", "points_inserted",
+            "points_written", "buckets_written", "bytes_written"]
+
+_INVALID = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class MemorySink(object):
+    """Counters and timers (count, sum and max seconds) in process,
+    e.g. for the prometheus endpoint.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def timing(self, name, seconds):
+        with self._lock:
+            t = self.timers.get(name)
+            if t is None:
+                self.timers[name] = {"count": 1, "sum": seconds,
+                                     "max": seconds}
+            else:
+                t["count"] += 1
+                t["sum"] += seconds
+                t["max"] = max(t["max"], seconds)
+
+    def snapshot(self):
+        """Copy of all counters and timers.
+        """
+        with self._lock:
+            return {"counters": dict(self.counters),
+                    "timers": dict((k, dict(v))
+                                   for k, v in self.timers.items())}
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.timers = {}
+
+    def prometheus(self, prefix="pytsdb"):
+        """Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = _INVALID.sub("_", "{}_{}_total".format(prefix, name))
+            lines.append("# TYPE {} counter".format(metric))
+            lines.append("{} {}".format(metric, value))
+        for name, t in sorted(snapshot["timers"].items()):
+            metric = _INVALID.sub("_", "{}_{}_seconds".format(prefix, name))
+            lines.append("# TYPE {} summary".format(metric))
+            lines.append("{}_count {}".format(metric, t["count"]))
+            lines.append("{}_sum {!r}".format(metric, t["sum"]))
+            lines.append("# TYPE {}_max gauge".format(metric))
+            lines.append("{}_max {!r}".format(metric, t["max"]))
+        return "\n".join(lines) + "\n"
+
+
+class StatsdSink(object):
+    """Sends counters and timers (milliseconds) to statsd over UDP.
+    Send errors are ignored, metrics never fail the caller.
+    """
+    def __init__(self, host="localhost", port=8125, prefix="pytsdb"):
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _send(self, line):
+        try:
+            self._socket.sendto(line.encode("utf8"), self.address)
+        except (socket.error, IOError) as e:
+            logger.debug("statsd send failed: %s", e)
+
+    def incr(self, name, value=1):
+        self._send("{}.{}:{}|c".format(self.prefix, name, value))
+
+    def timing(self, name, seconds):
+        self._send("{}.{}:{:.3f}|ms".format(self.prefix, name,
+                                             seconds * 1000))
+
+    def close(self):
+        self._socket.close()
+
+
+class Metrics(object):
+    """Fans counters and timers out to the sinks. A TSDB without
+    metrics has none of this (db.metrics is None), the hot path only
+    pays for that check.
+    """
+    def __init__(self, sinks, owned=()):
+        self.sinks = list(sinks)
+        # Sinks created from the settings (closed with the metrics)
+        self._owned = list(owned)
+
+    def incr(self, name, value=1):
+        for sink in self.sinks:
+            sink.incr(name, value)
+
+    def timing(self, name, seconds):
+        for sink in self.sinks:
+            sink.timing(name, seconds)
+
+    def memory(self):
+        """The first MemorySink (None if there is none).
+        """
+        for sink in self.sinks:
+            if isinstance(sink, MemorySink):
+                return sink
+        return None
+
+    def close(self):
+        for sink in self._owned:
+            if hasattr(sink, "close"):
+                sink.close()
+
+
+def create_metrics(settings):
+    """Metrics of the TSDB settings (METRICS: sink names "memory",
+    "statsd" or sink objects), None if disabled.
+    """
+    if not settings.get("METRICS"):
+        return None
+    sinks = []
+    owned = []
+    for sink in settings["METRICS"]:
+        if sink == "memory":
+            sink = MemorySink()
+            owned.append(sink)
+        elif sink == "statsd":
+            sink = StatsdSink(host=settings["STATSD_HOST"],
+                              port=settings["STATSD_PORT"],
+                              prefix=settings["METRICS_PREFIX"])
+            owned.append(sink)
+        elif not hasattr(sink, "incr") or not hasattr(sink, "timing"):
+            raise ValueError("invalid metrics sink: {}".format(sink))
+        sinks.append(sink)
+    return Metrics(sinks, owned)
@@ -8,25 +8,46 @@ except ImportError:  # will be 3.x series
     pass
 
 from enum import Enum
-from collections import MutableSequence
 from collections import namedtuple
 
 import bisect
+import itertools
 import logging
 import struct
 import array
 import hashlib
 import json
+import sys
 
 from .helper import ts_daily_left, ts_daily_right
 from .helper import ts_hourly_left, ts_hourly_right
 from .helper import ts_weekly_left, ts_weekly_right
 from .helper import ts_monthly_left, ts_monthly_right
+from .helper import match_pattern
 
 
 Aggregation = namedtuple('Aggregation', ['min', 'max', 'sum', 'count'])
 
 
+def _amp(x):
+    return max(x) - min(x)
+
+
+def _mean(x):
+    return sum(x) / len(x)
+
+
+# Aggregation functions (name -> function of a list of values)
+AGGREGATION_FUNCTIONS = {
+    "sum": sum,
+    "count": len,
+    "min": min,
+    "max": max,
+    "amp": _amp,
+    "mean": _mean,
+}
+
+
 class BucketType(Enum):
     dynamic = 1
     hourly = 2
@@ -45,6 +66,17 @@ class ItemType(Enum):
     basic_aggregation = 6
 
 
+# Bytes per point (timestamp + value)
+POINT_SIZE = {
+    ItemType.raw_float: 8,
+    ItemType.raw_int: 8,
+    ItemType.tuple_float_2: 12,
+    ItemType.tuple_float_3: 16,
+    ItemType.tuple_float_4: 20,
+    ItemType.basic_aggregation: 20,
+}
+
+
 class Stats(dict):
     def __init__(self, key, ts_min, ts_max, count, *args, **kwargs):
         super(Stats, self).__init__(*args, **kwargs)
@@ -77,11 +109,86 @@ class Stats(dict):
         return cls(**json.loads(s))
 
 
-class TupleArray(MutableSequence):
+def _as_array(typecode, data):
+    """data as array.array of typecode (no copy if it is one).
+    """
+    if isinstance(data, array.array) and data.typecode == typecode:
+        return data
+    return array.array(typecode, data)
+
+
+def _sorted(timestamps, strict=False):
+    """True if the timestamps are ascending (strict: without duplicates).
+    One linear pass, with numpy for larger arrays.
+    """
+    if len(timestamps) > 64 and isinstance(timestamps, array.array):
+        try:
+            import numpy
+        except ImportError:
+            pass
+        else:
+            d = numpy.diff(_numpy_column(timestamps).astype("<i8"))
+            return bool((d > 0).all() if strict else (d >= 0).all())
+    pairs = zip(timestamps, itertools.islice(timestamps, 1, None))
+    if strict:
+        return all(a < b for a, b in pairs)
+    return all(a <= b for a, b in pairs)
+
+
+def _sort_columns(timestamps, columns):
+    """Sort timestamp and value columns by timestamp (stable), only if
+    they are not sorted yet.
+    """
+    if _sorted(timestamps):
+        return timestamps, columns
+    order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+    return (array.array("I", [timestamps[i] for i in order]),
+            [array.array(c.typecode, [c[i] for i in order])
+             for c in columns])
+
+
+def _input_column(typecode, data):
+    """Column input (array.array, numpy array, sequence or little-endian
+    bytes) as array.array of typecode.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        a = array.array(typecode)
+        a.fromstring(bytes(data))
+        if sys.byteorder != "little":
+            a.byteswap()
+        return a
+    if hasattr(data, "dtype"):
+        import numpy
+        if typecode not in "fd" and len(data) > 0 and \
+                (data.min() < 0 or data.max() > 2**32 - 1):
+            raise ValueError("values out of range")
+        a = array.array(typecode)
+        a.fromstring(numpy.ascontiguousarray(data, dtype=typecode).tostring())
+        return a
+    return _as_array(typecode, data)
+
+
+def _json_column(column):
+    """Column for JSON output, NaN and inf (no JSON numbers) as null.
+    """
+    if column.typecode not in "fd":
+        return column
+    # The sum is finite if all values are (checked per chunk in C)
+    total = sum(column)
+    if total - total == 0:
+        return column
+    return ["null" if v - v != 0 else v for v in column]
+
+
+class TupleArray(object):
+    """Sequence of tuples stored as one array per column.
+    No collections ABC base, on Python 2 they have no __slots__.
+    """
+    __slots__ = ("data_type", "tuple_size", "_arrays")
+
     def __init__(self, data_type="f", tuple_size=2):
         if tuple_size < 2 or tuple_size > 20:
             raise ValueError("invalid tuple size (2-20)")
-        super(TupleArray, self).__init__()
         self.data_type = data_type
         self.tuple_size = tuple_size
         self._arrays = [array.array(data_type) for i in range(tuple_size)]
@@ -90,6 +197,10 @@ class TupleArray(MutableSequence):
         return len(self._arrays[0])
 
     def __getitem__(self, ii):
+        if isinstance(ii, slice):
+            t = TupleArray(self.data_type, self.tuple_size)
+            t._arrays = [a[ii] for a in self._arrays]
+            return t
         return tuple(item[ii] for item in self._arrays)
 
     def __delitem__(self, ii):
@@ -97,6 +208,12 @@ class TupleArray(MutableSequence):
             del a[ii]
 
     def __setitem__(self, ii, val):
+        if isinstance(ii, slice) and isinstance(val, TupleArray):
+            if val.tuple_size != self.tuple_size:
+                raise ValueError("tuple size incorrect")
+            for a, b in zip(self._arrays, val._arrays):
+                a[ii] = b
+            return
         if len(val) != len(self._arrays):
             raise ValueError("tuple size incorrect")
 
@@ -104,6 +221,40 @@ class TupleArray(MutableSequence):
             self._arrays[i][ii] = v
         return tuple(item[ii] for item in self._arrays)
 
+    def __iter__(self):
+        return zip(*self._arrays)
+
+    def __reversed__(self):
+        return reversed(list(self))
+
+    def __contains__(self, value):
+        return any(v == value for v in self)
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def index(self, value):
+        for i, v in enumerate(self):
+            if v == value:
+                return i
+        raise ValueError("{} is not in TupleArray".format(value))
+
+    def count(self, value):
+        return sum(1 for v in self if v == value)
+
+    def pop(self, ii=-1):
+        value = self[ii]
+        del self[ii]
+        return value
+
+    def remove(self, value):
+        del self[self.index(value)]
+
+    def reverse(self):
+        for a in self._arrays:
+            a.reverse()
+
     def __str__(self):
         return self.__repr__()
 
@@ -124,6 +275,37 @@ class TupleArray(MutableSequence):
         for i, v in enumerate(val):
             self._arrays[i].append(v)
 
+    def extend(self, values):
+        if isinstance(values, TupleArray):
+            return self.extend_columns(values._arrays)
+        for v in values:
+            self.append(v)
+
+    def column(self, i):
+        """Column i as array.array (no copy).
+        """
+        return self._arrays[i]
+
+    def _check_columns(self, columns):
+        if len(columns) != len(self._arrays):
+            raise ValueError("tuple size incorrect")
+        if len(set(len(c) for c in columns)) > 1:
+            raise ValueError("columns of different length")
+
+    def extend_columns(self, columns):
+        """Append one sequence per column.
+        """
+        self._check_columns(columns)
+        for a, c in zip(self._arrays, columns):
+            a.extend(_as_array(a.typecode, c))
+
+    def insert_columns(self, ii, columns):
+        """Insert one sequence per column at position ii.
+        """
+        self._check_columns(columns)
+        for a, c in zip(self._arrays, columns):
+            a[ii:ii] = _as_array(a.typecode, c)
+
     def tostring(self):
         return b"".join([x.tostring() for x in self._arrays])
 
@@ -136,6 +318,8 @@ class TupleArray(MutableSequence):
 
 
 class Item(object):
+    __slots__ = ("_timestamps", "_values", "_dirty", "_existing", "key",
+                 "item_type", "bucket_type")
     HEADER_SIZE = 8
     DEFAULT_ITEMTYPE = ItemType.raw_float
     DEFAULT_BUCKETTYPE = BucketType.dynamic
@@ -284,13 +468,18 @@ class Item(object):
     def count(self):
         return len(self._timestamps)
 
-    def split_needed(self, limit="soft"):
+    def split_needed(self, limit="soft", policy=None):
         if len(self) < 1:
             return False
         if self.bucket_type == BucketType.dynamic:
-            if len(self) > Item.DYNAMICSIZE_MAX:
+            if policy is None:
+                target = Item.DYNAMICSIZE_TARGET
+                max_size = Item.DYNAMICSIZE_MAX
+            else:
+                target, max_size = policy.sizes(self.key, self.item_type)
+            if len(self) > max_size:
                 return True
-            if len(self) > Item.DYNAMICSIZE_TARGET and limit == "soft":
+            if len(self) > target and limit == "soft":
                 return True
             return False
         elif self.bucket_type == BucketType.hourly:
@@ -311,6 +500,27 @@ class Item(object):
             return not (l == r)
         raise NotImplementedError()
 
+    def column_names(self):
+        """Names of the exported columns (timestamp first).
+        """
+        if self.item_type == ItemType.basic_aggregation:
+            return ["ts"] + list(Aggregation._fields)
+        if isinstance(self._values, TupleArray):
+            return ["ts"] + ["value_{}".format(i)
+                             for i in range(self._values.tuple_size)]
+        return ["ts", "value"]
+
+    def _columns(self):
+        if isinstance(self._values, TupleArray):
+            return [self._timestamps] + list(self._values._arrays)
+        return [self._timestamps, self._values]
+
+    def column(self, i):
+        """Column i of column_names() as array.array (no copy, changes
+        apply to the item).
+        """
+        return self._columns()[i]
+
     def _at(self, i):
         if self.item_type == ItemType.basic_aggregation:
             return (self._timestamps[i], Aggregation(*self._values[i]))
@@ -332,9 +542,13 @@ class Item(object):
         return (header + length + self._timestamps.tostring() +
                 self._values.tostring())
 
-    def split_item(self):
+    def split_item(self, policy=None):
         if self.bucket_type == BucketType.dynamic:
-            return self._split_item_at(count=Item.DYNAMICSIZE_TARGET)
+            if policy is None:
+                target = Item.DYNAMICSIZE_TARGET
+            else:
+                target = policy.sizes(self.key, self.item_type)[0]
+            return self._split_item_at(count=target)
         return self._split_item()
 
     def _split_item(self):
@@ -377,6 +591,21 @@ class Item(object):
         new_items[0]._dirty = True
         return new_items
 
+    def _append_items(self, items):
+        """Append the points of buckets sorted by range key. Buckets
+        can overlap while a compaction rewrites them (or after it was
+        interrupted), their points are taken once.
+        """
+        for i in items:
+            if len(self._timestamps) > 0 and len(i._timestamps) > 0 and \
+                    i._timestamps[0] <= self._timestamps[-1]:
+                low = bisect.bisect_right(i._timestamps, self._timestamps[-1])
+                self._timestamps += i._timestamps[low:]
+                self._values += i._values[low:]
+            else:
+                self._timestamps += i._timestamps
+                self._values += i._values
+
     def _split_item_at(self, count):
         if count >= len(self._timestamps):
             raise ValueError("split to big")
@@ -411,6 +640,12 @@ class Item(object):
         assert(i)
         return i
 
+    @staticmethod
+    def count_from_string(string):
+        """Points of a serialized item (from the header).
+        """
+        return int(struct.unpack("I", string[4:8])[0])
+
     @classmethod
     def from_db_data(cls, key, data):
         i = cls.from_string(key, data)
@@ -441,12 +676,139 @@ class Item(object):
         self._dirty = True
         return 1
 
-    def insert(self, series):
+    def insert(self, series, overwrite=False):
+        timestamps, columns = self._to_columns(series)
+        return self.insert_columns(timestamps, columns, overwrite)
+
+    def _to_columns(self, series):
+        """(timestamp, value) points as timestamp and value columns.
+        """
+        series = list(series)
+        timestamps = array.array("I", [int(p[0]) for p in series])
+        values = [p[1] for p in series]
+        if not isinstance(self._values, TupleArray):
+            return timestamps, [array.array(self._values.typecode, values)]
+        size = self._values.tuple_size
+        if any(len(v) != size for v in values):
+            raise ValueError("tuple size incorrect")
+        typecode = self._values.data_type
+        if not values:
+            return timestamps, [array.array(typecode) for i in range(size)]
+        return timestamps, [array.array(typecode, c) for c in zip(*values)]
+
+    def _input_columns(self, timestamps, values):
+        """Columnar input as timestamp and value columns, sorted by
+        timestamp. Every column may be an array.array, a numpy array, a
+        sequence or little-endian bytes, tuple items take a list of
+        value columns (or a 2d numpy array).
+        """
+        if isinstance(self._values, TupleArray):
+            if getattr(values, "ndim", 1) == 2:
+                values = list(values.T)
+            if len(values) != self._values.tuple_size:
+                raise ValueError("tuple size incorrect")
+        else:
+            values = [values]
+        timestamps = _input_column("I", timestamps)
+        columns = [_input_column(a.typecode, c)
+                   for a, c in zip(self._value_columns(), values)]
+        if any(len(c) != len(timestamps) for c in columns):
+            raise ValueError("columns of different length")
+        return _sort_columns(timestamps, columns)
+
+    def _value_columns(self):
+        if isinstance(self._values, TupleArray):
+            return self._values._arrays
+        return [self._values]
+
+    def extend_columns(self, timestamps, columns):
+        """Append strictly ascending points after ts_max, given as
+        timestamp column and one column per value.
+        """
+        if len(timestamps) < 1:
+            return 0
+        if len(self) > 0 and timestamps[0] <= self.ts_max:
+            raise ValueError("points not after the last point")
+        if not _sorted(timestamps, strict=True):
+            raise ValueError("timestamps not strictly ascending")
+        return self.insert_columns(timestamps, columns)
+
+    def insert_columns(self, timestamps, columns, overwrite=False):
+        """Insert points given as timestamp column and one column per
+        value. Sorted points are merged column-wise, every run between
+        two existing points is inserted with one slice per column.
+        Returns the number of inserted (or overwritten) points.
+        """
+        values = self._value_columns()
+        if len(columns) != len(values):
+            raise ValueError("tuple size incorrect")
+        n = len(timestamps)
+        if any(len(c) != n for c in columns):
+            raise ValueError("columns of different length")
+        if n < 1:
+            return 0
+        if not _sorted(timestamps, strict=True):
+            counter = 0
+            for i in range(n):
+                if len(values) > 1:
+                    value = tuple(c[i] for c in columns)
+                else:
+                    value = columns[0][i]
+                counter += self.insert_point(timestamps[i], value, overwrite)
+            return counter
+
+        timestamps = _as_array("I", timestamps)
+        columns = [_as_array(a.typecode, c) for a, c in zip(values, columns)]
         counter = 0
-        for timestamp, value in series:
-            counter += self.insert_point(timestamp, value)
+        i = pos = 0
+        while i < n:
+            ts = timestamps[i]
+            idx = bisect.bisect_left(self._timestamps, ts, pos)
+            if idx < len(self._timestamps) and self._timestamps[idx] == ts:
+                if overwrite:
+                    for a, c in zip(values, columns):
+                        a[idx] = c[i]
+                    counter += 1
+                i += 1
+                pos = idx + 1
+                continue
+            # Run of new points up to the next existing point
+            if idx < len(self._timestamps):
+                j = bisect.bisect_left(timestamps, self._timestamps[idx], i)
+            else:
+                j = n
+            self._timestamps[idx:idx] = timestamps[i:j]
+            for a, c in zip(values, columns):
+                a[idx:idx] = c[i:j]
+            counter += j - i
+            pos = idx + j - i
+            i = j
+        if counter > 0:
+            self._dirty = True
         return counter
 
+    def remove(self, ts_min, ts_max):
+        """Remove all points with ts_min <= timestamp <= ts_max.
+        Returns the number of removed points.
+        """
+        low = bisect.bisect_left(self._timestamps, ts_min)
+        high = bisect.bisect_right(self._timestamps, ts_max)
+        if high <= low:
+            return 0
+        del self._timestamps[low:high]
+        del self._values[low:high]
+        self._dirty = True
+        return high - low
+
+    def at(self, timestamp):
+        """Last point with a timestamp <= timestamp (None if there is
+        none in this item).
+        """
+        i = bisect.bisect_right(self._timestamps, timestamp) - 1
+        if i < 0:
+            return None
+        return self._at(i)
+
     def pretty_print(self):
         lines = []
         lines.append("{}: {} points({})".format(self.key, len(self),
@@ -456,15 +818,146 @@ class Item(object):
         return "\n".join(lines)
 
 
+class BucketPolicy(object):
+    """Size of dynamic buckets (per TSDB instance).
+
+    The target is a point count or a byte budget which is converted
+    with the point size of the item type. Series (keys or "prefix*")
+    can have their own byte budget. If adaptive, the target shrinks
+    for series with small inserts, so the last bucket (rewritten on
+    every append) is full after about ADAPTIVE_INSERTS inserts.
+    The max size is the target times max_factor.
+    """
+    ADAPTIVE_INSERTS = 10
+    ADAPTIVE_WEIGHT = 0.2
+    ADAPTIVE_MIN_FACTOR = 0.25
+
+    def __init__(self, target=100, max_size=190, target_bytes=None,
+                 series=None, adaptive=False):
+        self.target = target
+        self.max_factor = float(max_size) / target
+        self.target_bytes = target_bytes
+        self.series = dict((k.lower(), v) for k, v in
+                           (series or {}).items())
+        self.adaptive = adaptive
+        self._rates = {}
+
+    def __repr__(self):
+        return "<BucketPolicy target: {}, bytes: {}, adaptive: {}>".format(
+            self.target, self.target_bytes, self.adaptive)
+
+    def bucket_bytes(self, key):
+        """Byte budget of a series (None for point counts).
+        """
+        pattern = match_pattern(self.series, key)
+        if pattern is None:
+            return self.target_bytes
+        return self.series[pattern]
+
+    def sizes(self, key, item_type):
+        """Target and max points of a bucket.
+        """
+        b = self.bucket_bytes(key)
+        if b is None:
+            target = self.target
+        else:
+            target = max(1, (b - Item.HEADER_SIZE) // POINT_SIZE[item_type])
+        rate = self._rates.get(key)
+        if rate is not None:
+            lower = max(1, int(target * self.ADAPTIVE_MIN_FACTOR))
+            target = max(lower, min(target,
+                                    int(rate * self.ADAPTIVE_INSERTS)))
+        return target, max(target, int(target * self.max_factor))
+
+    def observe(self, key, count):
+        """Record the size of an insert (adaptive only).
+        """
+        if not self.adaptive:
+            return
+        rate = self._rates.get(key)
+        if rate is None:
+            self._rates[key] = float(count)
+        else:
+            self._rates[key] = rate + self.ADAPTIVE_WEIGHT * (count - rate)
+
+
+def _numpy_dtype(a):
+    """Little-endian numpy dtype string for an array.array.
+    """
+    if a.typecode in "fd":
+        return "<f{}".format(a.itemsize)
+    if a.typecode.isupper():
+        return "<u{}".format(a.itemsize)
+    return "<i{}".format(a.itemsize)
+
+
+def _numpy_column(a):
+    import numpy
+    if len(a) < 1:
+        return numpy.empty(0, dtype=_numpy_dtype(a))
+    return numpy.frombuffer(a, dtype=a.typecode)
+
+
+def as_of_join(results, ts_min=None, tolerance=None):
+    """Align ResultSets on the union of their timestamps (>= ts_min).
+    Every series is forward filled (its last value as of a timestamp),
+    values older than tolerance seconds and timestamps before the first
+    point of a series are NaN. Works on the column arrays (numpy).
+    Returns a numpy structured array with the columns "ts" and one per
+    value column ("<key>" or "<key>.<column>").
+    """
+    import numpy
+    stamps = [_numpy_column(r._timestamps) for r in results]
+    if stamps:
+        timeline = numpy.unique(numpy.concatenate(stamps)).astype("<i8")
+    else:
+        timeline = numpy.empty(0, dtype="<i8")
+    if ts_min is not None:
+        timeline = timeline[timeline >= ts_min]
+
+    names = ["ts"]
+    columns = [timeline]
+    for r, ts in zip(results, stamps):
+        idx = numpy.searchsorted(ts, timeline, side="right") - 1
+        valid = idx >= 0
+        if tolerance is not None and len(ts) > 0:
+            age = timeline - ts[numpy.maximum(idx, 0)].astype("<i8")
+            valid &= age <= tolerance
+        value_names = r.column_names()[1:]
+        for name, c in zip(value_names, r._columns()[1:]):
+            values = _numpy_column(c).astype("<f8")
+            out = numpy.full(len(timeline), numpy.nan)
+            out[valid] = values[idx[valid]]
+            if len(value_names) > 1:
+                name = "{}.{}".format(r.key, name)
+            else:
+                name = r.key
+            names.append(name)
+            columns.append(out)
+
+    out = numpy.empty(len(timeline), dtype=[(str(n), c.dtype)
+                                            for n, c in zip(names, columns)])
+    for n, c in zip(names, columns):
+        out[str(n)] = c
+    return out
+
+
 class ResultSet(Item):
-    def __init__(self, key, items):
-        super(ResultSet, self).__init__(key)
+    __slots__ = ()
+
+    def __init__(self, key, items, item_type=None):
+        items = list(items)
+        if item_type is None:
+            if len(items) > 0:
+                item_type = items[0].item_type
+            else:
+                item_type = Item.DEFAULT_ITEMTYPE
+        super(ResultSet, self).__init__(key, item_type=item_type)
         self.bucket_type = BucketType.resultset
         for i in items:
             if i.key != key:
                 raise ValueError("Item has wrong key")
-            self._timestamps += i._timestamps
-            self._values += i._values
+        self._append_items(items)
 
     def _trim(self, ts_min, ts_max):
         low = bisect.bisect_left(self._timestamps, ts_min)
@@ -477,6 +970,81 @@ class ResultSet(Item):
         """
         return zip(self._timestamps, self._values)
 
+    def to_buffers(self):
+        """Raw little-endian column buffers.
+        Returns a list of byte strings in the order of column_names().
+        """
+        out = []
+        for c in self._columns():
+            if sys.byteorder != "little":
+                c = array.array(c.typecode, c)
+                c.byteswap()
+            out.append(c.tostring())
+        return out
+
+    def to_numpy(self):
+        """Export as numpy structured array (requires numpy).
+        """
+        import numpy
+        names = self.column_names()
+        columns = self._columns()
+        dtypes = [_numpy_dtype(c) for c in columns]
+        out = numpy.empty(len(self), dtype=list(zip(names, dtypes)))
+        for name, c, dtype in zip(names, columns, dtypes):
+            out[name] = numpy.frombuffer(c, dtype=c.typecode)
+        return out
+
+    def to_arrow(self):
+        """Export as pyarrow RecordBatch (requires pyarrow).
+        """
+        import pyarrow
+        arrays = []
+        for c, buf in zip(self._columns(), self.to_buffers()):
+            t = pyarrow.from_numpy_dtype(_numpy_dtype(c))
+            arrays.append(pyarrow.Array.from_buffers(
+                t, len(c), [None, pyarrow.py_buffer(buf)]))
+        return pyarrow.RecordBatch.from_arrays(arrays, self.column_names())
+
+    def iter_csv(self, chunk_size=1000, header=True, delimiter=","):
+        """CSV Generator.
+        Yields one string per chunk of chunk_size rows.
+        """
+        if header:
+            yield delimiter.join(self.column_names()) + "\n"
+        line = delimiter.join(["{}"] * len(self._columns())) + "\n"
+        for columns in self._chunks(chunk_size):
+            yield "".join(map(line.format, *columns))
+
+    def iter_ndjson(self, chunk_size=1000):
+        """Newline delimited JSON Generator.
+        Yields one string per chunk of chunk_size rows.
+        """
+        fields = ['"{}": {{}}'.format(n) for n in self.column_names()]
+        line = "{{" + ", ".join(fields) + "}}\n"
+        for columns in self._chunks(chunk_size):
+            columns = [_json_column(c) for c in columns]
+            yield "".join(map(line.format, *columns))
+
+    def iter_json(self, chunk_size=1000):
+        """JSON Generator.
+        Yields a JSON list of [ts, value, ...] rows in chunks.
+        """
+        line = "[" + ", ".join(["{}"] * len(self._columns())) + "]"
+        yield "["
+        sep = ""
+        for columns in self._chunks(chunk_size):
+            columns = [_json_column(c) for c in columns]
+            yield sep + ", ".join(map(line.format, *columns))
+            sep = ", "
+        yield "]"
+
+    def _chunks(self, chunk_size):
+        if chunk_size < 1:
+            raise ValueError("invalid chunk size")
+        columns = self._columns()
+        for i in range(0, len(self), chunk_size):
+            yield [c[i:i + chunk_size] for c in columns]
+
     def daily(self):
         """Generator to access daily data.
         This will return an inner generator.
@@ -521,27 +1089,217 @@ class ResultSet(Item):
         else:
             raise ValueError("Invalid aggregation group")
 
-        if function == "sum":
-            func = sum
-        elif function == "count":
-            func = len
-        elif function == "min":
-            func = min
-        elif function == "max":
-            func = max
-        elif function == "amp":
-            def amp(x):
-                return max(x) - min(x)
-            func = amp
-        elif function == "mean":
-            def mean(x):
-                return sum(x) / len(x)
-            func = mean
-        else:
+        if function not in AGGREGATION_FUNCTIONS:
             raise ValueError("Invalid aggregation group")
+        func = AGGREGATION_FUNCTIONS[function]
 
         for g in it():
             t = list(g)
             ts = left(t[0][0])
             value = func([x[1] for x in t])
             yield (ts, value)
+
+    def resample(self, interval, fill="none", function="mean"):
+        """Resample to one point per interval (see Resampler).
+        """
+        r = Resampler(self.key, interval, fill, function, self.item_type)
+        first = r.feed(self)
+        rest = r.finish()
+        return ResultSet(self.key, [first, rest], item_type=self.item_type)
+
+
+RESAMPLE_FILLS = ("none", "previous", "linear", "zero")
+RESAMPLE_FUNCTIONS = ("mean", "sum", "min", "max", "amp", "count", "first",
+                      "last")
+
+
+def _aggregate_numpy(ts, columns, interval, function):
+    import numpy
+    ts = _numpy_column(ts).astype("<i8")
+    bins = ts - ts % interval
+    starts = numpy.flatnonzero(numpy.r_[True, bins[1:] != bins[:-1]])
+    ends = numpy.r_[starts[1:], len(ts)]
+    counts = ends - starts
+    out = []
+    for c in columns:
+        c = _numpy_column(c).astype("<f8")
+        if function == "mean":
+            v = numpy.add.reduceat(c, starts) / counts
+        elif function == "sum":
+            v = numpy.add.reduceat(c, starts)
+        elif function == "min":
+            v = numpy.minimum.reduceat(c, starts)
+        elif function == "max":
+            v = numpy.maximum.reduceat(c, starts)
+        elif function == "amp":
+            v = (numpy.maximum.reduceat(c, starts) -
+                 numpy.minimum.reduceat(c, starts))
+        elif function == "count":
+            v = counts.astype("<f8")
+        elif function == "first":
+            v = c[starts]
+        else:
+            v = c[ends - 1]
+        out.append(v)
+    return bins[starts], out
+
+
+def _fill_numpy(bins, columns, interval, fill, prev=None):
+    import numpy
+    if fill == "none":
+        return bins, columns
+    if prev is not None:
+        bins = numpy.r_[prev[0], bins]
+        columns = [numpy.r_[p, v] for p, v in zip(prev[1], columns)]
+    grid = numpy.arange(bins[0], bins[-1] + 1, interval, dtype="<i8")
+    out = []
+    for v in columns:
+        if fill == "previous":
+            v = v[numpy.searchsorted(bins, grid, side="right") - 1]
+        elif fill == "linear":
+            v = numpy.interp(grid, bins, v)
+        else:
+            z = numpy.zeros(len(grid))
+            z[(bins - bins[0]) // interval] = v
+            v = z
+        out.append(v)
+    if prev is not None:
+        return grid[1:], [v[1:] for v in out]
+    return grid, out
+
+
+def _aggregate_python(ts, columns, interval, function):
+    bins = []
+    groups = []
+    for i, t in enumerate(ts):
+        b = t - t % interval
+        if not bins or bins[-1] != b:
+            bins.append(b)
+            groups.append([])
+        groups[-1].append(i)
+    funcs = dict(AGGREGATION_FUNCTIONS)
+    funcs["first"] = lambda x: x[0]
+    funcs["last"] = lambda x: x[-1]
+    func = funcs[function]
+    out = []
+    for c in columns:
+        out.append([float(func([float(c[i]) for i in g])) for g in groups])
+    return bins, out
+
+
+def _fill_python(bins, columns, interval, fill, prev=None):
+    if fill == "none":
+        return bins, columns
+    if prev is not None:
+        bins = [prev[0]] + list(bins)
+        columns = [[p] + list(v) for p, v in zip(prev[1], columns)]
+    grid = list(range(bins[0], bins[-1] + 1, interval))
+    out = []
+    for v in columns:
+        filled = []
+        j = 0
+        for t in grid:
+            if t == bins[j]:
+                filled.append(v[j])
+                j += 1
+            elif fill == "previous":
+                filled.append(v[j - 1])
+            elif fill == "linear":
+                f = float(t - bins[j - 1]) / (bins[j] - bins[j - 1])
+                filled.append(v[j - 1] + (v[j] - v[j - 1]) * f)
+            else:
+                filled.append(0.0)
+        out.append(filled)
+    if prev is not None:
+        return grid[1:], [v[1:] for v in out]
+    return grid, out
+
+
+class Resampler(object):
+    """Resamples the chunks of a series (ordered ResultSets, e.g. of
+    iter_query) to evenly spaced timestamps.
+
+    Points are aggregated per interval (function), empty intervals
+    between them are filled: none (left out), previous (last value),
+    linear (interpolated) or zero. Tuple items are resampled column by
+    column. The last interval of a chunk is kept until the next chunk
+    or finish(). Uses numpy if available.
+    """
+    def __init__(self, key, interval, fill="none", function="mean",
+                 item_type=None):
+        if fill not in RESAMPLE_FILLS:
+            raise ValueError("Invalid fill")
+        if function not in RESAMPLE_FUNCTIONS:
+            raise ValueError("Invalid aggregation function")
+        if interval < 1:
+            raise ValueError("invalid interval")
+        self.key = key
+        self.interval = int(interval)
+        self.fill = fill
+        self.function = function
+        self.item_type = item_type
+        self._carry = None
+        self._last = None
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            self._aggregate = _aggregate_python
+            self._fill = _fill_python
+        else:
+            self._aggregate = _aggregate_numpy
+            self._fill = _fill_numpy
+
+    def feed(self, result):
+        """Add the next chunk, returns a ResultSet of the intervals
+        completed by it.
+        """
+        if self.item_type is None:
+            self.item_type = result.item_type
+        columns = result._columns()
+        if self._carry is not None:
+            columns = [a + b for a, b in zip(self._carry, columns)]
+        if len(columns[0]) < 1:
+            return self._result([], [])
+        # The last interval may continue in the next chunk
+        last = columns[0][-1]
+        split = bisect.bisect_left(columns[0], last - last % self.interval)
+        self._carry = [c[split:] for c in columns]
+        return self._resample([c[:split] for c in columns])
+
+    def finish(self):
+        """Returns a ResultSet of the remaining intervals.
+        """
+        columns, self._carry = self._carry, None
+        if columns is None:
+            return self._result([], [])
+        return self._resample(columns)
+
+    def _resample(self, columns):
+        if len(columns[0]) < 1:
+            return self._result([], [])
+        bins, values = self._aggregate(columns[0], columns[1:],
+                                       self.interval, self.function)
+        grid, filled = self._fill(bins, values, self.interval, self.fill,
+                                  self._last)
+        # Gaps to the next chunk are filled from the last interval
+        self._last = (int(bins[-1]), [float(v[-1]) for v in values])
+        return self._result(grid, filled)
+
+    def _result(self, timestamps, columns):
+        r = ResultSet(self.key, [], item_type=self.item_type)
+        arrays = r._columns()
+        if self._fill is _fill_numpy and len(timestamps) > 0:
+            import numpy
+            columns = [timestamps] + list(columns)
+            for a, c in zip(arrays, columns):
+                if a.typecode not in "fd":
+                    c = numpy.rint(c)
+                a.fromstring(numpy.asarray(c).astype(a.typecode).tostring())
+            return r
+        r._timestamps.extend(int(t) for t in timestamps)
+        for a, c in zip(arrays[1:], columns):
+            if a.typecode in "fd":
+                a.extend(float(x) for x in c)
+            else:
+                a.extend(int(round(x)) for x in c)
+        return r
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# coding: utf8
+
+from __future__ import unicode_literals
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceRegistry(object):
+    """Process wide registry for connections and pools.
+    Resources are created on first acquire and shared by name,
+    they are closed when the last user releases them.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._resources = {}
+        self._refs = {}
+
+    def __len__(self):
+        return len(self._resources)
+
+    def __contains__(self, name):
+        return name in self._resources
+
+    def acquire(self, name, factory):
+        """Get the resource with this name or create it with factory().
+        """
+        with self._lock:
+            if name not in self._resources:
+                logger.debug("Creating resource %s", name)
+                self._resources[name] = factory()
+                self._refs[name] = 0
+            self._refs[name] += 1
+            return self._resources[name]
+
+    def release(self, name):
+        """Release a resource, the last release closes it.
+        """
+        with self._lock:
+            if name not in self._refs:
+                return
+            self._refs[name] -= 1
+            if self._refs[name] > 0:
+                return
+            del self._refs[name]
+            resource = self._resources.pop(name)
+        close_resource(resource)
+
+    def forget(self):
+        """Drop all resources without closing them
+        (in a forked process, they belong to the parent).
+        """
+        with self._lock:
+            self._resources = {}
+            self._refs = {}
+
+    def close_all(self):
+        """Close all resources regardless of their users.
+        """
+        with self._lock:
+            resources = list(self._resources.values())
+            self._resources = {}
+            self._refs = {}
+        for r in resources:
+            close_resource(r)
+
+
+def close_resource(resource):
+    if hasattr(resource, "close"):
+        resource.close()
+    elif hasattr(resource, "disconnect"):
+        resource.disconnect()
+
+
+registry = ResourceRegistry()
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# coding: utf8
+
+from __future__ import unicode_literals
+
+import time
+import logging
+import threading
+
+from .helper import match_pattern
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionWorker(object):
+    """Scheduled deletion of old data.
+    Policies map a key or a key prefix ("sensor1.*") to a max age
+    in seconds, an exact key wins over the longest matching prefix.
+    The keys are listed by the storage, storages that can not list
+    them rely on the keys tracked on insert (or with track()).
+    """
+    def __init__(self, db, interval=3600):
+        self.db = db
+        self.interval = interval
+        self.policies = {}
+        self._keys = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.metrics = {"runs": 0, "keys": 0, "errors": 0, "deleted": 0,
+                        "dropped": 0, "rewritten": 0, "seconds": 0.0}
+
+    def add_policy(self, pattern, max_age):
+        self.policies[pattern.lower()] = int(max_age)
+
+    def remove_policy(self, pattern):
+        self.policies.pop(pattern.lower(), None)
+
+    def policy(self, key):
+        """Max age of a key (None if there is no policy).
+        """
+        pattern = match_pattern(self.policies, key.lower())
+        if pattern is None:
+            return None
+        return self.policies[pattern]
+
+    def track(self, key):
+        with self._lock:
+            self._keys.add(key)
+
+    def keys(self):
+        """Keys of the storage and the tracked keys.
+        """
+        try:
+            keys = set(self.db.storage.keys())
+        except NotImplementedError:
+            keys = set()
+        with self._lock:
+            keys.update(self._keys)
+        return sorted(keys)
+
+    def run(self, keys=None, now=None):
+        """Apply the policies to all keys (or these keys).
+        Returns the delete stats of keys with deleted points.
+        """
+        if now is None:
+            now = time.time()
+        if keys is None:
+            keys = self.keys()
+        res = []
+        t = time.time()
+        for key in keys:
+            max_age = self.policy(key)
+            if max_age is None:
+                continue
+            try:
+                stats = self.db.delete(key, 0, int(now) - max_age - 1)
+            except Exception:
+                logger.exception("Retention failed: {}".format(key))
+                self.metrics["errors"] += 1
+                continue
+            self.metrics["keys"] += 1
+            if stats["deleted"] > 0:
+                res.append(stats)
+        self._record(res, time.time() - t)
+        return res
+
+    def _record(self, results, seconds):
+        m = self.metrics
+        m["runs"] += 1
+        m["seconds"] += seconds
+        for r in results:
+            for k in ["deleted", "dropped", "rewritten"]:
+                m[k] += r[k]
+
+    def points_per_second(self):
+        """Delete throughput of all runs so far.
+        """
+        if self.metrics["seconds"] <= 0:
+            return 0.0
+        return self.metrics["deleted"] / self.metrics["seconds"]
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run()
@@ -0,0 +1,282 @@
+#!/usr/bin/python
+# coding: utf8
+
+from __future__ import unicode_literals
+
+import bisect
+import hashlib
+import logging
+import struct
+import threading
+
+from .storage import Storage
+from .errors import NotFoundError
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing(object):
+    """Consistent hash ring with virtual nodes.
+    Every node is placed `replicas` times on the ring, a key belongs
+    to the first node clockwise of its hash.
+    """
+    def __init__(self, nodes=None, replicas=100):
+        self.replicas = replicas
+        self._hashes = []
+        self._nodes = []
+        for node in nodes or []:
+            self.add(node)
+
+    def __len__(self):
+        return len(set(self._nodes))
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    def copy(self):
+        r = HashRing(replicas=self.replicas)
+        r._hashes = list(self._hashes)
+        r._nodes = list(self._nodes)
+        return r
+
+    @staticmethod
+    def _hash(value):
+        if not isinstance(value, bytes):
+            value = value.encode("utf-8")
+        return struct.unpack(str("<Q"), hashlib.md5(value).digest()[:8])[0]
+
+    def add(self, node):
+        if node in self._nodes:
+            raise ValueError("node already in ring: {}".format(node))
+        for i in range(self.replicas):
+            h = self._hash("{}#{}".format(node, i))
+            p = bisect.bisect_left(self._hashes, h)
+            self._hashes.insert(p, h)
+            self._nodes.insert(p, node)
+
+    def remove(self, node):
+        keep = [(h, n) for h, n in zip(self._hashes, self._nodes)
+                if n != node]
+        self._hashes = [h for h, _ in keep]
+        self._nodes = [n for _, n in keep]
+
+    def get(self, key):
+        if not self._hashes:
+            raise ValueError("empty ring")
+        p = bisect.bisect(self._hashes, self._hash(key))
+        return self._nodes[p % len(self._nodes)]
+
+
+class ShardedStorage(Storage):
+    """Routes keys over child storages (shards) with consistent hashing.
+
+    Multi-key operations are grouped per shard, the shards are queried
+    in parallel. add_shard() moves only the keys the new shard takes
+    over, they are served by their old shard until rebalance() has
+    copied them.
+    """
+    def __init__(self, shards, replicas=100, close_shards=True):
+        self.shards = dict(shards)
+        self.close_shards = close_shards
+        self.ring = HashRing(sorted(self.shards), replicas=replicas)
+        self._pending = {}
+        self._lock = threading.RLock()
+        self._pool = None
+
+    @property
+    def namespace(self):
+        return "sharded:{}".format(",".join(
+            self.shards[n].namespace for n in sorted(self.shards)))
+
+    @property
+    def BUCKET_BYTES(self):
+        return min(s.BUCKET_BYTES for s in self.shards.values())
+
+    def shard(self, key):
+        """Name of the shard serving a key.
+        """
+        # Read the ring first, add_shard() sets the pending keys first
+        name = self.ring.get(key)
+        return self._pending.get(key, name)
+
+    def _call(self, key, func):
+        if key in self._pending:
+            # Do not run concurrently with the move of this key
+            with self._lock:
+                return func(self.shards[self.shard(key)])
+        return func(self.shards[self.shard(key)])
+
+    def _ping(self):
+        for s in self.shards.values():
+            s._ping()
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+        if self.close_shards:
+            for s in self.shards.values():
+                s.close()
+
+    # Single key operations
+
+    def get(self, key, range_key):
+        return self._call(key, lambda s: s.get(key, range_key))
+
+    def insert(self, item, metrics=None):
+        return self._call(item.key, lambda s: s.insert(item, metrics))
+
+    def update(self, item, metrics=None):
+        return self._call(item.key, lambda s: s.update(item, metrics))
+
+    def delete(self, key, range_key):
+        return self._call(key, lambda s: s.delete(key, range_key))
+
+    def delete_range(self, key, range_min, range_max):
+        return self._call(key, lambda s: s.delete_range(key, range_min,
+                                                        range_max))
+
+    def query(self, key, range_min, range_max):
+        return self._call(key, lambda s: s.query(key, range_min, range_max))
+
+    def sizes(self, key, range_min, range_max):
+        return self._call(key, lambda s: s.sizes(key, range_min, range_max))
+
+    def iter_query_ranges(self, key, ranges, pool=None):
+        return self._call(key, lambda s: s.iter_query_ranges(key, ranges,
+                                                             pool))
+
+    def last(self, key):
+        return self._call(key, lambda s: s.last(key))
+
+    def first(self, key):
+        return self._call(key, lambda s: s.first(key))
+
+    def left(self, key, range_key):
+        return self._call(key, lambda s: s.left(key, range_key))
+
+    def count(self, key):
+        return self._call(key, lambda s: s.count(key))
+
+    def stats(self, key):
+        return self._call(key, lambda s: s.stats(key))
+
+    def _keys(self):
+        keys = set()
+        for s in self.shards.values():
+            keys.update(s.keys())
+        return sorted(keys)
+
+    # Multi key operations
+
+    def _parallel(self, keys, func):
+        """Run func(storage, [args]) once per shard (in parallel),
+        returns the results in the order of keys.
+        """
+        if any(key in self._pending for key in keys):
+            # Do not run concurrently with the move of these keys
+            with self._lock:
+                return self._run_parallel(keys, func)
+        return self._run_parallel(keys, func)
+
+    def _run_parallel(self, keys, func):
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(self.shard(key), []).append(i)
+        if len(groups) > 1:
+            with self._lock:
+                if self._pool is None:
+                    from multiprocessing.pool import ThreadPool
+                    self._pool = ThreadPool(len(self.shards))
+                pool = self._pool
+        else:
+            pool = None
+
+        def run(name):
+            return func(self.shards[name], groups[name])
+        names = sorted(groups)
+        results = pool.map(run, names) if pool else [run(n) for n in names]
+        out = [None] * len(keys)
+        for name, res in zip(names, results):
+            for i, r in zip(groups[name], res):
+                out[i] = r
+        return out
+
+    def query_bulk(self, queries):
+        return self._parallel(
+            [q[0] for q in queries],
+            lambda s, idx: s.query_bulk([queries[i] for i in idx]))
+
+    def last_bulk(self, keys):
+        return self._parallel(
+            keys, lambda s, idx: s.last_bulk([keys[i] for i in idx]))
+
+    def stats_bulk(self, keys):
+        return self._parallel(
+            keys, lambda s, idx: s.stats_bulk([keys[i] for i in idx]))
+
+    def insert_bulk(self, items, metrics=None):
+        def insert(s, idx):
+            for i in idx:
+                s.insert(items[i], metrics)
+            return [None] * len(idx)
+        self._parallel([i.key for i in items], insert)
+
+    # Rebalancing
+
+    def add_shard(self, name, storage):
+        """Add a shard, the keys it takes over are moved by rebalance().
+        Returns the number of keys to move.
+        """
+        with self._lock:
+            ring = self.ring.copy()
+            ring.add(name)
+            pending = dict(self._pending)
+            for old, s in self.shards.items():
+                for key in s.keys():
+                    if key not in pending and ring.get(key) == name:
+                        pending[key] = old
+            self.shards[name] = storage
+            self._pending = pending
+            self.ring = ring
+        logger.info("Added shard {}, {} keys to move".format(
+            name, len(pending)))
+        return len(pending)
+
+    @property
+    def pending(self):
+        """Number of keys not moved to their shard yet.
+        """
+        return len(self._pending)
+
+    def rebalance(self, limit=None):
+        """Move up to limit (all) pending keys to their new shard.
+        Returns the number of moved keys.
+        """
+        moved = 0
+        while self._pending and (limit is None or moved < limit):
+            with self._lock:
+                key, old = next(iter(self._pending.items()))
+                self._move(key, self.shards[old],
+                           self.shards[self.ring.get(key)])
+                del self._pending[key]
+            moved += 1
+        return moved
+
+    def _move(self, key, source, target):
+        # The range keys of the key (in the range key type of every
+        # storage, e.g. int in cassandra)
+        try:
+            first = source.first(key).range_key
+            last = source.last(key).range_key
+        except NotFoundError:
+            return
+        for item in source.query(key, first, last):
+            try:
+                target.get(key, item.range_key)
+            except NotFoundError:
+                target.insert(item)
+            else:
+                target.update(item)
+        source.delete_range(key, first, last)
@@ -3,16 +3,75 @@
 
 from __future__ import unicode_literals
 import bisect
-from redis import StrictRedis as Redis
-from collections import namedtuple
+import logging
+import array
+import struct
+import mmap
+import re
+import os
+import threading
+import binascii
+import datetime
+from contextlib import contextmanager
 from .errors import NotFoundError, ConflictError
 from .models import Item, Stats
+from .metrics import clock
 
 
-Element = namedtuple('Element', ['key', 'range_key', 'data'])
+logger = logging.getLogger(__name__)
+
+
+_EMPTY_RANGE_KEYS = array.array("l")
+
+# Range keys are stored as cassandra int
+_CASSANDRA_RANGE_MIN = -(2 ** 31)
+_CASSANDRA_RANGE_MAX = 2 ** 31 - 1
+
+# Upper bound of the seconds in one partition period
+PARTITION_SECONDS = {"month": 31 * 24 * 60 * 60,
+                     "year": 366 * 24 * 60 * 60}
+
+
+def partition_period(range_key, partition):
+    """Partition period (year or month counted from year 0) of a
+    range key (unix timestamp).
+    """
+    range_key = max(min(range_key, _CASSANDRA_RANGE_MAX), _CASSANDRA_RANGE_MIN)
+    t = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=range_key)
+    if partition == "year":
+        return t.year
+    return t.year * 12 + t.month - 1
 
 
 class Storage(object):
+    # Bucket byte budget (BUCKET_DYNAMIC_BYTES="auto"), a page for
+    # local storages
+    BUCKET_BYTES = 4096
+
+    @property
+    def namespace(self):
+        """Identifies the data behind this storage (e.g. for caching).
+        """
+        return self.__class__.__name__
+
+    def ping(self):
+        """Health check, returns True if the storage is reachable.
+        """
+        try:
+            self._ping()
+        except Exception as e:
+            logger.warning("Storage ping failed: {}".format(e))
+            return False
+        return True
+
+    def _ping(self):
+        pass
+
+    def close(self):
+        """Close all connections.
+        """
+        pass
+
     def _to_item(self, key, data):
         raise NotImplementedError("child class must implement _to_item")
 
@@ -22,11 +81,39 @@ class Storage(object):
     def get(self, key, range_key):
         return self._to_item(key, self._get(key, range_key))
 
-    def insert(self, item):
-        self._insert(**self._from_item(item))
+    def insert(self, item, metrics=None):
+        """Write a new bucket, metrics (of the calling TSDB) time the
+        serialization and the write.
+        """
+        if metrics is None:
+            self._insert(**self._from_item(item))
+        else:
+            self._timed_write(self._insert, item, metrics)
 
-    def update(self, item):
-        self._update(**self._from_item(item))
+    def update(self, item, metrics=None):
+        if metrics is None:
+            self._update(**self._from_item(item))
+        else:
+            self._timed_write(self._update, item, metrics)
+
+    def _timed_write(self, write, item, m):
+        t = clock()
+        data = self._from_item(item)
+        serialized = clock()
+        write(**data)
+        m.timing("serialize", serialized - t)
+        m.timing("storage_write", clock() - serialized)
+        m.incr("bytes_written", len(data["data"]))
+
+    def delete(self, key, range_key):
+        """Delete the bucket with this range key.
+        """
+        self._delete(key, range_key)
+
+    def delete_range(self, key, range_min, range_max):
+        """Delete all buckets with range_min <= range key <= range_max.
+        """
+        self._delete_range(key, range_min, range_max)
 
     def query(self, key, range_min, range_max):
         out = list()
@@ -34,6 +121,43 @@ class Storage(object):
             out.append(self._to_item(key, i))
         return out
 
+    def sizes(self, key, range_min, range_max):
+        """Points per bucket of a query, read from the bucket headers
+        without decoding the buckets.
+        """
+        return [Item.count_from_string(i)
+                for i in self._query(key, range_min, range_max)]
+
+    def query_ranges(self, key, ranges, pool=None):
+        """Query adjacent (range_min, range_max) ranges.
+        Returns the buckets in order and without duplicates.
+        """
+        out = list()
+        for items in self.iter_query_ranges(key, ranges, pool):
+            out += items
+        return out
+
+    def iter_query_ranges(self, key, ranges, pool=None):
+        """Buckets of adjacent ranges, one list per range (in order).
+        With a thread pool the ranges are fetched and decoded
+        concurrently.
+        """
+        def fetch(i):
+            items = self.query(key, ranges[i][0], ranges[i][1])
+            if i > 0:
+                # The bucket left of the range is in the range before
+                items = [x for x in items if x.range_key >= ranges[i][0]]
+            return items
+        if pool is None:
+            return (fetch(i) for i in range(len(ranges)))
+        return pool.imap(lambda i: self._in_worker(fetch, i),
+                         range(len(ranges)))
+
+    def _in_worker(self, func, *args):
+        """Run func in a thread of the query pool.
+        """
+        return func(*args)
+
     def last(self, key):
         return self._to_item(key, self._last(key))
 
@@ -43,6 +167,33 @@ class Storage(object):
     def left(self, key, range_key):
         return self._to_item(key, self._left(key, range_key))
 
+    def keys(self):
+        """All series keys of this storage.
+        """
+        return self._keys()
+
+    def _keys(self):
+        raise NotImplementedError("storage can not list keys")
+
+    def query_bulk(self, queries):
+        """Query several (key, range_min, range_max), results in order.
+        """
+        return [self.query(*q) for q in queries]
+
+    def last_bulk(self, keys):
+        """Last bucket of several keys (None if a key has no data).
+        """
+        out = list()
+        for key in keys:
+            try:
+                out.append(self.last(key))
+            except NotFoundError:
+                out.append(None)
+        return out
+
+    def stats_bulk(self, keys):
+        return [self.stats(key) for key in keys]
+
     def stats(self, key):
         try:
             s = Stats(key=key, ts_min=self.ts_min(key),
@@ -73,12 +224,34 @@ class Storage(object):
 
 
 class CassandraStorage(Storage):
-    def __init__(self, **kwargs):
-        from cassandra.cluster import Cluster
-        self._cassandra = Cluster(**kwargs)
-        self._session = None
+    """Cassandra storage.
+
+    By default every series is one partition (PRIMARY KEY (key,
+    range_key)). With partition="month" or "year" the buckets are
+    partitioned by key and time period, the periods of a key are kept
+    in an index table. Reads fan out over the periods concurrently.
+    """
+    # Larger cells, every row read is a partition lookup
+    BUCKET_BYTES = 16384
+    # Partitions queried at once
+    FANOUT = 8
+
+    def __init__(self, partition=None, session=None, **kwargs):
+        if partition not in (None, "month", "year"):
+            raise ValueError("invalid partition: {}".format(partition))
+        self.partition = partition
+        self._cassandra = None
+        if session is None:
+            from cassandra.cluster import Cluster
+            self._cassandra = Cluster(**kwargs)
+        self._session = session
         self.key_space = "test"
         self.table_name = "{}.testtable".format(self.key_space)
+        if partition:
+            self.table_name = "{}_{}".format(self.table_name, partition)
+        self.periods_table = "{}_periods".format(self.table_name)
+        # (key, period) rows known to be in the periods table
+        self._periods_known = set()
 
     @property
     def cassandra(self):
@@ -86,6 +259,24 @@ class CassandraStorage(Storage):
             self._session = self._cassandra.connect()
         return self._session
 
+    @property
+    def namespace(self):
+        if self._cassandra is None:
+            return "cassandra:{}:{}".format(id(self._session),
+                                            self.table_name)
+        return "cassandra:{}:{}:{}".format(
+            ",".join(self._cassandra.contact_points), self._cassandra.port,
+            self.table_name)
+
+    def _ping(self):
+        self.cassandra.execute("SELECT now() FROM system.local")
+
+    def close(self):
+        # A passed session is closed by its owner
+        if self._cassandra is not None:
+            self._cassandra.shutdown()
+            self._session = None
+
     def _createTable(self):
         k = """
             CREATE KEYSPACE IF NOT EXISTS {} WITH
@@ -93,6 +284,25 @@ class CassandraStorage(Storage):
             {{ 'class' : 'SimpleStrategy',
               'replication_factor' : 1 }};""".format(self.key_space)
         self.cassandra.execute(k)
+        if self.partition:
+            s = """
+                CREATE TABLE IF NOT EXISTS {} (
+                key text,
+                period int,
+                range_key int,
+                data blob,
+                size int,
+                PRIMARY KEY ((key, period), range_key)
+                )""".format(self.table_name)
+            self.cassandra.execute(s)
+            s = """
+                CREATE TABLE IF NOT EXISTS {} (
+                key text,
+                period int,
+                PRIMARY KEY (key, period)
+                )""".format(self.periods_table)
+            self.cassandra.execute(s)
+            return
         s = """
             CREATE TABLE IF NOT EXISTS {} (
             key text,
@@ -104,12 +314,17 @@ class CassandraStorage(Storage):
         self.cassandra.execute(s)
 
     def _dropTable(self):
+        self._periods_known.clear()
         k = """
             DROP KEYSPACE IF EXISTS {};""".format(self.key_space)
         self.cassandra.execute(k)
         s = """
             DROP TABLE IF EXISTS {};""".format(self.table_name)
         self.cassandra.execute(s)
+        if self.partition:
+            s = """
+                DROP TABLE IF EXISTS {};""".format(self.periods_table)
+            self.cassandra.execute(s)
 
     def _to_item(self, key, data):
         return Item.from_db_data(key, data)
@@ -120,53 +335,169 @@ class CassandraStorage(Storage):
                 "data": item.to_string(),
                 "size": len(item)}
 
+    # Time partitions
+
+    def _period(self, range_key):
+        return partition_period(range_key, self.partition)
+
+    def _periods(self, key, range_min=None, range_max=None, desc=False):
+        """Periods of a key with data between range_min and range_max.
+        """
+        if range_min is None:
+            range_min = _CASSANDRA_RANGE_MIN
+        if range_max is None:
+            range_max = _CASSANDRA_RANGE_MAX
+        s = """
+            SELECT period FROM {}
+            WHERE key = %s AND period >= %s AND period <= %s
+            ORDER BY period {}
+            """.format(self.periods_table, "DESC" if desc else "ASC")
+        res = self.cassandra.execute(s, (key, self._period(range_min),
+                                         self._period(range_max)))
+        return [r.period for r in res]
+
+    def _fanout(self, statement, key, periods, params=(), first=False):
+        """Execute a statement on the partitions of periods
+        (FANOUT at once), the rows are returned in the order of periods.
+        With first only the rows of the first non empty partition.
+        """
+        out = []
+        for i in range(0, len(periods), self.FANOUT):
+            futures = [self.cassandra.execute_async(statement,
+                                                    (key, p) + params)
+                       for p in periods[i:i + self.FANOUT]]
+            for f in futures:
+                rows = list(f.result())
+                if first and rows:
+                    return rows
+                out += rows
+        return out
+
+    def migrate(self, source, keys=None):
+        """Copy all buckets of source (e.g. the unpartitioned table of
+        the cluster) into this storage. Every series is copied in
+        chunks of one partition period.
+        Returns the number of copied keys and buckets.
+        """
+        if keys is None:
+            keys = source.keys()
+        chunk = PARTITION_SECONDS.get(self.partition, 30 * 24 * 60 * 60)
+        stats = {"keys": 0, "buckets": 0}
+        for key in keys:
+            try:
+                first = source.first(key).range_key
+                last = source.last(key).range_key
+            except NotFoundError:
+                continue
+            for range_min in range(first, last + 1, chunk):
+                items = source.query(key, range_min, range_min + chunk - 1)
+                for item in items:
+                    # The bucket left of the chunk is already copied
+                    if range_min > first and item.range_key < range_min:
+                        continue
+                    self._insert(**self._from_item(item))
+                    stats["buckets"] += 1
+            stats["keys"] += 1
+            logger.info("Migrated {}".format(key))
+        return stats
+
     def _insert(self, key, range_key, data, size):
+        data = bytearray(data)
+        if self.partition:
+            period = self._period(range_key)
+            if (key, period) not in self._periods_known:
+                s = """
+                    INSERT INTO {} (key, period)
+                    VALUES (%s, %s)
+                    """.format(self.periods_table)
+                self.cassandra.execute(s, (key, period))
+                self._periods_known.add((key, period))
+            s = """
+                INSERT INTO {} (key, period, range_key, data, size)
+                VALUES (%s, %s, %s, %s, %s)
+                """.format(self.table_name)
+            self.cassandra.execute(s, (key, period, range_key, data, size))
+            return
         s = """
             INSERT INTO {} (key, range_key, data, size)
             VALUES (%s, %s, %s, %s)
             """.format(self.table_name)
-        data = bytearray(data)
         self.cassandra.execute(s, (key, range_key, data, size))
 
     def _get(self, key, range_key):
-        s = """
-            SELECT key, range_key, data FROM {}
-            WHERE key = %s AND range_key = %s
-            """.format(self.table_name)
-        res = self.cassandra.execute(s, (key, range_key))
+        if self.partition:
+            s = """
+                SELECT key, range_key, data FROM {}
+                WHERE key = %s AND period = %s AND range_key = %s
+                """.format(self.table_name)
+            res = self.cassandra.execute(
+                s, (key, self._period(range_key), range_key))
+        else:
+            s = """
+                SELECT key, range_key, data FROM {}
+                WHERE key = %s AND range_key = %s
+                """.format(self.table_name)
+            res = self.cassandra.execute(s, (key, range_key))
         res = list(res)
         if len(res) < 1:
             raise NotFoundError
         return res[0].data
 
     def _first(self, key):
-        s = """
-            SELECT key, range_key, data FROM {}
-            WHERE key = %s ORDER BY range_key ASC LIMIT 1
-            """.format(self.table_name)
-        res = self.cassandra.execute(s, (key, ))
+        if self.partition:
+            s = """
+                SELECT key, range_key, data FROM {}
+                WHERE key = %s AND period = %s
+                ORDER BY range_key ASC LIMIT 1
+                """.format(self.table_name)
+            res = self._fanout(s, key, self._periods(key), first=True)
+        else:
+            s = """
+                SELECT key, range_key, data FROM {}
+                WHERE key = %s ORDER BY range_key ASC LIMIT 1
+                """.format(self.table_name)
+            res = self.cassandra.execute(s, (key, ))
         res = list(res)
         if len(res) < 1:
             raise NotFoundError
         return res[0].data
 
     def _last(self, key):
-        s = """
-            SELECT key, range_key, data FROM {}
-            WHERE key = %s ORDER BY range_key DESC LIMIT 1
-            """.format(self.table_name)
-        res = self.cassandra.execute(s, (key, ))
+        if self.partition:
+            s = """
+                SELECT key, range_key, data FROM {}
+                WHERE key = %s AND period = %s
+                ORDER BY range_key DESC LIMIT 1
+                """.format(self.table_name)
+            res = self._fanout(s, key, self._periods(key, desc=True),
+                               first=True)
+        else:
+            s = """
+                SELECT key, range_key, data FROM {}
+                WHERE key = %s ORDER BY range_key DESC LIMIT 1
+                """.format(self.table_name)
+            res = self.cassandra.execute(s, (key, ))
         res = list(res)
         if len(res) < 1:
             raise NotFoundError
         return res[0].data
 
     def _left(self, key, range_key):
-        s = """
-            SELECT key, range_key, data FROM {}
-            WHERE key = %s AND range_key <= %s ORDER BY range_key DESC LIMIT 1
-            """.format(self.table_name)
-        res = self.cassandra.execute(s, (key, range_key))
+        if self.partition:
+            s = """
+                SELECT key, range_key, data FROM {}
+                WHERE key = %s AND period = %s AND range_key <= %s
+                ORDER BY range_key DESC LIMIT 1
+                """.format(self.table_name)
+            periods = self._periods(key, range_max=range_key, desc=True)
+            res = self._fanout(s, key, periods, (range_key, ), first=True)
+        else:
+            s = """
+                SELECT key, range_key, data FROM {}
+                WHERE key = %s AND range_key <= %s
+                ORDER BY range_key DESC LIMIT 1
+                """.format(self.table_name)
+            res = self.cassandra.execute(s, (key, range_key))
         res = list(res)
         if len(res) < 1:
             raise NotFoundError
@@ -175,13 +506,94 @@ class CassandraStorage(Storage):
     def _update(self, key, range_key, data, size):
         self._insert(key, range_key, data, size)
 
-    def _query(self, key, range_min, range_max):
+    def _delete(self, key, range_key):
+        if self.partition:
+            s = """
+                DELETE FROM {}
+                WHERE key = %s AND period = %s AND range_key = %s
+                """.format(self.table_name)
+            self.cassandra.execute(
+                s, (key, self._period(range_key), range_key))
+            return
+        s = """
+            DELETE FROM {}
+            WHERE key = %s AND range_key = %s
+            """.format(self.table_name)
+        self.cassandra.execute(s, (key, range_key))
+
+    def _delete_range(self, key, range_min, range_max):
+        if self.partition:
+            # One range tombstone per partition
+            s = """
+                DELETE FROM {}
+                WHERE key = %s AND period = %s
+                AND range_key >= %s AND range_key <= %s
+                """.format(self.table_name)
+            self._fanout(s, key, self._periods(key, range_min, range_max),
+                         (range_min, range_max))
+            return
+        # One range tombstone
+        s = """
+            DELETE FROM {}
+            WHERE key = %s AND range_key >= %s AND range_key <= %s
+            """.format(self.table_name)
+        self.cassandra.execute(s, (key, range_min, range_max))
+
+    def _keys(self):
+        if self.partition:
+            s = "SELECT DISTINCT key FROM {}".format(self.periods_table)
+            keys = [r.key for r in self.cassandra.execute(s)]
+            # Periods stay in the index when their buckets are deleted
+            return [k for k in keys if self.last_bulk([k])[0] is not None]
+        s = "SELECT DISTINCT key FROM {}".format(self.table_name)
+        return [r.key for r in self.cassandra.execute(s)]
+
+    def iter_query_ranges(self, key, ranges, pool=None):
+        if self.partition:
+            # Every range fans out over its partitions
+            return super(CassandraStorage, self).iter_query_ranges(
+                key, ranges, pool)
+        # All ranges are requested at once (async execution)
         s = """
             SELECT key, range_key, data FROM {}
             WHERE key = %s AND range_key >= %s AND range_key <= %s
             ORDER BY range_key ASC
             """.format(self.table_name)
-        res = self.cassandra.execute(s, (key, range_min, range_max))
+        futures = [self.cassandra.execute_async(s, (key, a, b))
+                   for a, b in ranges]
+        try:
+            left = self._left(key, ranges[0][0])
+        except NotFoundError:
+            left = None
+
+        def decode(i):
+            items = [r.data for r in futures[i].result()]
+            if i == 0 and left is not None and (len(items) < 1 or
+                                                left != items[0]):
+                items.insert(0, left)
+            return [self._to_item(key, d) for d in items]
+        if pool is None:
+            return (decode(i) for i in range(len(ranges)))
+        return pool.imap(decode, range(len(ranges)))
+
+    def _query(self, key, range_min, range_max):
+        if self.partition:
+            s = """
+                SELECT key, range_key, data FROM {}
+                WHERE key = %s AND period = %s
+                AND range_key >= %s AND range_key <= %s
+                ORDER BY range_key ASC
+                """.format(self.table_name)
+            res = self._fanout(s, key,
+                               self._periods(key, range_min, range_max),
+                               (range_min, range_max))
+        else:
+            s = """
+                SELECT key, range_key, data FROM {}
+                WHERE key = %s AND range_key >= %s AND range_key <= %s
+                ORDER BY range_key ASC
+                """.format(self.table_name)
+            res = self.cassandra.execute(s, (key, range_min, range_max))
         items = []
         for r in res:
             items.append(r.data)
@@ -196,16 +608,25 @@ class CassandraStorage(Storage):
         return items
 
     def _count(self, key):
+        if self.partition:
+            s = """
+                SELECT SUM(size) FROM {}
+                WHERE key = %s AND period = %s
+                """.format(self.table_name)
+            return sum(int(r[0] or 0)
+                       for r in self._fanout(s, key, self._periods(key)))
         s = """
             SELECT SUM(size) FROM {}
             WHERE key = %s
             """.format(self.table_name)
-        from cassandra import InvalidRequest
         # Fallback to slow count
         # if cassandra does not support SUM
         try:
             res = self.cassandra.execute(s, (key, ))
-        except InvalidRequest:
+        except Exception as e:
+            from cassandra import InvalidRequest
+            if not isinstance(e, InvalidRequest):
+                raise
             return super(CassandraStorage, self)._count(key)
         return int(res[0][0])
 
@@ -214,8 +635,73 @@ class SQLiteStorage(Storage):
     def __init__(self, filepath):
         self.filepath = filepath
         self.table_name = "datatable"
+        self._conn = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Reader connections of the query pool threads (thread -> conn)
+        self._readers = {}
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            import sqlite3
+            self._conn = sqlite3.connect(self.filepath,
+                                         check_same_thread=False)
+        return self._conn
+
+    def _in_worker(self, func, *args):
+        self._local.worker = True
+        return func(*args)
+
+    @contextmanager
+    def _reader(self):
+        # Threads of the query pool read with a connection per thread
+        # (parallel queries), all others share the connection
+        if self.filepath == ":memory:" or \
+                not getattr(self._local, "worker", False):
+            with self._lock:
+                yield self.conn
+            return
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open_reader()
+        yield conn
+
+    def _open_reader(self):
         import sqlite3
-        self.conn = sqlite3.connect(filepath)
+        conn = sqlite3.connect(self.filepath, check_same_thread=False)
+        self._local.conn = conn
+        with self._lock:
+            # Readers of finished threads (e.g. of a closed pool)
+            for thread, c in list(self._readers.items()):
+                if not thread.is_alive():
+                    c.close()
+                    del self._readers[thread]
+            self._readers[threading.current_thread()] = conn
+        return conn
+
+    @property
+    def namespace(self):
+        return "sqlite:{}:{}".format(os.path.abspath(self.filepath),
+                                     self.table_name)
+
+    def _ping(self):
+        self.conn.execute("SELECT 1")
+
+    def close(self):
+        with self._lock:
+            for conn in self._readers.values():
+                conn.close()
+            self._readers = {}
+            self._local = threading.local()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _keys(self):
+        s = "SELECT DISTINCT key FROM {}".format(self.table_name)
+        with self._reader() as conn:
+            return [r[0] for r in conn.execute(s)]
 
     def _createTable(self):
         c = self.conn.cursor()
@@ -250,18 +736,18 @@ class SQLiteStorage(Storage):
             VALUES (?, ?, ?)
             """.format(self.table_name)
         data = buffer(data)
-        c = self.conn.cursor()
-        c.execute(s, (key, range_key, data))
-        self.conn.commit()
+        with self._lock:
+            c = self.conn.cursor()
+            c.execute(s, (key, range_key, data))
+            self.conn.commit()
 
     def _get(self, key, range_key):
         s = """
             SELECT key, range_key, data FROM {}
             WHERE key = ? AND range_key = ?
             """.format(self.table_name)
-        c = self.conn.cursor()
-        res = c.execute(s, (key, range_key))
-        res = list(res)
+        with self._reader() as conn:
+            res = list(conn.execute(s, (key, range_key)))
         if len(res) < 1:
             raise NotFoundError
         return res[0][2]
@@ -271,9 +757,8 @@ class SQLiteStorage(Storage):
             SELECT key, range_key, data FROM {}
             WHERE key = ? ORDER BY range_key ASC LIMIT 1
             """.format(self.table_name)
-        c = self.conn.cursor()
-        res = c.execute(s, (key, ))
-        res = list(res)
+        with self._reader() as conn:
+            res = list(conn.execute(s, (key, )))
         if len(res) < 1:
             raise NotFoundError
         return res[0][2]
@@ -283,21 +768,39 @@ class SQLiteStorage(Storage):
             SELECT key, range_key, data FROM {}
             WHERE key = ? ORDER BY range_key DESC LIMIT 1
             """.format(self.table_name)
-        c = self.conn.cursor()
-        res = c.execute(s, (key, ))
-        res = list(res)
+        with self._reader() as conn:
+            res = list(conn.execute(s, (key, )))
         if len(res) < 1:
             raise NotFoundError
         return res[0][2]
 
+    # Keys per statement (below the sqlite variable limit)
+    BULK_KEYS = 500
+
+    def last_bulk(self, keys):
+        # The last bucket of many keys with one statement
+        found = {}
+        for i in range(0, len(keys), self.BULK_KEYS):
+            chunk = list(set(keys[i:i + self.BULK_KEYS]))
+            s = """
+                SELECT t.key, t.data FROM {0} t JOIN (
+                SELECT key, MAX(range_key) AS range_key FROM {0}
+                WHERE key IN ({1}) GROUP BY key) m
+                ON t.key = m.key AND t.range_key = m.range_key
+                """.format(self.table_name, ",".join("?" * len(chunk)))
+            with self._reader() as conn:
+                for key, data in conn.execute(s, chunk):
+                    found[key] = data
+        return [self._to_item(k, found[k]) if k in found else None
+                for k in keys]
+
     def _left(self, key, range_key):
         s = """
             SELECT key, range_key, data FROM {}
             WHERE key = ? AND range_key <= ? ORDER BY range_key DESC LIMIT 1
             """.format(self.table_name)
-        c = self.conn.cursor()
-        res = c.execute(s, (key, range_key))
-        res = list(res)
+        with self._reader() as conn:
+            res = list(conn.execute(s, (key, range_key)))
         if len(res) < 1:
             raise NotFoundError
         return res[0][2]
@@ -308,9 +811,30 @@ class SQLiteStorage(Storage):
             WHERE key = ? AND range_key = ?;
             """.format(self.table_name)
         data = buffer(data)
-        c = self.conn.cursor()
-        c.execute(s, (data, key, range_key))
-        self.conn.commit()
+        with self._lock:
+            c = self.conn.cursor()
+            c.execute(s, (data, key, range_key))
+            self.conn.commit()
+
+    def _delete(self, key, range_key):
+        s = """
+            DELETE FROM {}
+            WHERE key = ? AND range_key = ?;
+            """.format(self.table_name)
+        with self._lock:
+            c = self.conn.cursor()
+            c.execute(s, (key, range_key))
+            self.conn.commit()
+
+    def _delete_range(self, key, range_min, range_max):
+        s = """
+            DELETE FROM {}
+            WHERE key = ? AND range_key BETWEEN ? AND ?;
+            """.format(self.table_name)
+        with self._lock:
+            c = self.conn.cursor()
+            c.execute(s, (key, range_min, range_max))
+            self.conn.commit()
 
     def _query(self, key, range_min, range_max):
         s = """
@@ -318,11 +842,9 @@ class SQLiteStorage(Storage):
             WHERE key = ? AND range_key >= ? AND range_key <= ?
             ORDER BY range_key ASC
             """.format(self.table_name)
-        c = self.conn.cursor()
-        res = c.execute(s, (key, range_min, range_max))
-        items = []
-        for r in res:
-            items.append(r[2])
+        with self._reader() as conn:
+            res = conn.execute(s, (key, range_min, range_max))
+            items = [r[2] for r in res]
         try:
             left = self._left(key, range_min)
         except NotFoundError:
@@ -335,6 +857,11 @@ class SQLiteStorage(Storage):
 
 
 class RedisStorage(Storage):
+    # Members live in memory and are rewritten on every append
+    BUCKET_BYTES = 2048
+    # Set of all series keys (redis keys are shared with the cache)
+    KEYS_SET = "pytsdb:keys"
+
     def __init__(self, redis=None, expire=None, **kwargs):
         if expire is not None:
             self.expire = expire
@@ -343,8 +870,21 @@ class RedisStorage(Storage):
         if redis is not None:
             self.redis = redis
         else:
+            from redis import StrictRedis as Redis
             self.redis = Redis(**kwargs)
 
+    @property
+    def namespace(self):
+        kwargs = self.redis.connection_pool.connection_kwargs
+        return "redis:{}:{}:{}".format(kwargs.get("host"), kwargs.get("port"),
+                                       kwargs.get("db"))
+
+    def _ping(self):
+        self.redis.ping()
+
+    def close(self):
+        self.redis.connection_pool.disconnect()
+
     def _to_item(self, key, data):
         return Item.from_db_data(key, data)
 
@@ -353,10 +893,20 @@ class RedisStorage(Storage):
                 "range_key": item.range_key,
                 "data": item.to_string()}
 
+    def _keys(self):
+        keys = sorted(self.redis.smembers(self.KEYS_SET))
+        p = self.redis.pipeline()
+        for key in keys:
+            p.exists(key)
+        return [k.decode("utf-8") for k, e in zip(keys, p.execute()) if e]
+
     def _insert(self, key, range_key, data):
-        self.redis.zadd(key, range_key, data)
+        p = self.redis.pipeline()
+        p.zadd(key, range_key, data)
+        p.sadd(self.KEYS_SET, key)
         if self.expire:
-            self.redis.expire(key, self.expire)
+            p.expire(key, self.expire)
+        p.execute()
 
     def _get(self, key, range_key):
         l = self.redis.zrevrangebyscore(key, min=range_key, max=range_key,
@@ -379,6 +929,14 @@ class RedisStorage(Storage):
             raise NotFoundError
         return i[0]
 
+    def last_bulk(self, keys):
+        # One round trip for all keys
+        p = self.redis.pipeline(transaction=False)
+        for key in keys:
+            p.zrevrange(key, 0, 0)
+        return [self._to_item(k, i[0]) if i else None
+                for k, i in zip(keys, p.execute())]
+
     def _left(self, key, range_key):
         i = self.redis.zrevrangebyscore(key, min="-inf", max=range_key,
                                         start=0, num=1)
@@ -394,6 +952,12 @@ class RedisStorage(Storage):
             p.expire(key, self.expire)
         p.execute()
 
+    def _delete(self, key, range_key):
+        self.redis.zremrangebyscore(key, min=range_key, max=range_key)
+
+    def _delete_range(self, key, range_min, range_max):
+        self.redis.zremrangebyscore(key, min=range_min, max=range_max)
+
     def _query(self, key, range_min, range_max):
         items = self.redis.zrangebyscore(key, min=range_min, max=range_max)
         try:
@@ -409,7 +973,15 @@ class RedisStorage(Storage):
 
 class MemoryStorage(Storage):
     def __init__(self):
+        # key -> list of data blobs, sorted by range key
         self.cache = {}
+        # key -> array of range keys (parallel to cache)
+        self.range_keys = {}
+        self._id = binascii.hexlify(os.urandom(8)).decode("ascii")
+
+    @property
+    def namespace(self):
+        return "memory:{}".format(self._id)
 
     def _to_item(self, key, data):
         return Item.from_db_data(key, data)
@@ -421,15 +993,16 @@ class MemoryStorage(Storage):
 
     def _left(self, key, range_key):
         idx = self._le(key, range_key)
-        return self._at(key, idx).data
+        return self._at(key, idx)
 
     def _get_key(self, key):
-        if key not in self.cache:
-            self.cache[key] = list()
-        return self.cache[key]
+        return self.cache.get(key, [])
+
+    def _keys(self):
+        return [k for k in self.range_keys if len(self.range_keys[k]) > 0]
 
     def _get_range_keys(self, key):
-        return [r.range_key for r in self._get_key(key)]
+        return self.range_keys.get(key, _EMPTY_RANGE_KEYS)
 
     def _index(self, key, range_key):
         a = self._get_range_keys(key)
@@ -457,19 +1030,36 @@ class MemoryStorage(Storage):
         return self._get_key(key)[min:max]
 
     def _insert(self, key, range_key, data):
-        a = self._get_range_keys(key)
+        if key not in self.cache:
+            self.cache[key] = []
+            self.range_keys[key] = array.array("l")
+        a = self.range_keys[key]
         position = bisect.bisect_left(a, range_key)
         if position != len(a) and a[position] == range_key:
             raise ConflictError
-        self._get_key(key).insert(position, Element(key, range_key, data))
+        a.insert(position, range_key)
+        self.cache[key].insert(position, data)
 
     def _update(self, key, range_key, data):
         i = self._index(key, range_key)
-        self._get_key(key)[i] = Element(key, range_key, data)
+        self.cache[key][i] = data
+
+    def _delete(self, key, range_key):
+        i = self._index(key, range_key)
+        del self.range_keys[key][i]
+        del self.cache[key][i]
+
+    def _delete_range(self, key, range_min, range_max):
+        a = self._get_range_keys(key)
+        m = bisect.bisect_left(a, range_min)
+        e = bisect.bisect_right(a, range_max)
+        if e > m:
+            del self.range_keys[key][m:e]
+            del self.cache[key][m:e]
 
     def _get(self, key, range_key):
         i = self._index(key, range_key)
-        return self._at(key, i).data
+        return self._at(key, i)
 
     def _query(self, key, range_min, range_max):
         m = self._ge(key, range_min)
@@ -477,19 +1067,361 @@ class MemoryStorage(Storage):
             e = self._le(key, range_max) + 1
         except NotFoundError:
             return []
-        # Get one before maybe there is a range key inside
-        if m > 0:
+        # Get the one before if range_min is inside of it
+        a = self._get_range_keys(key)
+        if m > 0 and (m == len(a) or a[m] != range_min):
             m -= 1
-        return [x.data for x in self._slice(key, m, e)]
+        return self._slice(key, m, e)
 
     def _last(self, key):
         k = self._get_key(key)
         if len(k) > 0:
-            return k[-1].data
+            return k[-1]
         raise NotFoundError
 
     def _first(self, key):
         k = self._get_key(key)
         if len(k) > 0:
-            return k[0].data
+            return k[0]
         raise NotFoundError
+
+
+try:
+    _view = buffer
+except NameError:  # Python 3
+    def _view(obj, offset, size):
+        return memoryview(obj)[offset:offset + size]
+
+
+class _MMapSeries(object):
+    """Data and index file of one key.
+
+    The data file is an append-only sequence of records
+    (header: range_key, length + item data, padded to RECORD_ALIGN).
+    It grows in page-aligned chunks and is read with mmap.
+    The index file is an append-only log of (range_key, offset, length),
+    the latest entry for a range key wins (length -1 deletes it).
+    """
+    __slots__ = ("data_path", "index_path", "data_file", "index_file",
+                 "mm", "size", "end", "live", "dead", "range_keys", "offsets",
+                 "lengths")
+
+    def __init__(self, data_path, index_path):
+        self.data_path = data_path
+        self.index_path = index_path
+        self.mm = None
+        self._open()
+
+    def _open(self):
+        for p in [self.data_path, self.index_path]:
+            if not os.path.exists(p):
+                open(p, "wb").close()
+        self.data_file = open(self.data_path, "r+b")
+        self.index_file = open(self.index_path, "r+b")
+        self.size = os.path.getsize(self.data_path)
+        self.end = 0
+        self.live = 0
+        self.dead = 0
+        self.range_keys = array.array("l")
+        self.offsets = array.array("l")
+        self.lengths = array.array("l")
+        self._load_index()
+        self.mm = None
+
+    def _load_index(self):
+        entries = {}
+        raw = self.index_file.read()
+        size = MMapStorage.INDEX_ENTRY.size
+        for pos in range(0, len(raw) - len(raw) % size, size):
+            range_key, offset, length = \
+                MMapStorage.INDEX_ENTRY.unpack_from(raw, pos)
+            if range_key in entries:
+                self.dead += MMapStorage._record_size(entries[range_key][1])
+            if length < 0:
+                entries.pop(range_key, None)
+                continue
+            entries[range_key] = (offset, length)
+            self.end = max(self.end,
+                           offset + MMapStorage._record_size(length))
+        for range_key in sorted(entries):
+            offset, length = entries[range_key]
+            self.live += MMapStorage._record_size(length)
+            self.range_keys.append(range_key)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+        self.index_file.seek(0, os.SEEK_END)
+
+    def close(self):
+        # The mapping itself is released when no view uses it anymore
+        self.mm = None
+        self.data_file.close()
+        self.index_file.close()
+
+    def read(self, i):
+        offset = self.offsets[i] + MMapStorage.RECORD_HEADER.size
+        length = self.lengths[i]
+        if self.mm is None or len(self.mm) < offset + length:
+            self.mm = mmap.mmap(self.data_file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+        return _view(self.mm, offset, length)
+
+    def write(self, range_key, data):
+        length = len(data)
+        record_size = MMapStorage._record_size(length)
+        offset = self.end
+        if offset + record_size > self.size:
+            grow = max(offset + record_size, min(2 * self.size,
+                                                 self.size + (64 << 20)))
+            self.size = MMapStorage._page_align(grow)
+            self.data_file.truncate(self.size)
+        padding = record_size - MMapStorage.RECORD_HEADER.size - length
+        self.data_file.seek(offset)
+        self.data_file.write(MMapStorage.RECORD_HEADER.pack(range_key,
+                                                            length))
+        self.data_file.write(data)
+        self.data_file.write(b"\x00" * padding)
+        self.data_file.flush()
+        self.index_file.write(MMapStorage.INDEX_ENTRY.pack(range_key, offset,
+                                                           length))
+        self.index_file.flush()
+        self.end = offset + record_size
+        self.live += record_size
+        return offset, length
+
+    def delete(self, m, e):
+        """Delete the records m to e (exclusive).
+        """
+        self.index_file.write(b"".join(
+            MMapStorage.INDEX_ENTRY.pack(range_key, -1, -1)
+            for range_key in self.range_keys[m:e]))
+        self.index_file.flush()
+        size = sum(MMapStorage._record_size(length)
+                   for length in self.lengths[m:e])
+        self.live -= size
+        self.dead += size
+        del self.range_keys[m:e]
+        del self.offsets[m:e]
+        del self.lengths[m:e]
+
+
+class MMapStorage(Storage):
+    """Local storage with one memory mapped, append-only file per key.
+    Rewritten buckets are appended, the old record gets dead space
+    which is reclaimed by compact().
+    """
+    RECORD_HEADER = struct.Struct(str("<qI4x"))
+    RECORD_ALIGN = 16
+    INDEX_ENTRY = struct.Struct(str("<qqq"))
+    # Compact if dead space is larger than live space and this limit
+    COMPACT_MIN_DEAD = 1 << 20
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._series = {}
+        self._lock = threading.RLock()
+
+    @property
+    def namespace(self):
+        return "mmap:{}".format(os.path.abspath(self.directory))
+
+    @staticmethod
+    def _record_size(length):
+        size = MMapStorage.RECORD_HEADER.size + length
+        return size + (-size % MMapStorage.RECORD_ALIGN)
+
+    @staticmethod
+    def _page_align(size):
+        return size + (-size % mmap.PAGESIZE)
+
+    def _createTable(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _dropTable(self):
+        self.close()
+        if os.path.isdir(self.directory):
+            for f in os.listdir(self.directory):
+                if f.endswith(".data") or f.endswith(".index"):
+                    os.remove(os.path.join(self.directory, f))
+
+    def _ping(self):
+        if not os.path.isdir(self.directory):
+            raise IOError("directory not found")
+
+    def close(self):
+        with self._lock:
+            for s in self._series.values():
+                s.close()
+            self._series = {}
+
+    def _keys(self):
+        if not os.path.isdir(self.directory):
+            return []
+        keys = []
+        for f in sorted(os.listdir(self.directory)):
+            if not f.endswith(".index"):
+                continue
+            s = self._get_series_file(f[:-len(".index")])
+            if s is None or len(s.range_keys) < 1:
+                continue
+            name = f[:-len(".index")]
+            if name.startswith("_"):
+                name = binascii.unhexlify(name[1:]).decode("utf-8")
+            keys.append(name)
+        return keys
+
+    def _filename(self, key):
+        if re.match(r'^[a-z0-9\-][a-z0-9_\-\.]*$', key):
+            return key
+        if not isinstance(key, bytes):
+            key = key.encode("utf-8")
+        return "_" + binascii.hexlify(key).decode("ascii")
+
+    def _get_series(self, key, create=False):
+        return self._get_series_file(self._filename(key), create)
+
+    def _get_series_file(self, filename, create=False):
+        s = self._series.get(filename)
+        if s is not None:
+            return s
+        with self._lock:
+            if filename in self._series:
+                return self._series[filename]
+            path = os.path.join(self.directory, filename)
+            if not create and not os.path.exists(path + ".data"):
+                return None
+            self._createTable()
+            s = _MMapSeries(path + ".data", path + ".index")
+            self._series[filename] = s
+            return s
+
+    def _to_item(self, key, data):
+        return Item.from_db_data(key, data)
+
+    def _from_item(self, item):
+        return {"key": item.key,
+                "range_key": item.range_key,
+                "data": item.to_string()}
+
+    def _index(self, s, range_key):
+        if s is not None:
+            i = bisect.bisect_left(s.range_keys, range_key)
+            if i != len(s.range_keys) and s.range_keys[i] == range_key:
+                return i
+        raise NotFoundError
+
+    def _insert(self, key, range_key, data):
+        with self._lock:
+            s = self._get_series(key, create=True)
+            position = bisect.bisect_left(s.range_keys, range_key)
+            if (position != len(s.range_keys) and
+                    s.range_keys[position] == range_key):
+                raise ConflictError
+            offset, length = s.write(range_key, data)
+            s.range_keys.insert(position, range_key)
+            s.offsets.insert(position, offset)
+            s.lengths.insert(position, length)
+
+    def _update(self, key, range_key, data):
+        with self._lock:
+            s = self._get_series(key)
+            i = self._index(s, range_key)
+            old_size = self._record_size(s.lengths[i])
+            s.offsets[i], s.lengths[i] = s.write(range_key, data)
+            s.live -= old_size
+            s.dead += old_size
+            if s.dead > self.COMPACT_MIN_DEAD and s.dead > s.live:
+                self._compact(self._filename(key))
+
+    def _delete(self, key, range_key):
+        with self._lock:
+            s = self._get_series(key)
+            i = self._index(s, range_key)
+            s.delete(i, i + 1)
+
+    def _delete_range(self, key, range_min, range_max):
+        with self._lock:
+            s = self._get_series(key)
+            if s is None:
+                return
+            m = bisect.bisect_left(s.range_keys, range_min)
+            e = bisect.bisect_right(s.range_keys, range_max)
+            if e > m:
+                s.delete(m, e)
+
+    # Reads hold the lock for the index lookup (writes change the index
+    # arrays one after another, compaction replaces the series). The
+    # views stay valid after the lock is released, they keep their
+    # mapping alive.
+
+    def _get(self, key, range_key):
+        with self._lock:
+            s = self._get_series(key)
+            i = self._index(s, range_key)
+            return s.read(i)
+
+    def _first(self, key):
+        with self._lock:
+            s = self._get_series(key)
+            if s is None or len(s.range_keys) < 1:
+                raise NotFoundError
+            return s.read(0)
+
+    def _last(self, key):
+        with self._lock:
+            s = self._get_series(key)
+            if s is None or len(s.range_keys) < 1:
+                raise NotFoundError
+            return s.read(len(s.range_keys) - 1)
+
+    def _left(self, key, range_key):
+        with self._lock:
+            s = self._get_series(key)
+            if s is not None:
+                i = bisect.bisect_right(s.range_keys, range_key)
+                if i > 0:
+                    return s.read(i - 1)
+        raise NotFoundError
+
+    def _query(self, key, range_min, range_max):
+        with self._lock:
+            s = self._get_series(key)
+            if s is None:
+                return []
+            m = bisect.bisect_left(s.range_keys, range_min)
+            e = bisect.bisect_right(s.range_keys, range_max)
+            # Get the one before if range_min is inside of it
+            if m > 0 and (m == len(s.range_keys) or
+                          s.range_keys[m] != range_min):
+                m -= 1
+            if e <= m:
+                return []
+            return [s.read(i) for i in range(m, e)]
+
+    def compact(self, key=None):
+        """Rewrite the files of a key (or all keys) without dead records.
+        """
+        with self._lock:
+            if key is not None:
+                return self._compact(self._filename(key))
+            for f in os.listdir(self.directory):
+                if f.endswith(".index"):
+                    self._compact(f[:-len(".index")])
+
+    def _compact(self, filename):
+        s = self._get_series_file(filename)
+        if s is None or s.dead == 0:
+            return
+        data_tmp = s.data_path + ".compact"
+        index_tmp = s.index_path + ".compact"
+        for p in [data_tmp, index_tmp]:
+            if os.path.exists(p):
+                os.remove(p)
+        new = _MMapSeries(data_tmp, index_tmp)
+        for i in range(len(s.range_keys)):
+            new.write(s.range_keys[i], s.read(i))
+        new.close()
+        s.close()
+        os.rename(data_tmp, s.data_path)
+        os.rename(index_tmp, s.index_path)
+        self._series[filename] = _MMapSeries(s.data_path, s.index_path)
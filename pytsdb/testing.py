@@ -0,0 +1,334 @@
+#!/usr/bin/python
+# coding: utf8
+
+from __future__ import unicode_literals
+
+import re
+import bisect
+
+
+# Redis
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, type("")):
+        value = "{}".format(value)
+    return value.encode("utf-8")
+
+
+def _score(value):
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return float(value)
+
+
+class _FakeConnectionPool(object):
+    connection_kwargs = {"host": "fake", "port": 0, "db": 0}
+
+    def disconnect(self):
+        pass
+
+
+class FakeRedis(object):
+    """In-process stand-in for the redis commands of RedisStorage and
+    RedisLRU (sorted sets, sets, hashes and pipelines), e.g. for
+    benchmarks without a redis server.
+    """
+    def __init__(self):
+        self._data = {}
+        self.connection_pool = _FakeConnectionPool()
+
+    def ping(self):
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def _get(self, name, factory):
+        name = _bytes(name)
+        if name not in self._data:
+            self._data[name] = factory()
+        return self._data[name]
+
+    def exists(self, name):
+        return _bytes(name) in self._data
+
+    def delete(self, *names):
+        return sum(1 for n in names
+                   if self._data.pop(_bytes(n), None) is not None)
+
+    def expire(self, name, time):
+        return self.exists(name)
+
+    # Sets
+
+    def sadd(self, name, *values):
+        s = self._get(name, set)
+        before = len(s)
+        s.update(_bytes(v) for v in values)
+        return len(s) - before
+
+    def smembers(self, name):
+        return set(self._data.get(_bytes(name), set()))
+
+    # Sorted sets, kept as sorted list of (score, member)
+
+    def zadd(self, name, *args):
+        z = self._get(name, list)
+        added = 0
+        for score, member in zip(args[0::2], args[1::2]):
+            member = _bytes(member)
+            if self._zremove(z, member) == 0:
+                added += 1
+            bisect.insort(z, (float(score), member))
+        return added
+
+    @staticmethod
+    def _zremove(z, member):
+        for i, (_, m) in enumerate(z):
+            if m == member:
+                del z[i]
+                return 1
+        return 0
+
+    def zrem(self, name, *values):
+        z = self._data.get(_bytes(name), [])
+        removed = sum(self._zremove(z, _bytes(v)) for v in values)
+        self._cleanup(name)
+        return removed
+
+    def zcard(self, name):
+        return len(self._data.get(_bytes(name), []))
+
+    def _zscores(self, name, min, max):
+        z = self._data.get(_bytes(name), [])
+        low = bisect.bisect_left(z, (_score(min), b""))
+        high = low
+        max = _score(max)
+        while high < len(z) and z[high][0] <= max:
+            high += 1
+        return z, low, high
+
+    def zrangebyscore(self, name, min, max, start=None, num=None):
+        z, low, high = self._zscores(name, min, max)
+        members = [m for _, m in z[low:high]]
+        if start is not None:
+            members = members[start:start + num]
+        return members
+
+    def zrevrangebyscore(self, name, max, min, start=None, num=None):
+        z, low, high = self._zscores(name, min, max)
+        members = [m for _, m in reversed(z[low:high])]
+        if start is not None:
+            members = members[start:start + num]
+        return members
+
+    def zrange(self, name, start, end):
+        z = self._data.get(_bytes(name), [])
+        end = len(z) if end == -1 else end + 1
+        return [m for _, m in z[start:end]]
+
+    def zrevrange(self, name, start, end):
+        z = list(reversed(self._data.get(_bytes(name), [])))
+        end = len(z) if end == -1 else end + 1
+        return [m for _, m in z[start:end]]
+
+    def zremrangebyscore(self, name, min, max):
+        z, low, high = self._zscores(name, min, max)
+        del z[low:high]
+        self._cleanup(name)
+        return high - low
+
+    def zremrangebyrank(self, name, min, max):
+        z = self._data.get(_bytes(name), [])
+        max = len(z) if max == -1 else max + 1
+        removed = len(z[min:max])
+        del z[min:max]
+        self._cleanup(name)
+        return removed
+
+    def _cleanup(self, name):
+        if not self._data.get(_bytes(name), True):
+            del self._data[_bytes(name)]
+
+    # Hashes
+
+    def hset(self, name, key, value):
+        h = self._get(name, dict)
+        new = _bytes(key) not in h
+        h[_bytes(key)] = _bytes(value)
+        return int(new)
+
+    def hmset(self, name, mapping):
+        for k, v in mapping.items():
+            self.hset(name, k, v)
+        return True
+
+    def hget(self, name, key):
+        return self._data.get(_bytes(name), {}).get(_bytes(key))
+
+    def hmget(self, name, keys, *args):
+        h = self._data.get(_bytes(name), {})
+        return [h.get(_bytes(k)) for k in list(keys) + list(args)]
+
+    def hexists(self, name, key):
+        return _bytes(key) in self._data.get(_bytes(name), {})
+
+    def hdel(self, name, *keys):
+        h = self._data.get(_bytes(name), {})
+        removed = sum(1 for k in keys if h.pop(_bytes(k), None) is not None)
+        self._cleanup(name)
+        return removed
+
+
+class FakePipeline(object):
+    """Queued commands of a FakeRedis, run by execute().
+    """
+    def __init__(self, redis):
+        self._redis = redis
+        self._commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self._redis, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        return [c(*args, **kwargs) for c, args, kwargs in commands]
+
+
+# Cassandra
+
+class FakeInvalidRequest(Exception):
+    pass
+
+
+class FakeRow(object):
+    def __init__(self, columns, values):
+        self._columns = columns
+        self._values = values
+
+    def __getattr__(self, name):
+        try:
+            return self._values[self._columns.index(name)]
+        except ValueError:
+            raise AttributeError(name)
+
+    def __getitem__(self, i):
+        return self._values[i]
+
+
+class FakeFuture(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def result(self):
+        return self.rows
+
+
+class FakeCassandraSession(object):
+    """Cassandra stand-in for the statements of CassandraStorage.
+    Enforces the primary key: reads and deletes have to restrict the
+    whole partition key, ranges and order only on clustering columns.
+    """
+    def __init__(self):
+        self.tables = {}
+        self.partitions_read = []
+
+    def execute_async(self, query, params=()):
+        return FakeFuture(self.execute(query, params))
+
+    def execute(self, query, params=()):
+        q = " ".join(query.split()).rstrip(";")
+        params = list(params)
+        if q.startswith("CREATE KEYSPACE") or q.startswith("DROP KEYSPACE"):
+            return []
+        if q.startswith("SELECT now()"):
+            return [FakeRow(["now"], [0])]
+        m = re.match(r"CREATE TABLE IF NOT EXISTS (\S+) \((.*), "
+                     r"PRIMARY KEY \((.*)\) \)$", q)
+        if m:
+            columns = [c.split()[0] for c in m.group(2).split(", ")]
+            pk = m.group(3)
+            if pk.startswith("("):
+                partition, clustering = pk[1:].split(")")
+                partition = partition.split(", ")
+                clustering = [c for c in clustering.split(", ") if c]
+            else:
+                partition = pk.split(", ")[:1]
+                clustering = pk.split(", ")[1:]
+            self.tables.setdefault(m.group(1), {
+                "columns": columns, "partition": partition,
+                "clustering": clustering, "rows": {}})
+            return []
+        m = re.match(r"DROP TABLE IF EXISTS (\S+)$", q)
+        if m:
+            self.tables.pop(m.group(1), None)
+            return []
+        m = re.match(r"INSERT INTO (\S+) \((.*)\) VALUES", q)
+        if m:
+            t = self.tables[m.group(1)]
+            # Blobs are read back as bytes
+            params = [bytes(v) if isinstance(v, bytearray) else v
+                      for v in params]
+            row = dict(zip(m.group(2).split(", "), params))
+            if set(t["partition"] + t["clustering"]) - set(row):
+                raise FakeInvalidRequest("missing primary key")
+            p = tuple(row[c] for c in t["partition"])
+            c = tuple(row[c] for c in t["clustering"])
+            t["rows"].setdefault(p, {})[c] = row
+            return []
+        m = re.match(r"SELECT DISTINCT (.*) FROM (\S+)$", q)
+        if m:
+            t = self.tables[m.group(2)]
+            columns = m.group(1).split(", ")
+            if columns != t["partition"]:
+                raise FakeInvalidRequest("DISTINCT on partition key only")
+            return [FakeRow(columns, list(p))
+                    for p, rows in t["rows"].items() if rows]
+        m = re.match(r"(?:SELECT (.*)|DELETE) FROM (\S+) WHERE (.*?)"
+                     r"(?: ORDER BY (\w+) (ASC|DESC))?(?: LIMIT (\d+))?$", q)
+        if not m:
+            raise FakeInvalidRequest("unsupported: {}".format(q))
+        t = self.tables[m.group(2)]
+        conditions = []
+        for cond in m.group(3).split(" AND "):
+            column, op, _ = cond.split()
+            conditions.append((column, op, params.pop(0)))
+        partition = dict((c, v) for c, op, v in conditions
+                         if c in t["partition"] and op == "=")
+        if set(partition) != set(t["partition"]):
+            raise FakeInvalidRequest("partition key not restricted")
+        for c, op, v in conditions:
+            if c not in t["partition"] + t["clustering"]:
+                raise FakeInvalidRequest("no filtering on {}".format(c))
+        if m.group(4) and m.group(4) not in t["clustering"]:
+            raise FakeInvalidRequest("order by clustering column only")
+        p = tuple(partition[c] for c in t["partition"])
+        self.partitions_read.append((m.group(2), p))
+        ops = {"=": lambda a, b: a == b, ">=": lambda a, b: a >= b,
+               "<=": lambda a, b: a <= b, ">": lambda a, b: a > b,
+               "<": lambda a, b: a < b}
+        partition_rows = t["rows"].get(p, {})
+        selected = [ck for ck, row in sorted(partition_rows.items())
+                    if all(ops[op](row[c], v) for c, op, v in conditions)]
+        if m.group(5) == "DESC":
+            selected.reverse()
+        if m.group(6):
+            selected = selected[:int(m.group(6))]
+        if m.group(1) is None:
+            for ck in selected:
+                del partition_rows[ck]
+            return []
+        rows = [partition_rows[ck] for ck in selected]
+        if m.group(1) == "SUM(size)":
+            if not rows:
+                return [FakeRow(["sum"], [None])]
+            return [FakeRow(["sum"], [sum(r["size"] for r in rows)])]
+        columns = m.group(1).split(", ")
+        return [FakeRow(columns, [r[c] for c in columns]) for r in rows]
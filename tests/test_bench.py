@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# coding: utf8
+
+import unittest
+import logging
+import json
+import os
+
+
+from pytsdb import bench
+from pytsdb.storage import RedisStorage
+from pytsdb.models import Item
+from pytsdb.testing import FakeRedis
+
+
+class BenchTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        for f in ["test_bench.json", "test_baseline.json"]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_fakeredis(self):
+        r = RedisStorage(redis=FakeRedis())
+        for rk in [30, 10, 20]:
+            r.insert(Item.new("fake", [(rk, float(rk))]))
+        self.assertEqual(r.keys(), ["fake"])
+        self.assertEqual(r.first("fake").range_key, 10)
+        self.assertEqual(r.last("fake").range_key, 30)
+        self.assertEqual(r.left("fake", 25).range_key, 20)
+        self.assertEqual([i.range_key for i in r.query("fake", 15, 30)],
+                         [10, 20, 30])
+        r.update(Item.new("fake", [(20, 2.0)]))
+        self.assertEqual(r.get("fake", 20)[0], (20, 2.0))
+        self.assertEqual(r.last_bulk(["fake", "none"])[1], None)
+        r.delete_range("fake", 0, 25)
+        self.assertEqual(r.count("fake"), 1)
+
+    def test_bench(self):
+        results = bench.run(["memory", "cached"], scale=0.02, repeat=1)
+        self.assertEqual(results["scale"], 0.02)
+        names = sorted(results["results"])
+        self.assertIn("memory.ingest_append", names)
+        self.assertIn("cached.cache_hits", names)
+        self.assertNotIn("memory.cache_hits", names)
+        self.assertNotIn("cached.aggregation", names)
+        for r in results["results"].values():
+            self.assertGreater(r["ops"], 0)
+            self.assertGreater(r["ops_per_second"], 0)
+
+        # Regressions against a baseline
+        self.assertEqual(bench.compare(results, results), [])
+        baseline = json.loads(json.dumps(results))
+        baseline["results"]["memory.query_long"]["ops_per_second"] *= 2
+        regressions = bench.compare(results, baseline, threshold=0.2)
+        self.assertEqual([r[0] for r in regressions], ["memory.query_long"])
+        baseline["scale"] = 1.0
+        with self.assertRaises(ValueError):
+            bench.compare(results, baseline)
+
+    def test_main(self):
+        args = ["--backend", "memory", "--benchmark", "query_long",
+                "--scale", "0.02", "--repeat", "1"]
+        self.assertEqual(bench.main(args + ["--output", "test_bench.json"]), 0)
+        with open("test_bench.json") as f:
+            baseline = json.load(f)
+        baseline["results"]["memory.query_long"]["ops_per_second"] *= 100
+        with open("test_baseline.json", "w") as f:
+            json.dump(baseline, f)
+        self.assertEqual(bench.main(args + ["--compare",
+                                            "test_baseline.json"]), 1)
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# coding: utf8
+
+import unittest
+import logging
+
+
+from pytsdb import TSDB
+from pytsdb.events import DataEvent
+from pytsdb.continuous import ContinuousQuery
+
+
+class ContinuousTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_query(self):
+        q = ContinuousQuery("sensor*.temp", "sensor*.temp.1h")
+        self.assertEqual(q.target_key("sensor1.temp"), "sensor1.temp.1h")
+        self.assertIsNone(q.target_key("sensor1.hum"))
+        self.assertIsNone(q.target_key("sensor1.temp.1h"))
+        self.assertEqual(q.windows(3601, 7300), (3600, 10799))
+        self.assertEqual(q.windows(3600, 3600), (3600, 7199))
+        with self.assertRaises(ValueError):
+            ContinuousQuery("a*", "b")
+        with self.assertRaises(ValueError):
+            ContinuousQuery("a", "b", function="median")
+
+    def test_continuousqueries(self):
+        db = TSDB(STORAGE="memory", ENABLE_CACHING=False,
+                  ENABLE_EVENTS=False,
+                  CONTINUOUS_QUERIES=[
+                      {"source": "sensor*.temp", "target": "sensor*.temp.1h",
+                       "interval": 3600, "function": "mean"},
+                      {"source": "sensor*.temp.1h",
+                       "target": "sensor*.temp.1d",
+                       "interval": 86400, "function": "max"}])
+        db.insert("sensor1.temp", [(i * 600, float(i)) for i in range(12)])
+        res = db.query("sensor1.temp.1h", 0, 86400)
+        self.assertEqual(list(res.all()), [(0, 2.5), (3600, 8.5)])
+        self.assertEqual(list(db.query("sensor1.temp.1d", 0, 86400).all()),
+                         [(0, 8.5)])
+
+        # Only the windows of the insert are recomputed
+        windows = db.continuous.metrics["windows"]
+        db.insert("sensor1.temp", [(3700, 100.0)])
+        self.assertEqual(db.continuous.metrics["windows"], windows + 2)
+        res = list(db.query("sensor1.temp.1h", 0, 86400).all())
+        self.assertEqual(res[0], (0, 2.5))
+        self.assertAlmostEqual(res[1][1], 151.0 / 7, places=4)
+        res = list(db.query("sensor1.temp.1d", 0, 86400).all())
+        self.assertAlmostEqual(res[0][1], 151.0 / 7, places=4)
+        db.insert("sensor2.hum", [(0, 1.0)])
+        self.assertEqual(db.stats("sensor2.hum.1h"), None)
+
+        # Deletes keep the aggregates
+        db.delete("sensor1.temp", 0, 7200)
+        self.assertEqual(len(db.query("sensor1.temp.1h", 0, 86400)), 2)
+        db.close()
+
+    def test_eventdriven(self):
+        db = TSDB(STORAGE="memory", ENABLE_CACHING=False,
+                  ENABLE_EVENTS=False, CONTINUOUS_QUERIES_SYNC=False,
+                  CONTINUOUS_QUERIES=[{"source": "a", "target": "a.sum",
+                                       "interval": 10, "function": "sum"}])
+        stats = db.insert("a", [(1, 1.0), (5, 2.0), (12, 3.0)])
+        self.assertIsNone(db.stats("a.sum"))
+        db.continuous.on_event("a", DataEvent(**stats_event(stats)))
+        self.assertEqual(list(db.query("a.sum", 0, 100).all()),
+                         [(0, 3.0), (10, 3.0)])
+        db.continuous.remove("a.sum")
+        self.assertEqual(len(db.continuous), 0)
+        self.assertEqual(db.continuous.backfill("a"), 0)
+        db.close()
+
+
+def stats_event(stats):
+    return dict((k, stats[k]) for k in ["key", "ts_min", "ts_max", "count",
+                                        "appended", "inserted", "updated"])
@@ -5,9 +5,19 @@ import unittest
 import random
 import logging
 import os
+import sys
+import subprocess
+import shutil
+import threading
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 from pytsdb import TSDB
+from pytsdb.models import Item
+from pytsdb.resources import registry
 
 
 class DatabaseTest(unittest.TestCase):
@@ -33,6 +43,7 @@ class DatabaseTest(unittest.TestCase):
                   CASSANDRA_PORT=cassandra_port)
         db.storage._dropTable()
         db.storage._createTable()
+        db.clear_cache()
 
         d1 = [(i * 600, 6.5) for i in range(500)]
         d2 = [(i * 600, 25.5) for i in range(500)]
@@ -97,6 +108,7 @@ class DatabaseTest(unittest.TestCase):
                   CASSANDRA_PORT=cassandra_port)
         db.storage._dropTable()
         db.storage._createTable()
+        db.clear_cache()
         for i in range(0, 300):
             db._insert("cass", [(i * 10 * 60, 1.1)])
 
@@ -146,6 +158,41 @@ class DatabaseTest(unittest.TestCase):
             d = TSDB()
             d._insert("hüü", [(1, 1.1)])
 
+    def test_insertcolumns(self):
+        import array
+        d = TSDB(STORAGE="memory", ENABLE_CACHING=False, ENABLE_EVENTS=False,
+                 BUCKET_DYNAMIC_TARGET=10, BUCKET_DYNAMIC_MAX=20)
+        stats = d.insert_columns("A", array.array("I", range(0, 50, 2)),
+                                 array.array("f", [1.0] * 25))
+        self.assertEqual(stats["appended"], 25)
+        self.assertIn("A", d._known_keys)
+        # Unsorted input, merged into the existing buckets
+        stats = d.insert_columns("a", [31, 3, 1, 60], [3.0, 2.0, 2.0, 4.0])
+        self.assertEqual(stats["inserted"], 4)
+        ts = array.array("I", [100, 102])
+        values = array.array("f", [5.0, 6.0])
+        d.insert_bulk([{"key": "a", "timestamps": ts.tostring(),
+                        "values": values.tostring()}])
+        res = d.query("a", 0, 200)
+        self.assertEqual(len(res), 31)
+        self.assertEqual(list(res.all())[:3], [(0, 1.0), (1, 2.0), (2, 1.0)])
+        self.assertEqual(list(res.all())[-3:], [(60, 4.0), (100, 5.0),
+                                                (102, 6.0)])
+        with self.assertRaises(ValueError):
+            d.insert_columns("a", [1, 2], [1.0])
+        with self.assertRaises(ValueError):
+            d.insert_columns("a", [], [])
+        with self.assertRaises(ValueError):
+            d.insert_columns("a b", [1], [1.0])
+        if numpy is not None:
+            d.insert_columns("n", numpy.arange(10, 0, -1),
+                             numpy.arange(10, dtype="f8"))
+            self.assertEqual(d.query("n", 0, 3).to_list(),
+                             [(1, 9.0), (2, 8.0), (3, 7.0)])
+            with self.assertRaises(ValueError):
+                d.insert_columns("n", numpy.array([-1]), numpy.zeros(1))
+        d.close()
+
     def test_merge(self):
         d = TSDB(BUCKET_TYPE="dynamic", BUCKET_DYNAMIC_TARGET=2, BUCKET_DYNAMIC_MAX=2)
         d._insert("merge", [(1, 2.0), (2, 3.0), (5, 6.0), (6, 7.0),
@@ -294,3 +341,460 @@ class DatabaseTest(unittest.TestCase):
         self.assertEqual(len(res), 49999)
         res = d._query("large", 0, 49999)
         self.assertEqual(len(res), 50000)
+
+    def test_sharedresources(self):
+        d1 = TSDB(STORAGE="sqlite", SQLITE_FILE="test_shared.db3")
+        d2 = TSDB(STORAGE="sqlite", SQLITE_FILE="test_shared.db3")
+        d3 = TSDB(STORAGE="memory")
+        self.assertIs(d1.storage, d2.storage)
+        self.assertIs(d1.redis_pool, d3.redis_pool)
+        self.assertIsNot(d1.storage, d3.storage)
+        self.assertEqual(d1.health(), {"storage": True, "cache": True,
+                                       "events": True})
+
+        d1.storage._dropTable()
+        d1.storage._createTable()
+        d1.clear_cache()
+        d1.insert("shared", [(1, 1.0), (2, 2.0)])
+        self.assertEqual(len(d2.query("shared", 0, 10)), 2)
+        # Same key in another storage is not affected by the cache
+        self.assertEqual(len(d3.query("shared", 0, 10)), 0)
+        d3.insert("shared", [(5, 1.0)])
+        self.assertEqual(d3.stats("shared")["count"], 1)
+        self.assertEqual(d2.stats("shared")["count"], 2)
+
+        name = ("sqlite", os.path.abspath("test_shared.db3"))
+        d1.close()
+        self.assertIn(name, registry)
+        d2.close()
+        d2.close()
+        self.assertNotIn(name, registry)
+        d3.close()
+        os.remove("test_shared.db3")
+
+    def test_nocachenoevents(self):
+        d = TSDB(ENABLE_CACHING=False, ENABLE_EVENTS=False)
+        self.assertIsNone(d.redis_pool)
+        self.assertEqual(d.health(), {"storage": True})
+        d.insert("x", [(1, 1.0)])
+        self.assertEqual(d.stats("x")["count"], 1)
+        d.close()
+
+    def test_lazyimports(self):
+        code = ("import sys, pytsdb; "
+                "d = pytsdb.TSDB(ENABLE_CACHING=False, ENABLE_EVENTS=False); "
+                "d.insert('a', [(1, 1.0)]); "
+                "print(' '.join(m for m in ['redis', 'flask', 'cassandra'] "
+                "if m in sys.modules))")
+        out = subprocess.check_output([sys.executable, "-c", code])
+        self.assertEqual(out.strip(), b"")
+
+    def test_mmap(self):
+        d = TSDB(STORAGE="mmap", MMAP_DIRECTORY="test_tsdb_mmap",
+                 BUCKET_TYPE="dynamic", BUCKET_DYNAMIC_TARGET=10,
+                 BUCKET_DYNAMIC_MAX=20)
+        d.storage._dropTable()
+        d.clear_cache()
+        for i in range(0, 100, 5):
+            d.insert("mmap", [(i + x, float(i + x)) for x in range(5)])
+        d.insert("mmap", [(1000, 1.0), (50, 3.0), (51, 4.0)])
+        res = d.query("mmap", 0, 1000)
+        self.assertEqual(len(res), 101)
+        self.assertEqual(res[-1], (1000, 1.0))
+        self.assertEqual(d.stats("mmap")["count"], 101)
+        d.storage._dropTable()
+        d.close()
+        os.rmdir("test_tsdb_mmap")
+
+    def test_lsm(self):
+        d = TSDB(STORAGE="lsm", LSM_DIRECTORY="test_tsdb_lsm",
+                 BUCKET_TYPE="dynamic", BUCKET_DYNAMIC_TARGET=10,
+                 BUCKET_DYNAMIC_MAX=20)
+        d.storage._dropTable()
+        d.clear_cache()
+        for i in range(0, 100, 5):
+            d.insert("lsm", [(i + x, float(i + x)) for x in range(5)])
+        d.storage.flush()
+        d.insert("lsm", [(1000, 1.0), (50, 3.0), (51, 4.0)])
+        res = d.query("lsm", 0, 1000)
+        self.assertEqual(len(res), 101)
+        self.assertEqual(res[-1], (1000, 1.0))
+        self.assertEqual(d.stats("lsm")["count"], 101)
+        d.storage._dropTable()
+        d.close()
+        shutil.rmtree("test_tsdb_lsm")
+
+    def test_compact(self):
+        d = TSDB(BUCKET_TYPE="dynamic", BUCKET_DYNAMIC_TARGET=10,
+                 BUCKET_DYNAMIC_MAX=20, ENABLE_CACHING=False,
+                 ENABLE_EVENTS=False)
+        # Backfills let buckets grow up to the max size
+        for i in range(0, 100, 10):
+            d.insert("frag", [(i + x, float(i + x)) for x in range(5)])
+        for i in range(95, 0, -10):
+            d.insert("frag", [(i + x, float(i + x)) for x in range(5)])
+        buckets = d.storage.query("frag", 0, 1000)
+        self.assertGreater(max(len(b) for b in buckets), 10)
+
+        s = d.compact("frag")
+        self.assertEqual(s["points"], 100)
+        self.assertEqual(s["buckets_before"], len(buckets))
+        self.assertEqual(s["buckets_after"], 10)
+        self.assertEqual(s["written"], 10)
+        old = set(b.range_key for b in buckets)
+        self.assertEqual(s["deleted"], len(old - set(range(0, 100, 10))))
+        self.assertGreater(s["read_amplification_before"],
+                           s["read_amplification_after"])
+        self.assertAlmostEqual(s["read_amplification_after"], 1.9)
+        self.assertAlmostEqual(s["rows_per_query_after"], 1.9)
+        buckets = d.storage.query("frag", 0, 1000)
+        self.assertEqual([len(b) for b in buckets], [10] * 10)
+        res = d.query("frag", 0, 1000)
+        self.assertEqual(len(res), 100)
+        for ts, v in res.all():
+            self.assertAlmostEqual(float(ts), v)
+
+        # Nothing to do
+        s = d.compact("frag")
+        self.assertEqual(s["written"], 0)
+        self.assertEqual(d.compact("unknown")["buckets_before"], 0)
+        d.insert("frag", [(100, 100.0)])
+        self.assertEqual(d.storage.last("frag")[0], (100, 100.0))
+        d.close()
+
+    def test_compact_windows(self):
+        d = TSDB(BUCKET_TYPE="dynamic", BUCKET_DYNAMIC_TARGET=10,
+                 BUCKET_DYNAMIC_MAX=20, ENABLE_CACHING=False,
+                 ENABLE_EVENTS=False)
+        d.COMPACTION_WINDOW = 2
+        for i in range(0, 1000, 10):
+            d.insert("win", [(i + x, float(i + x)) for x in range(5)])
+        for i in range(995, 0, -10):
+            d.insert("win", [(i + x, float(i + x)) for x in range(5)])
+        # Buckets left behind by an interrupted compaction
+        d.storage.insert(Item.new("win", [(x, float(x))
+                                          for x in range(501, 511)]))
+        self.assertEqual(len(d.query("win", 0, 1000)), 1000)
+
+        stop = threading.Event()
+        errors = []
+
+        def read():
+            while not stop.is_set():
+                ts = [t for t, _ in d.query("win", 0, 1000).all()]
+                if ts != list(range(1000)):
+                    errors.append(len(ts))
+        t = threading.Thread(target=read)
+        t.start()
+        try:
+            s = d.compact("win")
+        finally:
+            stop.set()
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(s["buckets_after"], 100)
+        self.assertAlmostEqual(s["read_amplification_after"], 1.9)
+        buckets = d.storage.query("win", 0, 1000)
+        self.assertEqual([b.range_key for b in buckets],
+                         list(range(0, 1000, 10)))
+        self.assertEqual(d.compact("win")["written"], 0)
+        d.close()
+
+    def test_compactor(self):
+        d = TSDB(BUCKET_TYPE="dynamic", BUCKET_DYNAMIC_TARGET=10,
+                 BUCKET_DYNAMIC_MAX=20, ENABLE_CACHING=False,
+                 ENABLE_EVENTS=False, ENABLE_COMPACTION=True,
+                 COMPACTION_DELAY=3600)
+        for k in ["a", "b"]:
+            for i in range(0, 100, 10):
+                d.insert(k, [(i + x, float(i + x)) for x in range(5)])
+            for i in range(95, 0, -10):
+                d.insert(k, [(i + x, float(i + x)) for x in range(5)])
+        d.insert("c", [(i, 1.0) for i in range(10)])
+        self.assertEqual(len(d.compactor), 2)
+        self.assertEqual(d.compactor.run_pending(), [])
+        res = d.compactor.run_pending(force=True)
+        self.assertEqual([s["key"] for s in res], ["a", "b"])
+        self.assertEqual(len(d.compactor), 0)
+        m = d.compactor.metrics
+        self.assertEqual(m["keys"], 2)
+        self.assertEqual(m["buckets_after"], 20)
+        self.assertEqual(m["buckets_before"], 12)
+        self.assertEqual(len(d.query("b", 0, 1000)), 100)
+
+        # Appends restart the delay of a scheduled key
+        d.insert("a", [(50, 1.0)], overwrite=True)
+        d.compactor._pending["a"] = 0
+        d.insert("a", [(200, 1.0)])
+        self.assertGreater(d.compactor._pending["a"], 0)
+        d.insert("c", [(200, 1.0)])
+        self.assertNotIn("c", d.compactor._pending)
+        d.close()
+        self.assertIsNone(d.compactor._thread)
+
+    def test_compact_concurrent(self):
+        d = TSDB(BUCKET_TYPE="dynamic", BUCKET_DYNAMIC_TARGET=10,
+                 BUCKET_DYNAMIC_MAX=20, ENABLE_CACHING=False,
+                 ENABLE_EVENTS=False)
+        stop = threading.Event()
+        errors = []
+
+        def compact():
+            while not stop.is_set():
+                try:
+                    d.compact("race")
+                except Exception as e:
+                    errors.append(e)
+                    return
+        t = threading.Thread(target=compact)
+        t.start()
+        ts = list(range(1000))
+        random.Random(1).shuffle(ts)
+        d.insert("race", [(0, 0.0)])
+        try:
+            for i in range(0, 1000, 10):
+                d.insert("race", [(x, float(x)) for x in ts[i:i + 10]])
+        finally:
+            stop.set()
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(d.query("race", 0, 1000)), 1000)
+        self.assertEqual(d._key_locks, {})
+        d.close()
+
+    def test_delete(self):
+        d = TSDB(BUCKET_TYPE="dynamic", BUCKET_DYNAMIC_TARGET=10,
+                 BUCKET_DYNAMIC_MAX=20, ENABLE_CACHING=False,
+                 ENABLE_EVENTS=False)
+        d.insert("del", [(i, float(i)) for i in range(100)])
+        self.assertEqual(len(d.storage.query("del", 0, 1000)), 10)
+        # Only the edge buckets are decoded
+        decoded = []
+        to_item = d.storage._to_item
+        d.storage._to_item = lambda k, data: decoded.append(data) or \
+            to_item(k, data)
+        s = d.delete("del", 15, 54)
+        self.assertEqual(len(decoded), 2)
+        del d.storage._to_item
+        self.assertEqual(s["deleted"], 40)
+        self.assertEqual(s["dropped"], 3)
+        self.assertEqual(s["rewritten"], 2)
+        res = d.query("del", 0, 1000)
+        self.assertEqual(len(res), 60)
+        self.assertEqual([ts for ts, v in res.all()],
+                         list(range(15)) + list(range(55, 100)))
+        buckets = d.storage.query("del", 0, 1000)
+        self.assertEqual([b.range_key for b in buckets],
+                         [0, 10, 55, 60, 70, 80, 90])
+        self.assertEqual(d.stats("del")["count"], 60)
+
+        # Nothing left in the range
+        self.assertEqual(d.delete("del", 20, 50)["deleted"], 0)
+        # The tail
+        s = d.delete("del", 95, 2000)
+        self.assertEqual(s["deleted"], 5)
+        self.assertEqual(d.storage.last("del")[-1], (94, 94.0))
+        d.insert("del", [(96, 1.0)])
+        self.assertEqual(len(d.query("del", 0, 1000)), 56)
+        # Everything
+        s = d.delete("del", 0, 2000)
+        self.assertEqual(s["deleted"], 56)
+        self.assertEqual(len(d.storage.query("del", 0, 1000)), 0)
+        self.assertIsNone(d.stats("del"))
+        d.close()
+
+    def test_deletehourly(self):
+        d = TSDB(BUCKET_TYPE="hourly", ENABLE_CACHING=False,
+                 ENABLE_EVENTS=False)
+        d.insert("delh", [(i * 600, 1.0) for i in range(60)])
+        s = d.delete("delh", 3000, 4 * 3600 + 1200)
+        self.assertEqual(s["deleted"], 22)
+        self.assertEqual(s["dropped"], 3)
+        self.assertEqual(s["rewritten"], 2)
+        buckets = d.storage.query("delh", 0, 10 * 3600)
+        self.assertEqual([b.range_key for b in buckets],
+                         [h * 3600 for h in [0, 4, 5, 6, 7, 8, 9]])
+        self.assertEqual(len(d.query("delh", 0, 10 * 3600)), 38)
+        d.close()
+
+    def test_retention(self):
+        now = 100000
+        d = TSDB(ENABLE_CACHING=False, ENABLE_EVENTS=False,
+                 RETENTION={"sensor.*": 1000, "sensor.keep": 100000,
+                            "sensor.short.*": 100})
+        self.assertEqual(d.retention.policy("sensor.a"), 1000)
+        self.assertEqual(d.retention.policy("sensor.short.a"), 100)
+        self.assertEqual(d.retention.policy("sensor.keep"), 100000)
+        self.assertIsNone(d.retention.policy("other"))
+        for k in ["sensor.a", "sensor.short.a", "sensor.keep", "other"]:
+            d.insert(k, [(now - 5000 + i * 10, 1.0) for i in range(500)])
+        # Keys are listed by the storage
+        d.storage.insert(Item.new("sensor.b", [(now - 2000, 1.0),
+                                               (now, 1.0)]))
+        res = d.retention.run(now=now)
+        self.assertEqual(sorted(s["key"] for s in res),
+                         ["sensor.a", "sensor.b", "sensor.short.a"])
+        self.assertEqual(d.stats("sensor.a")["ts_min"], now - 1000)
+        self.assertEqual(d.stats("sensor.short.a")["count"], 10)
+        self.assertEqual(d.stats("sensor.keep")["count"], 500)
+        self.assertEqual(d.stats("other")["count"], 500)
+        m = d.retention.metrics
+        self.assertEqual(m["keys"], 4)
+        self.assertEqual(m["deleted"], 400 + 490 + 1)
+        self.assertGreater(d.retention.points_per_second(), 0)
+        d.close()
+        self.assertIsNone(d.retention._thread)
+
+    def test_bucketsettings(self):
+        small = TSDB(BUCKET_DYNAMIC_TARGET=10, BUCKET_DYNAMIC_MAX=10,
+                     ENABLE_CACHING=False, ENABLE_EVENTS=False)
+        large = TSDB(BUCKET_DYNAMIC_BYTES=808, BUCKET_TYPE="hourly",
+                     ENABLE_CACHING=False, ENABLE_EVENTS=False)
+        auto = TSDB(BUCKET_DYNAMIC_BYTES="auto",
+                    BUCKET_POLICIES={"fine.*": 88},
+                    ENABLE_CACHING=False, ENABLE_EVENTS=False)
+        data = [(i, 1.0) for i in range(1000)]
+        small.insert("a", list(data))
+        large.insert("a", list(data))
+        self.assertEqual(len(small.storage.query("a", 0, 1000)), 100)
+        # Settings of other instances are not shared
+        self.assertEqual(len(large.storage.query("a", 0, 1000)), 1)
+        self.assertEqual(large.storage.last("a").bucket_type.name, "hourly")
+        auto.insert("a", list(data))
+        self.assertEqual(len(auto.storage.query("a", 0, 1000)), 2)
+        auto.insert("fine.a", list(data))
+        self.assertEqual(len(auto.storage.query("fine.a", 0, 1000)), 100)
+        for d in [small, large, auto]:
+            d.close()
+
+    def test_parallelquery(self):
+        for storage in ["memory", "sqlite"]:
+            d = TSDB(STORAGE=storage, SQLITE_FILE="test_parallel.db3",
+                     BUCKET_DYNAMIC_TARGET=10, BUCKET_DYNAMIC_MAX=20,
+                     ENABLE_CACHING=False, ENABLE_EVENTS=False,
+                     QUERY_WORKERS=3, QUERY_PARTITION=100)
+            if storage == "sqlite":
+                d.storage._dropTable()
+                d.storage._createTable()
+            self.assertEqual(d._query_ranges(0, 99), [(0, 99)])
+            self.assertEqual(d._query_ranges(0, 299),
+                             [(0, 99), (100, 199), (200, 299)])
+            self.assertEqual(len(d._query_ranges(0, 10000)), 12)
+            d.insert("p", [(i * 7, float(i)) for i in range(1000)])
+            for ts_min, ts_max in [(0, 7000), (3, 6990), (500, 520),
+                                   (-100, 20000)]:
+                res = d.query("p", ts_min, ts_max)
+                expected = [(i * 7, float(i)) for i in range(1000)
+                            if ts_min <= i * 7 <= ts_max]
+                self.assertEqual(list(res.all()), expected)
+                chunks = list(d.iter_query("p", ts_min, ts_max))
+                self.assertEqual([p for c in chunks for p in c.all()],
+                                 expected)
+            self.assertEqual(len(list(d.iter_query("p", 0, 7000))), 12)
+            self.assertIsNotNone(d._query_pool)
+            if storage == "sqlite":
+                # Only the pool threads have reader connections
+                self.assertLessEqual(len(d.storage._readers), 3)
+                readers = set(d.storage._readers.values())
+                threads = [threading.Thread(target=d.query, args=("p", 0, 50))
+                           for _ in range(20)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                self.assertEqual(set(d.storage._readers.values()), readers)
+            d.close()
+            self.assertIsNone(d._query_pool)
+        os.remove("test_parallel.db3")
+
+    def test_lastvalue(self):
+        for storage, caching, local in [("memory", False, False),
+                                        ("sqlite", True, False),
+                                        ("redis", True, True)]:
+            d = TSDB(STORAGE=storage, SQLITE_FILE="test_latest.db3",
+                     ENABLE_CACHING=caching, ENABLE_EVENTS=False,
+                     LATEST_LOCAL=local, BUCKET_DYNAMIC_TARGET=10,
+                     BUCKET_DYNAMIC_MAX=20)
+            if storage == "sqlite":
+                d.storage._dropTable()
+                d.storage._createTable()
+            if storage == "redis":
+                for k in ["l1", "l2", "l3"]:
+                    d.storage.redis.delete(k)
+            d.clear_cache()
+            self.assertIsNone(d.last_value("l1"))
+            self.assertEqual(len(d.latest("l1", 5)), 0)
+            d.insert("l1", [(i, float(i)) for i in range(50)])
+            d.insert("l2", [(5, 1.0)])
+            self.assertEqual(d.last_value("L1"), (49, 49.0))
+            self.assertEqual(d.last_values(["l2", "l3", "l1"]),
+                             [(5, 1.0), None, (49, 49.0)])
+
+            # Without the latest records (e.g. another process wrote)
+            d.clear_cache()
+            if d._latest is not None:
+                d._latest.clear()
+            self.assertEqual(d.last_values(["l1", "l2"]),
+                             [(49, 49.0), (5, 1.0)])
+            d.insert("l1", [(10, 3.0), (60, 2.0)])
+            self.assertEqual(d.last_value("l1"), (60, 2.0))
+
+            res = d.latest("l1", 25)
+            self.assertEqual(len(res), 25)
+            self.assertEqual(res[0], (26, 26.0))
+            self.assertEqual(res[-1], (60, 2.0))
+            self.assertEqual(len(d.latest("l1", 1000)), 51)
+            with self.assertRaises(ValueError):
+                d.latest("l1", 0)
+
+            d.delete("l1", 55, 100)
+            self.assertEqual(d.last_value("l1"), (49, 49.0))
+            d.close()
+        os.remove("test_latest.db3")
+
+    def test_valueat(self):
+        d = TSDB(STORAGE="memory", ENABLE_CACHING=False, ENABLE_EVENTS=False,
+                 BUCKET_DYNAMIC_TARGET=10, BUCKET_DYNAMIC_MAX=20)
+        d.insert("a", [(i * 10, float(i)) for i in range(100)])
+        self.assertEqual(d.value_at("a", 0), (0, 0.0))
+        self.assertEqual(d.value_at("A", 255), (250, 25.0))
+        self.assertEqual(d.value_at("a", 5000), (990, 99.0))
+        self.assertIsNone(d.value_at("a", -1))
+        self.assertIsNone(d.value_at("a", 5000, tolerance=100))
+        self.assertEqual(d.value_at("a", 995, tolerance=5), (990, 99.0))
+        self.assertIsNone(d.value_at("unknown", 5))
+        d.close()
+
+    def test_iterresample(self):
+        d = TSDB(STORAGE="memory", ENABLE_CACHING=False, ENABLE_EVENTS=False,
+                 BUCKET_DYNAMIC_TARGET=10, BUCKET_DYNAMIC_MAX=20,
+                 QUERY_WORKERS=3, QUERY_PARTITION=100)
+        d.insert("a", [(i * 7, float(i)) for i in range(1000) if i % 50 > 5])
+        for fill in ["none", "previous", "linear", "zero"]:
+            chunks = list(d.iter_resample("a", 0, 7000, 60, fill))
+            self.assertGreater(len(chunks), 1)
+            expected = d.query("a", 0, 7000).resample(60, fill)
+            self.assertEqual([p for c in chunks for p in c.all()],
+                             list(expected.all()))
+        self.assertEqual(list(d.iter_resample("unknown", 0, 100, 10)), [])
+        d.close()
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_asofjoin(self):
+        d = TSDB(STORAGE="memory", ENABLE_CACHING=False, ENABLE_EVENTS=False,
+                 BUCKET_DYNAMIC_TARGET=10, BUCKET_DYNAMIC_MAX=20)
+        d.insert("a", [(i * 10, float(i)) for i in range(100)])
+        d.insert("b", [(15, 1.0), (35, 2.0), (100, 3.0)])
+        res = d.as_of_join(["a", "b", "c"], 20, 40)
+        self.assertEqual(list(res.dtype.names), ["ts", "a", "b", "c"])
+        self.assertEqual(list(res["ts"]), [20, 30, 35, 40])
+        self.assertEqual(list(res["a"]), [2.0, 3.0, 3.0, 4.0])
+        self.assertEqual(list(res["b"]), [1.0, 1.0, 2.0, 2.0])
+        self.assertTrue(numpy.isnan(res["c"]).all())
+
+        res = d.as_of_join(["a", "b"], 0, 60, tolerance=10)
+        self.assertEqual(list(res["ts"]), [0, 10, 15, 20, 30, 35, 40, 50, 60])
+        b = [None if numpy.isnan(x) else x for x in res["b"]]
+        self.assertEqual(b, [None, None, 1.0, 1.0, None, 2.0, 2.0, None,
+                             None])
+        d.close()
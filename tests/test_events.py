@@ -7,7 +7,8 @@ import os
 import time
 
 
-from pytsdb.events import RedisPubSub
+from pytsdb.events import RedisPubSub, RedisStreams, DataEvent
+from pytsdb.events import encode_batch, decode_batch
 
 
 class EventTest(unittest.TestCase):
@@ -65,3 +66,142 @@ class EventTest(unittest.TestCase):
         self.r.publish_event("device.xyz", ts_min=1, ts_max=2, count=2)
         time.sleep(0.1)
         self.assertIn("Mein Fehler", self.r._last_error)
+
+    def test_encodebatch(self):
+        events = [DataEvent("device.xyz", 1, 5, 3, appended=3),
+                  DataEvent(u"device.äbc", 2, 2, 1, updated=1, deleted=4)]
+        for binary in [False, True]:
+            data = encode_batch(events, binary=binary)
+            decoded = decode_batch(data)
+            self.assertEqual([e.to_dict() for e in decoded],
+                             [e.to_dict() for e in events])
+        self.assertLess(len(encode_batch(events, binary=True)),
+                        len(encode_batch(events)))
+        e = DataEvent("a", 10, 20, 2, inserted=2)
+        e.merge(DataEvent("a", 5, 15, 1, appended=1))
+        self.assertEqual((e.ts_min, e.ts_max, e.count, e.inserted,
+                          e.appended), (5, 20, 3, 2, 1))
+
+    def test_batching(self):
+        for binary in [False, True]:
+            messages = []
+            def test_function3(key, event):
+                messages.append((key, event))
+            r = RedisPubSub(redis=self.r._redis, batch_window=60,
+                            binary=binary)
+            r.register_callback("device.*", test_function3)
+            for i in range(10):
+                r.publish_event("device.xyz", ts_min=i, ts_max=i + 1,
+                                count=2, appended=2)
+            r.publish_event("device.abc", ts_min=2, ts_max=2, count=1,
+                            inserted=1)
+            r.publish_event("other.abc", ts_min=2, ts_max=2, count=1)
+            time.sleep(0.1)
+            self.assertEqual(len(messages), 0)
+            self.assertEqual(r.flush(), 3)
+            self.assertEqual(r.flush(), 0)
+            time.sleep(0.1)
+            self.assertEqual(sorted(k for k, _ in messages),
+                             ["device.abc", "device.xyz"])
+            ev = dict(messages)["device.xyz"]
+            self.assertEqual((ev.ts_min, ev.ts_max, ev.count, ev.appended),
+                             (0, 10, 20, 20))
+            self.assertEqual(r.metrics["events"], 12)
+            self.assertEqual(r.metrics["messages"], 1)
+            self.assertEqual(r.messages_saved(), 11)
+            self.assertEqual(r.metrics["received_messages"], 1)
+            self.assertEqual(r.metrics["received_events"], 3)
+
+            # Pending events are published on close
+            r.publish_event("device.xyz", ts_min=1, ts_max=1, count=1)
+            r.close()
+            self.assertEqual(r.metrics["messages"], 2)
+
+    def test_streams(self):
+        redis = self.r._redis
+        redis.delete("test:stream")
+        producer = RedisStreams(redis=redis, stream="test:stream",
+                                maxlen=1000)
+        worker1 = RedisStreams(redis=redis, stream="test:stream",
+                               group="rollup", consumer="w1", block=100)
+        worker1.create_group()
+        for i in range(5):
+            producer.publish_event("device.xyz", ts_min=i, ts_max=i,
+                                   count=1)
+        producer.publish_events([DataEvent("device.abc", 1, 2, 2)] * 3)
+
+        # Batch consumption, unacknowledged entries are read again
+        entries = worker1.read(count=4, block=100)
+        self.assertEqual([e.ts_min for _, e in entries], [0, 1, 2, 3])
+        worker1 = RedisStreams(redis=redis, stream="test:stream",
+                               group="rollup", consumer="w1", block=100)
+        self.assertEqual(len(worker1.read(pending=True)), 4)
+        self.assertEqual(worker1.ack([i for i, _ in entries]), 4)
+        self.assertEqual(worker1.read(pending=True), [])
+        batches = []
+        self.assertEqual(worker1.consume(batches.append), 4)
+        self.assertEqual([e.key for e in batches[0]],
+                         ["device.xyz"] + ["device.abc"] * 3)
+        self.assertEqual(worker1.read(pending=True), [])
+        self.assertEqual(worker1.consume(batches.append, block=10), 0)
+        self.assertEqual(worker1.metrics["acked"], 8)
+
+        # Callbacks run in a blocking consumer thread
+        messages = []
+        def test_function4(key, event):
+            messages.append((key, event))
+        listener = RedisStreams(redis=redis, stream="test:stream",
+                                group="listener", block=100)
+        listener.register_callback("device.x*", test_function4)
+        producer.publish_event("device.xyz", ts_min=7, ts_max=8, count=2)
+        producer.publish_event("device.abc", ts_min=7, ts_max=8, count=2)
+        for _ in range(50):
+            if listener.metrics["acked"] >= 2:
+                break
+            time.sleep(0.02)
+        listener.close()
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0][0], "device.xyz")
+        self.assertEqual(messages[0][1].ts_max, 8)
+        self.assertEqual(listener.metrics["acked"], 2)
+
+        # Entries of a failing callback stay pending
+        def test_function5(key, event):
+            if event.count == 3:
+                raise ValueError("failed")
+            messages.append((key, event))
+        listener = RedisStreams(redis=redis, stream="test:stream",
+                                group="retry", consumer="l1", block=100)
+        listener.create_group()
+        del messages[:]
+        for count in [1, 3, 5]:
+            producer.publish_event("device.xyz", ts_min=7, ts_max=8,
+                                   count=count)
+        listener.register_callback("device.*", test_function5)
+        for _ in range(50):
+            if listener.metrics["failed"] >= 1 and len(messages) >= 2:
+                break
+            time.sleep(0.02)
+        listener.close()
+        self.assertEqual([e.count for _, e in messages], [1, 5])
+        self.assertEqual(listener.metrics["acked"], 2)
+        self.assertEqual(len(listener.read(pending=True)), 1)
+        # Claimed by another consumer (the first one did not restart)
+        other = RedisStreams(redis=redis, stream="test:stream",
+                             group="retry", consumer="l2", block=100,
+                             claim_idle=0)
+        other.register_callback("device.*", lambda key, event: None)
+        for _ in range(50):
+            if other.metrics["acked"] >= 1:
+                break
+            time.sleep(0.02)
+        other.close()
+        self.assertEqual(other.metrics["claimed"], 1)
+        self.assertEqual(other.metrics["acked"], 1)
+        self.assertEqual(other.read(pending=True), [])
+        self.assertEqual(listener.read(pending=True), [])
+
+        # Capped length
+        producer.publish_events([DataEvent("device.abc", 1, 2, 2)] * 2000)
+        self.assertLess(redis.execute_command("XLEN", "test:stream"), 1200)
+        redis.delete("test:stream")
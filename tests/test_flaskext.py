@@ -7,6 +7,8 @@ import random
 import logging
 import datetime
 import time
+import json
+import zlib
 from flask import Flask
 
 from pytsdb import FlaskTSDB
@@ -74,4 +76,137 @@ class HelperTest(unittest.TestCase):
         self.assertEqual(len(list(q.all())), 2)
 
         # Tear Down
-        ctx.pop()
\ No newline at end of file
+        ctx.pop()
+
+class APITest(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask("testapi")
+        self.app.config.update(
+            STORAGE="memory",
+            ENABLE_EVENTS=False,
+            ENABLE_CACHING=False
+        )
+        self.ext = FlaskTSDB(self.app)
+        self.app.register_blueprint(self.ext.create_blueprint(),
+                                    url_prefix="/tsdb")
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        pass
+
+    def test_shared_db(self):
+        with self.app.app_context():
+            db1 = self.ext.db
+        with self.app.app_context():
+            db2 = self.ext.db
+        self.assertIs(db1, db2)
+
+    def test_ingest_query(self):
+        payload = [{"key": "sensor1.ph", "data": [[1000, 2.5], [1001, 3.5]]},
+                   {"key": "sensor1.temp", "data": [[1000, 20.5]]}]
+        r = self.client.post("/tsdb/ingest", data=json.dumps(payload),
+                             content_type="application/json")
+        self.assertEqual(r.status_code, 200)
+        res = json.loads(r.data.decode("utf-8"))
+        self.assertEqual(res["keys"], 2)
+        self.assertEqual(res["count"], 3)
+
+        lines = "sensor1.ph value=4.5 1002\n\nsensor1.temp value=21.5 1001\n"
+        r = self.client.post("/tsdb/ingest", data=lines,
+                             content_type="text/plain")
+        self.assertEqual(r.status_code, 200)
+        # Influx line protocol, tag values are part of the key
+        r = self.client.post("/tsdb/ingest?precision=ms",
+                             data="cpu,host=a value=1.0 10000\n"
+                                  "cpu,host=a value=2.0,idle=3i 20000",
+                             content_type="text/plain")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(json.loads(r.data.decode("utf-8"))["count"], 3)
+        self.assertEqual(len(self.ext.db.query("cpu.a", 0, 100)), 2)
+        self.assertEqual(self.ext.db.query("cpu.a.idle", 0, 100)[0],
+                         (20, 3.0))
+
+        r = self.client.get("/tsdb/query/sensor1.ph?ts_min=1000&ts_max=1002"
+                            "&chunk_size=2")
+        self.assertEqual(r.status_code, 200)
+        data = json.loads(r.data.decode("utf-8"))
+        self.assertEqual(data, [[1000, 2.5], [1001, 3.5], [1002, 4.5]])
+
+        r = self.client.get("/tsdb/query/sensor1.temp?format=csv")
+        self.assertEqual(r.data.decode("utf-8"),
+                         "ts,value\n1000,20.5\n1001,21.5\n")
+
+        r = self.client.get("/tsdb/query/sensor1.temp?format=xml")
+        self.assertEqual(r.status_code, 400)
+
+        r = self.client.get("/tsdb/stats/sensor1.ph")
+        self.assertEqual(json.loads(r.data.decode("utf-8"))["count"], 3)
+        r = self.client.get("/tsdb/stats?key=sensor1.ph&key=sensor1.temp")
+        s = json.loads(r.data.decode("utf-8"))
+        self.assertEqual([x["count"] for x in s], [3, 2])
+        r = self.client.get("/tsdb/stats/unknown")
+        self.assertEqual(r.status_code, 404)
+
+    def test_gzip(self):
+        gz = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = gz.compress(b"gz.test value=1.5 10\ngz.test value=2.5 20\n")
+        body += gz.flush()
+        r = self.client.post("/tsdb/ingest", data=body,
+                             content_type="text/plain",
+                             headers={"Content-Encoding": "gzip"})
+        self.assertEqual(r.status_code, 200)
+
+        r = self.client.get("/tsdb/query/gz.test?format=ndjson",
+                            headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(r.headers["Content-Encoding"], "gzip")
+        lines = zlib.decompress(r.data, 16 + zlib.MAX_WBITS).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[1].decode("utf-8")),
+                         {"ts": 20, "value": 2.5})
+
+    def test_invalid_ingest(self):
+        for lines in ["a b c d", "a value=1 1\na 1 1", "a value=x 1"]:
+            r = self.client.post("/tsdb/ingest", data=lines,
+                                 content_type="text/plain")
+            self.assertEqual(r.status_code, 400)
+        r = self.client.post("/tsdb/ingest?precision=h", data="a value=1 1",
+                             content_type="text/plain")
+        self.assertEqual(r.status_code, 400)
+        r = self.client.post("/tsdb/ingest", data=json.dumps({"key": "a"}),
+                             content_type="application/json")
+        self.assertEqual(r.status_code, 400)
+        for payload in [{"key": "a", "data": 5}, [1], 5,
+                        {"key": "a", "data": [5]},
+                        {"key": "a", "data": [[1, 2, 3]]},
+                        {"key": "a.b", "data": [[1, "x"]]},
+                        {"key": "a.b", "data": [[1, None]]},
+                        {"key": 5, "data": [[1, 1.0]]}]:
+            r = self.client.post("/tsdb/ingest", data=json.dumps(payload),
+                                 content_type="application/json")
+            self.assertEqual(r.status_code, 400)
+        r = self.client.post("/tsdb/ingest", data=b"not gzip",
+                             content_type="text/plain",
+                             headers={"Content-Encoding": "gzip"})
+        self.assertEqual(r.status_code, 400)
+        r = self.client.post("/tsdb/ingest", data=b"\xff\xfe a 1 1",
+                             content_type="text/plain")
+        self.assertEqual(r.status_code, 400)
+
+    def test_metrics(self):
+        r = self.client.get("/tsdb/metrics")
+        self.assertEqual(r.status_code, 404)
+
+        app = Flask("testmetrics")
+        app.config.update(STORAGE="memory", ENABLE_EVENTS=False,
+                          ENABLE_CACHING=False, METRICS=["memory"])
+        ext = FlaskTSDB(app)
+        app.register_blueprint(ext.create_blueprint(), url_prefix="/tsdb")
+        client = app.test_client()
+        client.post("/tsdb/ingest", data="sensor1.ph value=4.5 1002\n",
+                    content_type="text/plain")
+        r = client.get("/tsdb/metrics")
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.content_type.startswith("text/plain"))
+        text = r.data.decode("utf-8")
+        self.assertIn("pytsdb_points_inserted_total 1\n", text)
+        self.assertIn("pytsdb_storage_write_seconds_count 1\n", text)
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# coding: utf8
+
+import unittest
+import logging
+import socket
+import threading
+import time
+import os
+
+
+from pytsdb import TSDB
+from pytsdb.models import Item, ItemType
+from pytsdb.ingest import ParallelIngestor, shard
+from pytsdb.ingest import LineProtocolParser, BinaryParser, encode_frame
+from pytsdb.ingest import ingest_stream, serve
+
+
+class IngestTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        if os.path.exists("test_ingest.db3"):
+            os.remove("test_ingest.db3")
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_shard(self):
+        self.assertEqual(shard("sensor1.temp", 4), shard("Sensor1.TEMP", 4))
+        shards = set(shard("sensor{}.temp".format(i), 4) for i in range(100))
+        self.assertEqual(shards, set(range(4)))
+
+    def test_parallelingest(self):
+        settings = dict(STORAGE="sqlite", SQLITE_FILE="test_ingest.db3",
+                        ENABLE_CACHING=False, ENABLE_EVENTS=False)
+        db = TSDB(**settings)
+        db.storage._dropTable()
+        db.storage._createTable()
+
+        ingestor = ParallelIngestor(workers=2, batch_size=10, queue_size=2,
+                                    **settings)
+        for i in range(0, 200, 10):
+            for s in range(5):
+                ingestor.insert("sensor{}.temp".format(s),
+                                [(i + x, float(i + x)) for x in range(10)])
+        ingestor.insert("invalid key", [(1, 1.0)])
+        stats = ingestor.flush()
+        self.assertEqual(len(stats), 2)
+        self.assertEqual(sum(s["inserts"] for s in stats), 100)
+        self.assertEqual(sum(s["points"] for s in stats), 1000)
+        self.assertEqual(sum(s["errors"] for s in stats), 1)
+        for s in range(5):
+            res = db.query("sensor{}.temp".format(s), 0, 1000)
+            self.assertEqual(len(res), 200)
+
+        # Out of order inserts of a key stay in order
+        ingestor.insert("sensor0.temp", [(5, 1.0)])
+        ingestor.insert("sensor0.temp", [(500, 2.0)])
+        stats = ingestor.close()
+        self.assertEqual(sum(s["inserts"] for s in stats), 102)
+        self.assertTrue(ingestor.closed)
+        with self.assertRaises(RuntimeError):
+            ingestor.insert("a", [(1, 1.0)])
+        self.assertEqual(db.query("sensor0.temp", 0, 1000)[-1], (500, 2.0))
+        db.close()
+
+    def test_parallelingest_failure(self):
+        # The TSDB of the workers can not be created
+        ingestor = ParallelIngestor(workers=2, STORAGE="unknown")
+        ingestor.POLL_INTERVAL = 0.05
+        ingestor.insert("a", [(1, 1.0)])
+        with self.assertRaises(RuntimeError):
+            ingestor.flush()
+        with self.assertRaises(RuntimeError):
+            ingestor.close()
+
+        # A worker dies
+        ingestor = ParallelIngestor(workers=1, batch_size=1, queue_size=1,
+                                    STORAGE="memory", ENABLE_CACHING=False,
+                                    ENABLE_EVENTS=False)
+        ingestor.POLL_INTERVAL = 0.05
+        ingestor._processes[0].terminate()
+        ingestor._processes[0].join()
+        with self.assertRaises(RuntimeError):
+            for i in range(10):
+                ingestor.insert("a", [(i, 1.0)])
+        with self.assertRaises(RuntimeError):
+            ingestor.close()
+
+    def test_lineprotocol(self):
+        p = LineProtocolParser(precision="ms")
+        data = (b"cpu,host=a,dc=x load=0.5,idle=2i 60000\n"
+                b"temp value=21.5 61000\n"
+                b"# comment\n\n"
+                b"broken line\n"
+                b"temp value=abc 62000\n"
+                b"temp value=22.5 62000\ntemp val")
+        # Any chunking of the stream
+        for i in range(0, len(data), 7):
+            p.feed(data[i:i + 7])
+        self.assertEqual(p.points, 4)
+        self.assertEqual(p.metrics["errors"], 2)
+        inserts = dict((i["key"], i) for i in p.flush())
+        self.assertEqual(sorted(inserts), ["cpu.a.x.idle", "cpu.a.x.load",
+                                           "temp"])
+        self.assertEqual(list(inserts["temp"]["timestamps"]), [61, 62])
+        self.assertEqual(list(inserts["temp"]["values"]), [21.5, 22.5])
+        self.assertEqual(list(inserts["cpu.a.x.idle"]["values"]), [2.0])
+        self.assertEqual(p.points, 0)
+        p.feed(b"ue=1\nnow value=1\n")
+        self.assertEqual(sorted(i["key"] for i in p.flush()), ["now", "temp"])
+        p.close()
+        # The last line needs no newline
+        p.feed(b"cpu,host=a load=0.5 60000\ncpu,host=a load=0.7 120000")
+        self.assertEqual(p.points, 1)
+        p.close()
+        self.assertEqual(p.points, 2)
+        inserts = p.flush()
+        self.assertEqual(list(inserts[0]["timestamps"]), [60, 120])
+        p.feed(b"broken")
+        p.close()
+        self.assertEqual(p.metrics["errors"], 3)
+        with self.assertRaises(ValueError):
+            LineProtocolParser(precision="h")
+
+    def test_binaryframes(self):
+        data = (encode_frame("a", [1, 2], [1.0, 2.0]) +
+                encode_frame("t", [5], [[1.0], [2.0]]) +
+                encode_frame("a", [3], [3.0]))
+        p = BinaryParser()
+        for i in range(0, len(data), 5):
+            p.feed(data[i:i + 5])
+        p.close()
+        self.assertEqual(p.metrics["points"], 4)
+        self.assertEqual(p.metrics["bytes"], len(data))
+        db = TSDB(STORAGE="memory", ENABLE_CACHING=False, ENABLE_EVENTS=False)
+        # An existing tuple series
+        db.storage.insert(Item("t", [(0, (0.0, 0.0))],
+                               item_type=ItemType.tuple_float_2))
+        db.insert_bulk(p.flush())
+        self.assertEqual(db.query("a", 0, 10).to_list(),
+                         [(1, 1.0), (2, 2.0), (3, 3.0)])
+        self.assertEqual(db.query("t", 0, 10).to_list(),
+                         [(0, (0.0, 0.0)), (5, (1.0, 2.0))])
+        with self.assertRaises(ValueError):
+            BinaryParser().feed(b"\x00" * 7)
+        with self.assertRaises(ValueError):
+            encode_frame("a", [1, 2], [1.0])
+        db.close()
+
+    def test_ingeststream(self):
+        import io
+        db = TSDB(STORAGE="memory", ENABLE_CACHING=False, ENABLE_EVENTS=False)
+        lines = b"".join("s{} value={} {}\n".format(i % 3, i, i).encode()
+                         for i in range(100))
+        f = io.BytesIO(lines + b"bad! value=1 5\n")
+        stats = ingest_stream(db, lambda: f.read(64), LineProtocolParser(),
+                              batch_points=10)
+        self.assertEqual(stats["points"], 101)
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["errors"], 0)
+        self.assertEqual(len(db.query("s1", 0, 100)), 33)
+        f = io.BytesIO(b"last value=1 10\nlast value=2 20")
+        stats = ingest_stream(db, lambda: f.read(4), LineProtocolParser())
+        self.assertEqual(stats["points"], 2)
+        self.assertEqual(len(db.query("last", 0, 100)), 2)
+
+        # TCP
+        port = 18094
+        t = threading.Thread(target=serve, args=(db, "127.0.0.1", port,
+                                                 "binary"))
+        t.daemon = True
+        t.start()
+        for _ in range(50):
+            try:
+                conn = socket.create_connection(("127.0.0.1", port))
+            except socket.error:
+                time.sleep(0.1)
+            else:
+                break
+        conn.sendall(encode_frame("tcp", list(range(100)), [1.0] * 100))
+        conn.close()
+        for _ in range(50):
+            if len(db.query("tcp", 0, 100)) == 100:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(db.query("tcp", 0, 100)), 100)
+        db.close()
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+# coding: utf8
+
+import unittest
+import logging
+import os
+import shutil
+
+
+from pytsdb.models import Item, BucketType
+from pytsdb.lsm import LSMStorage, BloomFilter
+from pytsdb.errors import NotFoundError
+
+
+class LSMTest(unittest.TestCase):
+    def setUp(self):
+        Item.DEFAULT_BUCKETTYPE = BucketType.dynamic
+
+    def tearDown(self):
+        if os.path.isdir("test_lsm"):
+            shutil.rmtree("test_lsm")
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_bloomfilter(self):
+        keys = [("sensor{}.ph".format(i)).encode("utf-8") for i in range(100)]
+        b = BloomFilter.create(keys)
+        for k in keys:
+            self.assertIn(k, b)
+        misses = sum(1 for i in range(1000)
+                     if "other{}".format(i).encode("utf-8") in b)
+        self.assertLess(misses, 50)
+
+    def test_lsmstore(self):
+        storage = LSMStorage("test_lsm", background=False)
+        storage._dropTable()
+        self.assertTrue(storage)
+        self.assertTrue(storage.ping())
+
+        with self.assertRaises(NotFoundError):
+            storage.get(key="test.ph", range_key=1000)
+        
+        with self.assertRaises(NotFoundError):
+            storage.last(key="test.ph")
+
+        i = Item.new("test.ph", [(1000, 1.0)])
+        storage.insert(i)
+        i = Item.new("test.ph", [(2000, 4.0)])
+        storage.insert(i)
+        storage.flush()
+        i = Item.new("test.ph", [(1100, 2.0)])
+        storage.insert(i)
+        i = Item.new("test.ph", [(1200, 3.0)])
+        storage.insert(i)
+
+        d = storage.get(key="test.ph", range_key=1000)
+        self.assertEqual(d[0], (1000, 1.0))
+        d = storage.get(key="test.ph", range_key=1100)
+        self.assertEqual(d[0], (1100, 2.0))
+        d = storage.get(key="test.ph", range_key=1200)
+        self.assertEqual(d[0], (1200, 3.0))
+        d = storage.get(key="test.ph", range_key=2000)
+        self.assertEqual(d[0], (2000, 4.0))
+
+        ds = storage.query(key="test.ph", range_min=1000, range_max=1000)
+        self.assertEqual(len(ds), 1)
+        self.assertEqual(ds[0][0], (1000, 1.0))
+
+        ds = storage.query(key="test.ph", range_min=-1000, range_max=1000)
+        self.assertEqual(len(ds), 1)
+        self.assertEqual(ds[0][0], (1000, 1.0))
+
+        ds = storage.query(key="test.ph", range_min=-999, range_max=999)
+        self.assertEqual(len(ds), 0)
+
+        ds = storage.query(key="test.ph", range_min=1000, range_max=1200)
+        self.assertEqual(len(ds), 3)
+        self.assertEqual(ds[0][0], (1000, 1.0))
+        self.assertEqual(ds[1][0], (1100, 2.0))
+        self.assertEqual(ds[2][0], (1200, 3.0))
+
+        ds = storage.query(key="test.ph", range_min=99, range_max=1350)
+        self.assertEqual(len(ds), 3)
+        self.assertEqual(ds[0][0], (1000, 1.0))
+        self.assertEqual(ds[1][0], (1100, 2.0))
+        self.assertEqual(ds[2][0], (1200, 3.0))
+
+        ds = storage.query(key="test.ph", range_min=1101, range_max=1200)
+        self.assertEqual(len(ds), 2)
+        self.assertEqual(ds[0][0], (1100, 2.0))
+        self.assertEqual(ds[1][0], (1200, 3.0))
+
+        ds = storage.query(key="test.ph", range_min=99, range_max=999999)
+        self.assertEqual(len(ds), 4)
+        self.assertEqual(ds[0][0], (1000, 1.0))
+        self.assertEqual(ds[1][0], (1100, 2.0))
+        self.assertEqual(ds[2][0], (1200, 3.0))
+        self.assertEqual(ds[3][0], (2000, 4.0))
+
+        d = storage.last(key="test.ph")
+        self.assertEqual(d[0], (2000, 4.0))
+
+        d = storage.first(key="test.ph")
+        self.assertEqual(d[0], (1000, 1.0))
+
+        d = storage.left(key="test.ph", range_key=1050)
+        self.assertEqual(d[0], (1000, 1.0))
+
+        s = storage.stats(key="test.ph")
+        self.assertEqual(s["ts_min"], 1000)
+        self.assertEqual(s["ts_max"], 2000)
+        self.assertEqual(s["count"], 4)
+
+    def test_recovery(self):
+        storage = LSMStorage("test_lsm", background=False)
+        storage.insert(Item.new("a", [(1, 1.0)]))
+        storage.flush()
+        storage.insert(Item.new("a", [(2, 2.0)]))
+        storage.update(Item.new("a", [(1, 3.0)]))
+        # Reopen without close, the log is replayed
+        storage = LSMStorage("test_lsm", background=False)
+        self.assertEqual(storage.get("a", 1)[0], (1, 3.0))
+        self.assertEqual(storage.last("a")[0], (2, 2.0))
+        self.assertFalse(storage.query("b", 0, 10))
+        with self.assertRaises(NotFoundError):
+            storage.first("b")
+
+    def test_compaction(self):
+        storage = LSMStorage("test_lsm", memtable_size=2000)
+        for v in range(3):
+            for r in range(0, 2000, 10):
+                i = Item.new("c{}".format(r % 3),
+                             [(r + x, float(v)) for x in range(5)])
+                storage.update(i)
+        storage.wait()
+        self.assertLess(len(storage._segments), 2 * LSMStorage.COMPACTION_TIER_SIZE)
+        counts = []
+        for k in range(3):
+            res = storage.query("c{}".format(k), 0, 2000)
+            counts.append(len(res))
+            for i in res:
+                self.assertEqual(len(i), 5)
+                self.assertEqual(i[0][1], 2.0)
+        self.assertEqual(counts, [67, 67, 66])
+        storage.compact()
+        self.assertEqual(len(storage._segments), 1)
+        self.assertEqual(len(storage.query("c1", 0, 2000)), 67)
+        storage.close()
+        storage = LSMStorage("test_lsm")
+        self.assertEqual(storage.last("c2")[0][1], 2.0)
+        storage.close()
+
+    def test_tombstones(self):
+        storage = LSMStorage("test_lsm", background=False)
+        for rk in [1, 2, 3, 4]:
+            storage.insert(Item.new("t", [(rk, float(rk))]))
+        storage.flush()
+        storage.delete("t", 4)
+        storage.delete("t", 1)
+        with self.assertRaises(NotFoundError):
+            storage.get("t", 4)
+        with self.assertRaises(NotFoundError):
+            storage.delete("t", 4)
+        self.assertEqual(storage.last("t")[0], (3, 3.0))
+        self.assertEqual(storage.first("t")[0], (2, 2.0))
+        self.assertEqual(storage.left("t", 1000)[0], (3, 3.0))
+        self.assertEqual([i[0][0] for i in storage.query("t", 0, 10)],
+                         [2, 3])
+        # Tombstones are kept in the log and in segments
+        storage = LSMStorage("test_lsm", background=False)
+        self.assertEqual(storage.last("t")[0], (3, 3.0))
+        self.assertEqual(len(storage._segments), 2)
+        # ... and dropped by a full merge
+        storage.compact()
+        self.assertEqual(len(storage._segments), 1)
+        self.assertEqual(len(list(storage._segments[0].records())), 2)
+        self.assertEqual(storage.first("t")[0], (2, 2.0))
+        for rk in [5, 6, 7]:
+            storage.insert(Item.new("t", [(rk, float(rk))]))
+        storage.delete_range("t", 3, 6)
+        self.assertEqual([i[0][0] for i in storage.query("t", 0, 10)],
+                         [2, 7])
+        storage.close()
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# coding: utf8
+
+import unittest
+import logging
+import socket
+import os
+
+
+from pytsdb import TSDB
+from pytsdb.cache import RedisLRU
+from pytsdb.models import Item
+from pytsdb.storage import MemoryStorage
+from pytsdb.sharding import ShardedStorage
+from pytsdb.metrics import MemorySink, StatsdSink, Metrics, create_metrics
+from pytsdb.testing import FakeRedis
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        if os.path.exists("test_metrics.db3"):
+            os.remove("test_metrics.db3")
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_memorysink(self):
+        sink = MemorySink()
+        sink.incr("cache_hits")
+        sink.incr("cache_hits", 2)
+        sink.timing("merge", 0.5)
+        sink.timing("merge", 0.25)
+        snapshot = sink.snapshot()
+        self.assertEqual(snapshot["counters"], {"cache_hits": 3})
+        self.assertEqual(snapshot["timers"]["merge"],
+                         {"count": 2, "sum": 0.75, "max": 0.5})
+        text = sink.prometheus("tsdb")
+        self.assertIn("# TYPE tsdb_cache_hits_total counter\n", text)
+        self.assertIn("tsdb_cache_hits_total 3\n", text)
+        self.assertIn("tsdb_merge_seconds_count 2\n", text)
+        self.assertIn("tsdb_merge_seconds_sum 0.75\n", text)
+        self.assertIn("tsdb_merge_seconds_max 0.5\n", text)
+        sink.reset()
+        self.assertEqual(sink.prometheus(), "\n")
+
+    def test_statsdsink(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+        sink = StatsdSink("127.0.0.1", server.getsockname()[1], "tsdb")
+        sink.incr("cache_misses")
+        sink.timing("storage_write", 0.002)
+        self.assertEqual(server.recv(100), b"tsdb.cache_misses:1|c")
+        self.assertEqual(server.recv(100), b"tsdb.storage_write:2.000|ms")
+        sink.close()
+        server.close()
+
+    def test_create(self):
+        self.assertIsNone(create_metrics({"METRICS": None}))
+        sink = MemorySink()
+        m = create_metrics({"METRICS": ["memory", sink]})
+        self.assertIsNot(m.memory(), sink)
+        m.incr("x")
+        self.assertEqual(sink.counters, {"x": 1})
+        self.assertIsNone(Metrics([]).memory())
+        with self.assertRaises(ValueError):
+            create_metrics({"METRICS": ["graphite"]})
+
+    def test_disabled(self):
+        d = TSDB(STORAGE="memory", ENABLE_CACHING=False, ENABLE_EVENTS=False)
+        self.assertIsNone(d.metrics)
+        d.insert("metrics.off", [(10, 1.0)])
+        d.close()
+
+    def test_db(self):
+        sink = MemorySink()
+        d = TSDB(STORAGE="memory", ENABLE_CACHING=False, ENABLE_EVENTS=False,
+                 BUCKET_TYPE="dynamic", BUCKET_DYNAMIC_TARGET=3,
+                 BUCKET_DYNAMIC_MAX=3, METRICS=[sink])
+        d.insert("metrics.test", [(10, 1.0), (20, 2.0), (30, 3.0)])
+        d.insert("metrics.test", [(40, 4.0), (50, 5.0)])
+        d.insert("metrics.test", [(15, 1.5)])
+        d.query("metrics.test", 0, 100)
+        s = sink.snapshot()
+        self.assertEqual(s["counters"]["points_inserted"], 6)
+        # Every insert rewrites its whole bucket
+        self.assertGreater(s["counters"]["points_written"], 6)
+        self.assertGreater(s["counters"]["bytes_written"], 0)
+        self.assertEqual(s["counters"]["buckets_written"],
+                         s["timers"]["storage_write"]["count"])
+        self.assertEqual(s["timers"]["serialize"]["count"],
+                         s["timers"]["storage_write"]["count"])
+        self.assertEqual(s["timers"]["merge"]["count"], 3)
+        self.assertEqual(s["timers"]["split"]["count"], 3)
+        # Last item of each insert, items of the merge and the query
+        self.assertEqual(s["timers"]["storage_read"]["count"], 5)
+        self.assertNotIn("cache_lookup", s["timers"])
+        d.close()
+
+    def test_cache(self):
+        d = TSDB(STORAGE="memory", ENABLE_CACHING=False, ENABLE_EVENTS=False,
+                 METRICS=["memory"])
+        d.cache = RedisLRU(redis=FakeRedis())
+        for namespace in ["last_item", "data_stats", "latest"]:
+            d.cache.setup_namespace(namespace, 1000)
+        d.settings["ENABLE_CACHING"] = True
+        d.insert("metrics.cache", [(10, 1.0)])
+        d.insert("metrics.cache", [(20, 2.0)])
+        d.stats("metrics.cache")
+        d.stats("metrics.cache")
+        s = d.metrics.memory().snapshot()
+        self.assertEqual(s["counters"]["cache_misses"], 2)
+        self.assertEqual(s["counters"]["cache_hits"], 2)
+        self.assertEqual(s["timers"]["cache_lookup"]["count"], 4)
+        d.close()
+
+    def test_sharded(self):
+        storage = ShardedStorage({"a": MemoryStorage(), "b": MemoryStorage()})
+        sink = MemorySink()
+        storage.insert(Item.new("shard.a", [(10, 1.0)]), Metrics([sink]))
+        storage.update(Item.new("shard.a", [(10, 2.0)]))
+        self.assertEqual(sink.timers["storage_write"]["count"], 1)
+        self.assertEqual(storage.get("shard.a", 10)[0], (10, 2.0))
+        storage.close()
+
+    def test_shared_storage(self):
+        # Instances on the same file share the storage, not the metrics
+        settings = {"STORAGE": "sqlite", "SQLITE_FILE": "test_metrics.db3",
+                    "ENABLE_CACHING": False, "ENABLE_EVENTS": False}
+        a = TSDB(METRICS=["memory"], **settings)
+        b = TSDB(**settings)
+        c = TSDB(METRICS=["memory"], **settings)
+        self.assertIs(a.storage, c.storage)
+        a.storage._createTable()
+        a.insert("shared.a", [(10, 1.0)])
+        b.insert("shared.b", [(10, 1.0)])
+        c.insert("shared.c", [(10, 1.0)])
+        c.insert("shared.c", [(20, 1.0)])
+        c.close()
+        a.insert("shared.a", [(20, 1.0)])
+        self.assertEqual(
+            a.metrics.memory().timers["storage_write"]["count"], 2)
+        self.assertEqual(
+            c.metrics.memory().timers["storage_write"]["count"], 2)
+        a.close()
+        b.close()
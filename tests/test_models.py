@@ -6,9 +6,21 @@ import random
 import logging
 import binascii
 import datetime
+import json
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 from pytsdb.models import Item, ItemType, Aggregation, TupleArray, Stats
-from pytsdb.models import ResultSet
+from pytsdb.models import ResultSet, BucketPolicy, as_of_join
+from pytsdb.models import Resampler, RESAMPLE_FILLS
 from pytsdb.helper import to_ts
 
 
@@ -139,6 +151,34 @@ class ModelTest(unittest.TestCase):
         self.assertEqual(i2.to_hash(), i4.to_hash())
         self.assertIn("test1", i2.pretty_print())
 
+    def test_slots(self):
+        i = Item("slots", [(1, 1.0)])
+        with self.assertRaises(AttributeError):
+            i.foo = 1
+        r = ResultSet("slots", [i])
+        with self.assertRaises(AttributeError):
+            r.foo = 1
+        t = TupleArray("f", 2)
+        with self.assertRaises(AttributeError):
+            t.foo = 1
+
+    def test_tuplearray_sequence(self):
+        t = TupleArray("f", 2)
+        t.extend([(1.0, 2.0), (3.0, 4.0), (5.0, 6.0)])
+        self.assertIn((3.0, 4.0), t)
+        self.assertNotIn((3.0, 5.0), t)
+        self.assertEqual(t.index((5.0, 6.0)), 2)
+        self.assertEqual(t.count((1.0, 2.0)), 1)
+        self.assertEqual(list(reversed(t))[0], (5.0, 6.0))
+        self.assertEqual(t.pop(), (5.0, 6.0))
+        t.remove((1.0, 2.0))
+        self.assertEqual(list(t), [(3.0, 4.0)])
+        with self.assertRaises(ValueError):
+            t.index((1.0, 2.0))
+        t.append((7.0, 8.0))
+        t.reverse()
+        self.assertEqual(list(t), [(7.0, 8.0), (3.0, 4.0)])
+
     def test_tuplearray(self):
         t = TupleArray("f", 2)
         self.assertEqual(len(t), 0)
@@ -162,6 +202,55 @@ class ModelTest(unittest.TestCase):
             t.append(3)
         self.assertTrue(str(t))
 
+    def test_tuplearray_columns(self):
+        t = TupleArray("f", 3)
+        t.extend_columns([[1.0, 4.0], [2.0, 5.0], [3.0, 6.0]])
+        t.insert_columns(1, [[7.0], [8.0], [9.0]])
+        self.assertEqual(list(t), [(1.0, 2.0, 3.0), (7.0, 8.0, 9.0),
+                                   (4.0, 5.0, 6.0)])
+        self.assertEqual(t.column(1).tolist(), [2.0, 8.0, 5.0])
+        t.column(1)[0] = 0.0
+        self.assertEqual(t[0], (1.0, 0.0, 3.0))
+        s = t[1:]
+        self.assertEqual(list(s), [(7.0, 8.0, 9.0), (4.0, 5.0, 6.0)])
+        s += t[:1]
+        self.assertEqual(len(s), 3)
+        self.assertEqual(s[2], (1.0, 0.0, 3.0))
+        t[0:2] = s[0:2]
+        self.assertEqual(t[0], (7.0, 8.0, 9.0))
+        with self.assertRaises(ValueError):
+            t.extend_columns([[1.0], [2.0]])
+        with self.assertRaises(ValueError):
+            t.insert_columns(0, [[1.0], [2.0], []])
+
+    def test_insertcolumns(self):
+        i = Item("c", item_type=ItemType.tuple_float_2)
+        self.assertEqual(i.extend_columns([10, 20], [[1.0, 2.0],
+                                                     [3.0, 4.0]]), 2)
+        with self.assertRaises(ValueError):
+            i.extend_columns([15], [[0.0], [0.0]])
+        self.assertEqual(i.insert_columns([5, 10, 12, 14, 30],
+                                          [[0.5, 9.0, 1.2, 1.4, 3.0],
+                                           [0.5, 9.0, 1.2, 1.4, 3.0]]), 4)
+        self.assertEqual(list(i.column(0)), [5, 10, 12, 14, 20, 30])
+        self.assertEqual(i[1], (10, (1.0, 3.0)))
+        self.assertEqual(i.insert_columns([10], [[9.0], [9.0]],
+                                          overwrite=True), 1)
+        self.assertEqual(i[1], (10, (9.0, 9.0)))
+        self.assertTrue(i.dirty)
+        # Unsorted points are inserted one by one
+        self.assertEqual(i.insert_columns([40, 1, 40], [[1.0, 2.0, 3.0],
+                                                        [1.0, 2.0, 3.0]]), 2)
+        self.assertEqual(i.to_list()[0], (1, (2.0, 2.0)))
+        self.assertEqual(i.to_list()[-1], (40, (1.0, 1.0)))
+        self.assertTrue(i)
+        with self.assertRaises(ValueError):
+            i.insert_columns([50], [[1.0]])
+
+        r = Item("r", [(3, 3.0), (1, 1.0), (2, 2.0), (2, 5.0)])
+        self.assertEqual(r.to_list(), [(1, 1.0), (2, 2.0), (3, 3.0)])
+        self.assertEqual(r.column_names(), ["ts", "value"])
+
     def test_split(self):
         d = []
         for i in range(100):
@@ -177,6 +266,37 @@ class ModelTest(unittest.TestCase):
         self.assertEqual(len(buckets[3]), 10)
         self.assertEqual(len(i), 30)
 
+    def test_bucketpolicy(self):
+        p = BucketPolicy(target=100, max_size=200)
+        self.assertEqual(p.sizes("a", ItemType.raw_float), (100, 200))
+        self.assertEqual(p.sizes("a", ItemType.tuple_float_4), (100, 200))
+        p = BucketPolicy(target=100, max_size=200, target_bytes=808,
+                         series={"Big.*": 8008, "big.small": 88})
+        self.assertEqual(p.sizes("a", ItemType.raw_float), (100, 200))
+        self.assertEqual(p.sizes("a", ItemType.tuple_float_4), (40, 80))
+        self.assertEqual(p.sizes("big.a", ItemType.raw_float), (1000, 2000))
+        self.assertEqual(p.sizes("big.small", ItemType.raw_float), (10, 20))
+
+        i = Item("a", [(t, 1.0) for t in range(150)])
+        self.assertFalse(i.split_needed(limit="hard", policy=p))
+        self.assertTrue(i.split_needed(limit="soft", policy=p))
+        self.assertEqual([len(b) for b in i.split_item(policy=p)], [100, 50])
+
+    def test_adaptivebucketpolicy(self):
+        p = BucketPolicy(target=100, max_size=200, adaptive=True)
+        self.assertEqual(p.sizes("a", ItemType.raw_float), (100, 200))
+        for x in range(20):
+            p.observe("slow", 1)
+            p.observe("fast", 50)
+        self.assertEqual(p.sizes("slow", ItemType.raw_float), (25, 50))
+        self.assertEqual(p.sizes("fast", ItemType.raw_float), (100, 200))
+        p.observe("medium", 5)
+        self.assertEqual(p.sizes("medium", ItemType.raw_float), (50, 100))
+        # Not adaptive
+        p = BucketPolicy(target=100, max_size=200)
+        p.observe("slow", 1)
+        self.assertEqual(p.sizes("slow", ItemType.raw_float), (100, 200))
+
     def test_intdata(self):
         i = Item("int", item_type=ItemType.raw_int)
         for j in range(10):
@@ -258,3 +378,151 @@ class ModelTest(unittest.TestCase):
         s = i.to_string()
         self.assertEqual(binascii.hexlify(s),
                          b'0100010001000000ffff00000000c040')
+
+    def test_resultset_overlap(self):
+        # Buckets overlap while a compaction rewrites them
+        a = Item.new("o", [(1, 1.0), (2, 2.0), (3, 3.0), (4, 4.0)])
+        b = Item.new("o", [(3, 3.0), (4, 4.0)])
+        c = Item.new("o", [(4, 4.0), (5, 5.0)])
+        e = Item.new("o", [])
+        r = ResultSet("o", [e, a, b, e, c])
+        self.assertEqual(list(r.all()),
+                         [(1, 1.0), (2, 2.0), (3, 3.0), (4, 4.0), (5, 5.0)])
+
+    def test_resultsetexport(self):
+        i = Item("ex", [(1, 1.5), (2, 2.5), (3, 3.25)])
+        r = ResultSet("ex", [i])
+        self.assertEqual(r.column_names(), ["ts", "value"])
+        ts, v = r.to_buffers()
+        self.assertEqual(binascii.hexlify(ts),
+                         b'010000000200000003000000')
+        self.assertEqual(len(v), 3 * 4)
+
+        csv = list(r.iter_csv(chunk_size=2))
+        self.assertEqual(len(csv), 3)
+        self.assertEqual("".join(csv), "ts,value\n1,1.5\n2,2.5\n3,3.25\n")
+
+        lines = "".join(r.iter_ndjson(chunk_size=2)).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[2]), {"ts": 3, "value": 3.25})
+
+        rows = json.loads("".join(r.iter_json(chunk_size=2)))
+        self.assertEqual(rows, [[1, 1.5], [2, 2.5], [3, 3.25]])
+        empty = ResultSet("ex", [])
+        self.assertEqual(json.loads("".join(empty.iter_json())), [])
+
+        with self.assertRaises(ValueError):
+            list(r.iter_csv(chunk_size=0))
+
+        # No JSON numbers, written as null
+        i = Item("ex", [(10, float("nan")), (20, 1.0), (30, float("inf"))])
+        r = ResultSet("ex", [i])
+        self.assertEqual(json.loads("".join(r.iter_json(chunk_size=2))),
+                         [[10, None], [20, 1.0], [30, None]])
+        lines = "".join(r.iter_ndjson()).splitlines()
+        self.assertEqual(json.loads(lines[2]), {"ts": 30, "value": None})
+
+    def test_resultsetexport_tuple(self):
+        i = Item("ex", item_type=ItemType.basic_aggregation)
+        for j in range(5):
+            i.insert_point(j, Aggregation(min=j, max=j * 2,
+                                          count=2, sum=j * 3))
+        r = ResultSet("ex", [i])
+        r._trim(1, 3)
+        self.assertEqual(r.item_type, ItemType.basic_aggregation)
+        self.assertEqual(len(r), 3)
+        self.assertEqual(r.column_names(),
+                         ["ts", "min", "max", "sum", "count"])
+        self.assertEqual(len(r.to_buffers()), 5)
+        lines = "".join(r.iter_ndjson()).splitlines()
+        self.assertEqual(json.loads(lines[0])["max"], 2.0)
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_resultsetexport_numpy(self):
+        i = Item("ex", [(1, 1.5), (2, 2.5), (3, 3.25)])
+        r = ResultSet("ex", [i])
+        a = r.to_numpy()
+        self.assertEqual(a.dtype.names, ("ts", "value"))
+        self.assertEqual(list(a["ts"]), [1, 2, 3])
+        self.assertEqual(list(a["value"]), [1.5, 2.5, 3.25])
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_asofjoin(self):
+        a = ResultSet("a", [Item("a", [(1, 1.0), (3, 3.0)])])
+        t = Item("t", item_type=ItemType.tuple_float_2)
+        t.insert_point(2, (2.0, 4.0))
+        r = as_of_join([a, ResultSet("t", [t])])
+        self.assertEqual(r.dtype.names, ("ts", "a", "t.value_0", "t.value_1"))
+        self.assertEqual(list(r["ts"]), [1, 2, 3])
+        self.assertEqual(list(r["a"]), [1.0, 1.0, 3.0])
+        self.assertTrue(numpy.isnan(r["t.value_1"][0]))
+        self.assertEqual(list(r["t.value_1"][1:]), [4.0, 4.0])
+        self.assertEqual(len(as_of_join([])), 0)
+        self.assertEqual(a.at(2), (1, 1.0))
+        self.assertIsNone(a.at(0))
+
+    def test_resample(self):
+        r = ResultSet("a", [Item("a", [(0, 1.0), (5, 3.0), (10, 2.0),
+                                       (40, 8.0), (41, 10.0)])])
+        expected = {
+            "none": [(0, 2.0), (10, 2.0), (40, 9.0)],
+            "previous": [(0, 2.0), (10, 2.0), (20, 2.0), (30, 2.0),
+                         (40, 9.0)],
+            "zero": [(0, 2.0), (10, 2.0), (20, 0.0), (30, 0.0), (40, 9.0)],
+        }
+        for fill, values in expected.items():
+            self.assertEqual(list(r.resample(10, fill).all()), values)
+        linear = [v for _, v in r.resample(10, "linear").all()]
+        for a, b in zip(linear, [2.0, 2.0, 13 / 3.0, 20 / 3.0, 9.0]):
+            self.assertAlmostEqual(a, b, places=5)
+        self.assertEqual(list(r.resample(20, "none", "max").all()),
+                         [(0, 3.0), (40, 10.0)])
+        self.assertEqual(len(ResultSet("a", []).resample(10)), 0)
+        with self.assertRaises(ValueError):
+            r.resample(10, "spline")
+
+        # Tuple types per column, int types stay int
+        t = Item("t", item_type=ItemType.tuple_float_2)
+        t.insert_point(0, (1.0, 2.0))
+        t.insert_point(30, (4.0, 8.0))
+        res = ResultSet("t", [t]).resample(10, "linear")
+        self.assertEqual(res.item_type, ItemType.tuple_float_2)
+        self.assertEqual(list(res.all()), [(0, (1.0, 2.0)), (10, (2.0, 4.0)),
+                                           (20, (3.0, 6.0)),
+                                           (30, (4.0, 8.0))])
+        i = Item("i", [(0, 1), (1, 2), (20, 5)], item_type=ItemType.raw_int)
+        res = ResultSet("i", [i]).resample(10, "previous", "sum")
+        self.assertEqual(list(res.all()), [(0, 3), (10, 3), (20, 5)])
+
+    def test_resample_chunks(self):
+        points = [(ts, float(ts % 7)) for ts in range(0, 1000, 3)
+                  if ts % 100 > 30]
+        whole = ResultSet("a", [Item("a", points)])
+        for fill in RESAMPLE_FILLS:
+            for python in (False, True):
+                resampler = Resampler("a", 20, fill)
+                if python:
+                    from pytsdb import models
+                    resampler._aggregate = models._aggregate_python
+                    resampler._fill = models._fill_python
+                out = []
+                for i in range(0, len(points), 17):
+                    chunk = ResultSet("a", [Item("a", points[i:i + 17])])
+                    out += list(resampler.feed(chunk).all())
+                out += list(resampler.finish().all())
+                expected = list(whole.resample(20, fill).all())
+                self.assertEqual([p[0] for p in out],
+                                 [p[0] for p in expected])
+                for a, b in zip(out, expected):
+                    self.assertAlmostEqual(a[1], b[1], places=4)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow not installed")
+    def test_resultsetexport_arrow(self):
+        i = Item("ex", item_type=ItemType.tuple_float_2)
+        for j in range(4):
+            i.insert_point(j, (j * 2.5, j * 3.0))
+        r = ResultSet("ex", [i])
+        b = r.to_arrow()
+        self.assertEqual(b.num_rows, 4)
+        self.assertEqual(b.schema.names, ["ts", "value_0", "value_1"])
+        self.assertEqual(b.column(2).to_pylist(), [0.0, 3.0, 6.0, 9.0])
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# coding: utf8
+
+import unittest
+import logging
+import threading
+import os
+
+
+from pytsdb import TSDB
+from pytsdb.models import Item
+from pytsdb.storage import MemoryStorage, SQLiteStorage
+from pytsdb.sharding import HashRing, ShardedStorage
+from pytsdb.metrics import MemorySink, Metrics
+from pytsdb.errors import NotFoundError
+
+
+class IntStorage(MemoryStorage):
+    """Range keys are 32 bit integers (like in cassandra).
+    """
+    def query(self, key, range_min, range_max):
+        if range_min < -(2**31) or range_max > 2**31 - 1:
+            raise OverflowError("range key out of range")
+        return super(IntStorage, self).query(key, range_min, range_max)
+
+
+class ShardingTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        for f in ["test_shard1.db3", "test_shard2.db3"]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    @classmethod
+    def tearDownClass(cls):
+        pass
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_hashring(self):
+        keys = ["sensor{}.temp".format(i) for i in range(1000)]
+        ring = HashRing(["a", "b", "c"])
+        self.assertEqual(len(ring), 3)
+        self.assertIn("a", ring)
+        before = dict((k, ring.get(k)) for k in keys)
+        counts = dict((n, list(before.values()).count(n)) for n in "abc")
+        for n in "abc":
+            self.assertGreater(counts[n], 200)
+
+        # A new node only takes keys, roughly 1/4 of them
+        ring.add("d")
+        moved = [k for k in keys if ring.get(k) != before[k]]
+        self.assertTrue(all(ring.get(k) == "d" for k in moved))
+        self.assertGreater(len(moved), 150)
+        self.assertLess(len(moved), 350)
+        with self.assertRaises(ValueError):
+            ring.add("d")
+        ring.remove("d")
+        self.assertEqual(dict((k, ring.get(k)) for k in keys), before)
+        with self.assertRaises(ValueError):
+            HashRing().get("a")
+
+    def test_shardedstorage(self):
+        sqlite = SQLiteStorage("test_shard1.db3")
+        sqlite._createTable()
+        storage = ShardedStorage({"m": IntStorage(), "s": sqlite})
+        keys = ["sensor{}.temp".format(i) for i in range(20)]
+        for i, key in enumerate(keys):
+            storage.insert(Item.new(key, [(1000, float(i))]))
+        sink = MemorySink()
+        storage.insert_bulk([Item.new(key, [(2000, 1.0)]) for key in keys],
+                            Metrics([sink]))
+        self.assertEqual(sink.timers["storage_write"]["count"], 20)
+        self.assertEqual(storage.keys(), sorted(keys))
+        self.assertEqual(sorted(sqlite.keys() + storage.shards["m"].keys()),
+                         sorted(keys))
+        self.assertGreater(len(sqlite.keys()), 0)
+        self.assertEqual(storage.get(keys[3], 1000)[0], (1000, 3.0))
+        self.assertEqual(storage.last(keys[3])[0], (2000, 1.0))
+
+        last = storage.last_bulk(keys + ["unknown"])
+        self.assertEqual([l[0][0] for l in last[:-1]], [2000] * 20)
+        self.assertIsNone(last[-1])
+        res = storage.query_bulk([(k, 0, 1500) for k in keys])
+        self.assertEqual([r[0][0][1] for r in res],
+                         [float(i) for i in range(20)])
+        self.assertEqual([s.count for s in storage.stats_bulk(keys)],
+                         [2] * 20)
+
+        # Add a shard, keys are served by their old shard until moved
+        new = MemoryStorage()
+        pending = storage.add_shard("n", new)
+        self.assertGreater(pending, 0)
+        self.assertEqual(storage.pending, pending)
+        self.assertEqual(len(new.keys()), 0)
+        self.assertEqual(storage.last_bulk(keys)[0][0][0], 2000)
+        # Multi key operations of pending keys wait for moves
+        moving = [k for k in keys if k in storage._pending]
+        t = threading.Thread(target=lambda: storage.last_bulk(moving))
+        with storage._lock:
+            t.start()
+            t.join(0.1)
+            self.assertTrue(t.is_alive())
+        t.join()
+        self.assertEqual(storage.rebalance(limit=1), 1)
+        self.assertEqual(storage.rebalance(), pending - 1)
+        self.assertEqual(storage.pending, 0)
+        self.assertEqual(len(new.keys()), pending)
+        self.assertEqual(len(storage.keys()), 20)
+        for key in new.keys():
+            self.assertEqual(storage.shard(key), "n")
+            with self.assertRaises(NotFoundError):
+                storage.shards["m"].first(key)
+            with self.assertRaises(NotFoundError):
+                sqlite.first(key)
+        res = storage.query_bulk([(k, 0, 3000) for k in keys])
+        self.assertEqual([len(r) for r in res], [2] * 20)
+        storage.close()
+
+    def test_shardeddb(self):
+        with self.assertRaises(ValueError):
+            TSDB(STORAGE="sharded", ENABLE_CACHING=False,
+                 ENABLE_EVENTS=False)
+        shards = {
+            "s1": {"STORAGE": "sqlite", "SQLITE_FILE": "test_shard1.db3"},
+            "s2": {"STORAGE": "sqlite", "SQLITE_FILE": "test_shard2.db3"},
+        }
+        d = TSDB(STORAGE="sharded", SHARDS=shards, ENABLE_CACHING=False,
+                 ENABLE_EVENTS=False)
+        for s in d.storage.shards.values():
+            s._createTable()
+        for i in range(10):
+            d.insert("sensor{}.temp".format(i), [(10, 1.0), (20, float(i))])
+        for i in range(10):
+            res = d.query("sensor{}.temp".format(i), 0, 100)
+            self.assertEqual(list(res.all()), [(10, 1.0), (20, float(i))])
+        counts = [len(s.keys()) for s in d.storage.shards.values()]
+        self.assertEqual(sum(counts), 10)
+        self.assertNotIn(0, counts)
+        d.close()
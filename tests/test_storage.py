@@ -4,11 +4,14 @@
 import unittest
 import logging
 import os
+import threading
 
 
 from pytsdb.models import Item, BucketType
 from pytsdb.storage import MemoryStorage, RedisStorage, CassandraStorage, SQLiteStorage
+from pytsdb.storage import MMapStorage
 from pytsdb.errors import NotFoundError
+from pytsdb.testing import FakeCassandraSession, FakeInvalidRequest
 
 
 class StorageTest(unittest.TestCase):
@@ -31,6 +34,7 @@ class StorageTest(unittest.TestCase):
         storage._dropTable()
         storage._createTable()
         self.assertTrue(storage)
+        self.assertTrue(storage.ping())
 
         with self.assertRaises(NotFoundError):
             storage.get(key="test.ph", range_key=1000)
@@ -105,6 +109,11 @@ class StorageTest(unittest.TestCase):
         self.assertEqual(s["ts_max"], 2000)
         self.assertEqual(s["count"], 4)
 
+        storage.close()
+        # Reconnects on demand
+        d = storage.last(key="test.ph")
+        self.assertEqual(d[0], (2000, 4.0))
+
     def test_cassandrastore(self):
         cassandra_host = os.getenv('CASSANDRA_HOST', 'localhost')
         cassandra_port = os.getenv('CASSANDRA_PORT', 9042)
@@ -265,6 +274,23 @@ class StorageTest(unittest.TestCase):
         self.assertEqual(s["ts_max"], 2000)
         self.assertEqual(s["count"], 4)
 
+    def test_memoryrangekeys(self):
+        storage = MemoryStorage()
+        for r in [3000, 1000, 2000]:
+            storage.insert(Item.new("test.rk", [(r, 1.0)]))
+        self.assertEqual(list(storage.range_keys["test.rk"]),
+                         [1000, 2000, 3000])
+        ds = storage.query(key="test.rk", range_min=2000, range_max=2500)
+        self.assertEqual(len(ds), 1)
+        self.assertEqual(ds[0][0], (2000, 1.0))
+        ds = storage.query(key="test.rk", range_min=3500, range_max=4000)
+        self.assertEqual(len(ds), 1)
+        self.assertEqual(ds[0][0], (3000, 1.0))
+        # Reading unknown keys does not create them
+        with self.assertRaises(NotFoundError):
+            storage.last(key="test.unknown")
+        self.assertNotIn("test.unknown", storage.cache)
+
     def test_memorystore(self):
         storage = MemoryStorage()
         self.assertTrue(storage)
@@ -341,3 +367,296 @@ class StorageTest(unittest.TestCase):
         self.assertEqual(s["ts_min"], 1000)
         self.assertEqual(s["ts_max"], 2000)
         self.assertEqual(s["count"], 4)
+
+    def test_mmapstore(self):
+        storage = MMapStorage("test_mmap")
+        storage._dropTable()
+        storage._createTable()
+        self.assertTrue(storage)
+        self.assertTrue(storage.ping())
+
+        with self.assertRaises(NotFoundError):
+            storage.get(key="test.ph", range_key=1000)
+        
+        with self.assertRaises(NotFoundError):
+            storage.last(key="test.ph")
+
+        i = Item.new("test.ph", [(1000, 1.0)])
+        storage.insert(i)
+        i = Item.new("test.ph", [(2000, 4.0)])
+        storage.insert(i)
+        i = Item.new("test.ph", [(1100, 2.0)])
+        storage.insert(i)
+        i = Item.new("test.ph", [(1200, 3.0)])
+        storage.insert(i)
+
+        d = storage.get(key="test.ph", range_key=1000)
+        self.assertEqual(d[0], (1000, 1.0))
+        d = storage.get(key="test.ph", range_key=1100)
+        self.assertEqual(d[0], (1100, 2.0))
+        d = storage.get(key="test.ph", range_key=1200)
+        self.assertEqual(d[0], (1200, 3.0))
+        d = storage.get(key="test.ph", range_key=2000)
+        self.assertEqual(d[0], (2000, 4.0))
+
+        ds = storage.query(key="test.ph", range_min=1000, range_max=1000)
+        self.assertEqual(len(ds), 1)
+        self.assertEqual(ds[0][0], (1000, 1.0))
+
+        ds = storage.query(key="test.ph", range_min=-1000, range_max=1000)
+        self.assertEqual(len(ds), 1)
+        self.assertEqual(ds[0][0], (1000, 1.0))
+
+        ds = storage.query(key="test.ph", range_min=-999, range_max=999)
+        self.assertEqual(len(ds), 0)
+
+        ds = storage.query(key="test.ph", range_min=1000, range_max=1200)
+        self.assertEqual(len(ds), 3)
+        self.assertEqual(ds[0][0], (1000, 1.0))
+        self.assertEqual(ds[1][0], (1100, 2.0))
+        self.assertEqual(ds[2][0], (1200, 3.0))
+
+        ds = storage.query(key="test.ph", range_min=99, range_max=1350)
+        self.assertEqual(len(ds), 3)
+        self.assertEqual(ds[0][0], (1000, 1.0))
+        self.assertEqual(ds[1][0], (1100, 2.0))
+        self.assertEqual(ds[2][0], (1200, 3.0))
+
+        ds = storage.query(key="test.ph", range_min=1101, range_max=1200)
+        self.assertEqual(len(ds), 2)
+        self.assertEqual(ds[0][0], (1100, 2.0))
+        self.assertEqual(ds[1][0], (1200, 3.0))
+
+        ds = storage.query(key="test.ph", range_min=99, range_max=999999)
+        self.assertEqual(len(ds), 4)
+        self.assertEqual(ds[0][0], (1000, 1.0))
+        self.assertEqual(ds[1][0], (1100, 2.0))
+        self.assertEqual(ds[2][0], (1200, 3.0))
+        self.assertEqual(ds[3][0], (2000, 4.0))
+
+        d = storage.last(key="test.ph")
+        self.assertEqual(d[0], (2000, 4.0))
+
+        d = storage.first(key="test.ph")
+        self.assertEqual(d[0], (1000, 1.0))
+
+        d = storage.left(key="test.ph", range_key=1050)
+        self.assertEqual(d[0], (1000, 1.0))
+
+        s = storage.stats(key="test.ph")
+        self.assertEqual(s["ts_min"], 1000)
+        self.assertEqual(s["ts_max"], 2000)
+        self.assertEqual(s["count"], 4)
+
+        # Reopen from disk
+        storage.close()
+        storage = MMapStorage("test_mmap")
+        ds = storage.query(key="test.ph", range_min=99, range_max=999999)
+        self.assertEqual(len(ds), 4)
+        self.assertEqual(ds[3][0], (2000, 4.0))
+        storage._dropTable()
+        os.rmdir("test_mmap")
+
+    def test_mmapcompaction(self):
+        storage = MMapStorage("test_mmap")
+        storage._dropTable()
+        storage._createTable()
+        for r in range(10):
+            storage.insert(Item.new("test.c", [(r * 10, 1.0)]))
+        for v in range(2, 6):
+            for r in range(10):
+                i = Item.new("test.c", [(r * 10 + x, float(v))
+                                        for x in range(v)])
+                storage.update(i)
+        s = storage._get_series("test.c")
+        self.assertGreater(s.dead, 0)
+        size = os.path.getsize(s.data_path)
+
+        storage.compact()
+        s = storage._get_series("test.c")
+        self.assertEqual(s.dead, 0)
+        self.assertLessEqual(os.path.getsize(s.data_path), size)
+        ds = storage.query(key="test.c", range_min=0, range_max=100)
+        self.assertEqual(len(ds), 10)
+        for i in ds:
+            self.assertEqual(len(i), 5)
+            self.assertEqual(i[4][1], 5.0)
+
+        # Keys which are no valid file names
+        storage.insert(Item("Test/Ü", [(1, 1.0)]))
+        storage._insert("Test/Ü", 5, Item("Test/Ü", [(5, 2.0)]).to_string())
+        storage._update("Test/Ü", 5, Item("Test/Ü", [(5, 3.0)]).to_string())
+        storage.compact()
+        self.assertEqual(storage.last("Test/Ü")[0], (5, 3.0))
+        storage._dropTable()
+        os.rmdir("test_mmap")
+
+    def test_mmapconcurrent(self):
+        storage = MMapStorage("test_mmap")
+        storage._dropTable()
+        storage._createTable()
+        # Compact on every update
+        storage.COMPACT_MIN_DEAD = 0
+        for r in range(20):
+            storage.insert(Item.new("test.c", [(r * 10, float(r * 10))]))
+        stop = threading.Event()
+        errors = []
+
+        def write():
+            n = 0
+            while not stop.is_set():
+                r = (n % 20) * 10
+                storage.delete_range("test.c", r, r + 30)
+                for x in range(r, min(r + 40, 200), 10):
+                    storage.insert(Item.new("test.c", [(x, float(x))]))
+                storage.update(Item.new("test.c", [(r, float(r)),
+                                                   (r + 1, float(r))]))
+                n += 1
+        t = threading.Thread(target=write)
+        t.start()
+        try:
+            for _ in range(300):
+                try:
+                    for i in storage.query("test.c", 0, 200):
+                        self.assertEqual(i[0], (i.range_key,
+                                                float(i.range_key)))
+                except NotFoundError:
+                    pass
+                except Exception as e:
+                    errors.append(e)
+        finally:
+            stop.set()
+            t.join()
+        self.assertEqual(errors, [])
+        storage._dropTable()
+        os.rmdir("test_mmap")
+
+
+    def test_sqliteconcurrent(self):
+        storage = SQLiteStorage("test.db3")
+        storage._dropTable()
+        storage._createTable()
+        storage.insert(Item.new("test.c", [(10, 1.0)]))
+        reads = [lambda: storage.first("test.c"),
+                 lambda: storage.last("test.c"),
+                 lambda: storage.left("test.c", 20),
+                 lambda: storage.get("test.c", 10),
+                 lambda: storage.query("test.c", 20, 30),
+                 lambda: storage.keys()]
+        for read in reads:
+            # Reads on the shared connection wait for writes
+            t = threading.Thread(target=read)
+            with storage._lock:
+                t.start()
+                t.join(0.1)
+                self.assertTrue(t.is_alive())
+            t.join()
+        storage._dropTable()
+
+    def test_delete(self):
+        redis_host = os.getenv('REDIS_HOST', 'localhost')
+        redis_port = os.getenv('REDIS_PORT', 6379)
+        sqlite = SQLiteStorage("test.db3")
+        sqlite._dropTable()
+        sqlite._createTable()
+        mmap = MMapStorage("test_mmap")
+        mmap._dropTable()
+        mmap._createTable()
+        r = RedisStorage(host=redis_host, port=redis_port, db=0, expire=5)
+        r.redis.delete("test.del")
+        for storage in [MemoryStorage(), sqlite, mmap, r]:
+            for rk in [1000, 2000, 3000]:
+                storage.insert(Item.new("test.del", [(rk, 1.0)]))
+            storage.delete("test.del", 2000)
+            with self.assertRaises(NotFoundError):
+                storage.get(key="test.del", range_key=2000)
+            ds = storage.query(key="test.del", range_min=0, range_max=5000)
+            self.assertEqual([i[0][0] for i in ds], [1000, 3000])
+            storage.delete("test.del", 3000)
+            self.assertEqual(storage.last("test.del")[0][0], 1000)
+            for rk in [2000, 3000, 4000, 5000]:
+                storage.insert(Item.new("test.del", [(rk, 1.0)]))
+            self.assertEqual(storage.sizes("test.del", 1500, 4000),
+                             [1, 1, 1, 1])
+            storage.delete_range("test.del", 1500, 4000)
+            ds = storage.query(key="test.del", range_min=0, range_max=9000)
+            self.assertEqual([i[0][0] for i in ds], [1000, 5000])
+            storage.delete_range("test.del", 6000, 7000)
+            storage.delete_range("test.unknown", 0, 7000)
+            storage.delete_range("test.del", 1000, 1000)
+            self.assertEqual(storage.first("test.del")[0][0], 5000)
+        s = mmap._get_series("test.del")
+        self.assertGreater(s.dead, 0)
+        # Deletes survive a reopen of the index
+        mmap = MMapStorage("test_mmap")
+        self.assertEqual(len(mmap.query("test.del", 0, 9000)), 1)
+        mmap._dropTable()
+        os.rmdir("test_mmap")
+        r.redis.delete("test.del")
+
+    def test_cassandrapartitioned(self):
+        session = FakeCassandraSession()
+        flat = CassandraStorage(session=session)
+        flat._createTable()
+        storage = CassandraStorage(partition="month", session=session)
+        storage._createTable()
+        with self.assertRaises(ValueError):
+            CassandraStorage(partition="day", session=session)
+        self.assertNotEqual(flat.namespace, storage.namespace)
+
+        # 2016-01-01, 2016-02-01, 2016-03-01, 2016-05-01
+        jan, feb, mar, may = 1451606400, 1454284800, 1456790400, 1462060800
+        rks = [jan, jan + 100, feb - 1, feb, feb + 100, mar + 100, may]
+        for rk in rks:
+            flat.insert(Item.new("test.part", [(rk, float(rk))]))
+        flat.insert(Item.new("test.other", [(jan, 1.0)]))
+        stats = storage.migrate(flat)
+        self.assertEqual(stats, {"keys": 2, "buckets": 8})
+        self.assertEqual(sorted(storage.keys()), ["test.other", "test.part"])
+        self.assertEqual(storage._periods("test.part"),
+                         [2016 * 12, 2016 * 12 + 1, 2016 * 12 + 2,
+                          2016 * 12 + 4])
+        # Every partition holds one month
+        t = session.tables[storage.table_name]
+        self.assertEqual(len(t["rows"]), 5)
+
+        self.assertEqual(storage.get("test.part", feb)[0][0], feb)
+        with self.assertRaises(NotFoundError):
+            storage.get("test.part", feb + 1)
+        self.assertEqual(storage.first("test.part").range_key, jan)
+        self.assertEqual(storage.last("test.part").range_key, may)
+        self.assertEqual(storage.left("test.part", mar).range_key, feb + 100)
+        self.assertEqual(storage.left("test.part", may - 1).range_key,
+                         mar + 100)
+        self.assertEqual(storage.count("test.part"), 7)
+
+        # Queries only read the partitions of their range
+        del session.partitions_read[:]
+        ds = storage.query("test.part", feb + 50, mar + 200)
+        self.assertEqual([i.range_key for i in ds], [feb, feb + 100, mar + 100])
+        read = [p for p in session.partitions_read
+                if p[0] == storage.table_name]
+        self.assertNotIn((storage.table_name, ("test.part", 2016 * 12 + 4)),
+                         read)
+        ds = storage.query("test.part", 0, 2 ** 31 - 1)
+        self.assertEqual([i.range_key for i in ds], rks)
+        self.assertEqual(storage.query_ranges("test.part",
+                                              [(jan, feb - 1), (feb, may)]),
+                         ds)
+
+        # Empty partitions are skipped
+        storage.delete_range("test.part", jan, feb + 100)
+        self.assertEqual(storage.first("test.part").range_key, mar + 100)
+        storage.delete("test.part", may)
+        self.assertEqual(storage.last("test.part").range_key, mar + 100)
+        self.assertEqual(storage.count("test.part"), 1)
+        storage.delete("test.other", jan)
+        self.assertEqual(storage.keys(), ["test.part"])
+
+        # The session enforces the partition key
+        with self.assertRaises(FakeInvalidRequest):
+            session.execute("SELECT key, range_key, data FROM {} "
+                            "WHERE key = %s".format(storage.table_name),
+                            ("test.part", ))
+        storage.close()
+        flat.close()